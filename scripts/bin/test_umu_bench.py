@@ -0,0 +1,43 @@
+import unittest
+from argparse import Namespace
+import sys
+
+# Add the bin directory to path so we can import umu_bench
+sys.path.append('/home/mw/git/conf/scripts/bin')
+import umu_bench
+
+
+class TestUmuBench(unittest.TestCase):
+
+    def test_compare_results_flags_regressions(self):
+        old = {"results": {"pstree": {"median": 0.100}, "fetch": {"median": 1.0},
+                           "patch": {"skipped": "needs pyzstd"}}}
+        new = {"results": {"pstree": {"median": 0.105}, "fetch": {"median": 1.5},
+                           "patch": {"median": 0.2}, "launch": {"median": 0.4}}}
+        rows = {name: regressed for name, _, _, _, regressed in umu_bench.compare_results(old, new)}
+        self.assertEqual(rows, {"pstree": False, "fetch": True})
+        rows = {name: regressed for name, _, _, _, regressed in umu_bench.compare_results(old, new, 0.6)}
+        self.assertEqual(rows, {"pstree": False, "fetch": False})
+
+    def test_run_benchmarks(self):
+        args = Namespace(repeat=1, size=1, procs=50)
+        results = umu_bench.run_benchmarks(["pstree", "extract"], args)
+        self.assertTrue(results["umu"])
+        pstree = results["results"]["pstree"]
+        self.assertNotIn("error", pstree)
+        self.assertEqual(pstree["procs"], 50)
+        extract = results["results"]["extract"]
+        self.assertGreater(extract["xz"]["mb_s"], 0)
+        self.assertGreater(extract["gz"]["median"], 0)
+
+    def test_backends_benchmark(self):
+        args = Namespace(repeat=1, size=1, procs=50)
+        backends = umu_bench.run_benchmarks(["backends"], args)["results"]["backends"]
+        self.assertNotIn("error", backends)
+        # umu's own extractor always runs, external ones where installed
+        self.assertEqual(backends["median"], backends["backends"]["xz/tarfile"]["median"])
+        self.assertIn("gz/tarfile", backends["backends"])
+
+
+if __name__ == '__main__':
+    unittest.main()
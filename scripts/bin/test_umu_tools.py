@@ -0,0 +1,719 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import errno
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+# Add the bin directory to path so we can import umu_tools
+sys.path.append('/home/mw/git/conf/scripts/bin')
+import umu_tools
+
+
+def make_proc(root, procs):
+    """Builds a fake /proc from {pid: (ppid, comm, [mapped paths])}."""
+    for pid, (ppid, comm, maps) in procs.items():
+        d = Path(root, str(pid))
+        d.mkdir()
+        Path(d, "stat").write_text(f"{pid} ({comm}) S {ppid} {pid} {pid} 0 -1\n")
+        lines = [f"7f00-7f01 r-xp 00000000 08:01 {i} {p}\n" for i, p in enumerate(maps, 1)]
+        lines.append("7ffd-7ffe rw-p 00000000 00:00 0 [stack]\n")
+        Path(d, "maps").write_text("".join(lines))
+
+
+class TestUmuTools(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.proc = Path(self.tmp, "proc")
+        self.proc.mkdir()
+        self.home = Path(self.tmp, "home")
+        patcher = patch.object(umu_tools, 'TOOLS_HOME', self.home)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_get_pstree_from_pid(self):
+        make_proc(self.proc, {
+            1: (0, "init", []),
+            10: (1, "umu-run", []),
+            11: (10, "pv-adverb", []),
+            12: (11, "game (x).exe", []),
+            20: (1, "unrelated", []),
+        })
+        self.assertEqual(umu_tools.get_pstree_from_pid(10, self.proc), {11, 12})
+        self.assertEqual(umu_tools.get_pstree_from_pid(12, self.proc), set())
+
+    def test_prefetch_recorder_keeps_game_files(self):
+        game = Path(self.tmp, "game")
+        game.mkdir()
+        exe = Path(game, "game.exe")
+        dll = Path(game, "engine.dll")
+        exe.write_bytes(b"MZ")
+        dll.write_bytes(b"MZ")
+        make_proc(self.proc, {
+            100: (1, "game.exe", [str(exe), "/usr/lib/libc.so.6", str(exe)]),
+            101: (100, "helper", [str(dll), str(Path(game, "gone.dll")) + " (deleted)"]),
+        })
+
+        recorder = umu_tools.PrefetchRecorder([str(game)], proc=self.proc)
+        recorder.sample([100, 101])
+        self.assertEqual(recorder.files, [str(exe), str(dll)])
+
+        saved = umu_tools.save_prefetch_list("umu-1234", recorder.files)
+        self.assertEqual(saved, [str(exe), str(dll)])
+
+        # A later launch appends new files and drops ones that disappeared
+        other = Path(game, "other.dll")
+        other.write_bytes(b"MZ")
+        dll.unlink()
+        saved = umu_tools.save_prefetch_list("umu-1234", [str(other), str(exe)])
+        self.assertEqual(saved, [str(exe), str(other)])
+        self.assertEqual(umu_tools.load_prefetch_list("umu-1234"), saved)
+
+    def test_prefetch_files(self):
+        paths = []
+        for i in range(3):
+            p = Path(self.tmp, f"f{i}")
+            p.write_bytes(b"x" * 4096)
+            paths.append(str(p))
+        paths.append(str(Path(self.tmp, "missing")))
+        self.assertEqual(umu_tools.prefetch_files(paths), 3)
+        self.assertEqual(umu_tools.prefetch_files([]), 0)
+
+    def test_load_sched_policy(self):
+        self.assertIsNone(umu_tools.load_sched_policy({}, {}))
+        self.assertEqual(umu_tools.parse_cpu_list("0-2, 5"), {0, 1, 2, 5})
+        self.assertEqual(umu_tools.parse_ioprio("idle"), (3, 4))
+        with self.assertRaises(ValueError):
+            umu_tools.parse_ioprio("best")
+
+        toml = {"sched": {"affinity": "2-3", "nice": 5, "cgroup": True, "cpu_weight": 500}}
+        env = {"UMU_SCHED_NICE": "-2", "UMU_SCHED_IOPRIO": "be:0"}
+        policy = umu_tools.load_sched_policy(env, toml)
+        self.assertEqual(policy["affinity"], {2, 3})
+        self.assertEqual(policy["nice"], -2)
+        self.assertEqual(policy["ioprio"], (2, 0))
+        self.assertTrue(policy["cgroup"])
+        self.assertEqual(policy["cpu_weight"], 500)
+        self.assertIsNone(policy["io_weight"])
+
+    def test_sched_policy_applies_to_children(self):
+        import subprocess
+        cpu = min(os.sched_getaffinity(0))
+        child = subprocess.Popen(["sleep", "5"])
+        try:
+            sched = umu_tools.SchedPolicy({"affinity": {cpu}, "nice": 7}, "umu-1234")
+            sched.sample([child.pid])
+            self.assertEqual(os.sched_getaffinity(child.pid), {cpu})
+            self.assertEqual(os.getpriority(os.PRIO_PROCESS, child.pid), 7)
+            self.assertIn(child.pid, sched.applied)
+        finally:
+            child.kill()
+            child.wait()
+
+    def test_sched_cgroup_keeps_working_knobs(self):
+        own = Path(self.tmp, "cgroup", "user.slice", "session.scope")
+        own.mkdir(parents=True)
+        group = own.parent / f"umu-umu-1234.{os.getpid()}"
+        # No io controller delegated: io.weight can't be written
+        Path(group, "io.weight").mkdir(parents=True)
+        with patch.object(umu_tools, 'get_cgroup_root', return_value=own):
+            sched = umu_tools.SchedPolicy({"cgroup": True, "cpu_weight": 500, "io_weight": 200}, "umu-1234")
+        self.assertEqual(sched.cgroup, group)
+        self.assertEqual(Path(group, "cpu.weight").read_text(), "500")
+        self.assertIn("io.weight", sched.warned)
+
+    def test_sched_cgroup_cleanup(self):
+        own = Path(self.tmp, "cgroup", "user.slice", "session.scope")
+        own.mkdir(parents=True)
+        # Left behind by a launch whose umu_tools has exited, and by one still running
+        stale = Path(own.parent, "umu-umu-1.999999")
+        running = Path(own.parent, "umu-umu-2.100")
+        stale.mkdir()
+        running.mkdir()
+        Path(self.proc, "100").mkdir()
+        with patch.object(umu_tools, 'get_cgroup_root', return_value=own):
+            sched = umu_tools.SchedPolicy({"cgroup": True}, "umu-1234", self.proc)
+        self.assertFalse(stale.exists())
+        self.assertTrue(running.is_dir())
+        self.assertTrue(sched.cgroup.is_dir())
+
+        # Busy while the last processes exit, then removed
+        rmdir = Path.rmdir
+        busy = [OSError(errno.EBUSY, "Device or resource busy")] * 2
+
+        def rmdir_when_empty(path):
+            if busy:
+                raise busy.pop()
+            rmdir(path)
+
+        with patch.object(Path, 'rmdir', rmdir_when_empty), patch.object(umu_tools.time, 'sleep'), \
+                patch.object(umu_tools, 'reap_children') as reap:
+            sched.remove_cgroup()
+        self.assertFalse(sched.cgroup.exists())
+        self.assertEqual(reap.call_count, 2)
+
+    def test_session_accounting(self):
+        ticks = os.sysconf("SC_CLK_TCK")
+        for pid, (utime, rss, hwm, read) in {200: (ticks * 2, 1000, 1500, 4096),
+                                             201: (ticks, 500, 600, 0)}.items():
+            d = Path(self.proc, str(pid))
+            d.mkdir()
+            # pid (comm) state ppid pgrp session tty tpgid flags minflt cminflt majflt cmajflt utime stime
+            Path(d, "stat").write_text(f"{pid} (wine (x)) S 1 1 1 0 -1 0 10 0 3 0 {utime} {ticks} 0 0\n")
+            Path(d, "status").write_text(f"Name:\twine\nVmHWM:\t{hwm} kB\nVmRSS:\t{rss} kB\n")
+            Path(d, "io").write_text(f"rchar: 1\nread_bytes: {read}\nwrite_bytes: 10\n")
+
+        accounting = umu_tools.SessionAccounting(self.proc)
+        accounting.sample({200, 201, 202})
+        totals = accounting.totals()
+        self.assertEqual(totals["processes_seen"], 2)
+        self.assertEqual(totals["utime"], 3.0)
+        self.assertEqual(totals["stime"], 2.0)
+        self.assertEqual(totals["majflt"], 6)
+        self.assertEqual(totals["peak_tree_rss_kb"], 1500)
+        self.assertEqual(totals["peak_process_rss_kb"], 1500)
+        self.assertEqual(totals["read_bytes"], 4096)
+        self.assertEqual(totals["write_bytes"], 20)
+
+        # A process that exits keeps its last counters
+        shutil.rmtree(Path(self.proc, "201"))
+        accounting.sample({200})
+        self.assertEqual(accounting.totals()["utime"], 3.0)
+
+        umu_tools.write_session_record("umu-1234", {"gameid": "umu-1234", "tree": totals})
+        umu_tools.write_session_record("umu-1234", {"gameid": "umu-1234", "tree": totals})
+        self.assertEqual(len(umu_tools.load_session_records("umu-1234")), 2)
+
+    def test_launch_returns_game_exit_code(self):
+        fake = Path(self.tmp, "umu-run")
+        fake.write_text("#!/bin/sh\n(sleep 0.2; exit 5) &\nsleep 0.1\nexit 3\n")
+        fake.chmod(0o755)
+        env = {"WINEPREFIX": str(Path(self.tmp, "pfx")), "PROTONPATH": str(Path(self.tmp, "proton")),
+               "GAMEID": "umu-1234"}
+        real_pstree = umu_tools.get_pstree_from_pid
+
+        def slow_pstree(pid, proc=umu_tools.PROC):
+            # umu-run exits while the tree is being sampled, before children are reaped
+            time.sleep(0.3)
+            return real_pstree(pid, proc)
+
+        with patch.object(umu_tools, 'UMU_RUN', fake), \
+                patch.object(umu_tools, 'get_pstree_from_pid', slow_pstree), \
+                patch.dict(os.environ, env):
+            for _ in range(3):
+                self.assertEqual(umu_tools.main(["launch", "--no-prefetch", "--no-record", "game.exe"]), 3)
+        record = umu_tools.load_session_records("umu-1234")[-1]
+        self.assertEqual(record["returncode"], 3)
+
+    def test_clone_prefix_from_template(self):
+        proton = Path(self.tmp, "GE-Proton9-20")
+        proton.mkdir()
+        Path(proton, "version").write_text("1700000000 GE-Proton9-20\n")
+
+        # Lay out a template the way create_template leaves it
+        template = umu_tools.template_path(proton) / "prefix"
+        system32 = Path(template, "drive_c", "windows", "system32")
+        system32.mkdir(parents=True)
+        Path(system32, "kernel32.dll").write_bytes(b"MZ" * 100)
+        Path(system32, "kernel32.dll").chmod(0o444)
+        Path(template, "user.reg").write_text("WINE REGISTRY Version 2\n")
+        Path(template, "dosdevices").mkdir()
+        Path(template, "dosdevices", "c:").symlink_to("../drive_c")
+        Path(template, "pfx").symlink_to(template)
+        for directory in (system32, template / "dosdevices"):
+            os.utime(directory, (1600000000, 1600000000))
+        Path(template.parent, "umu-template.json").write_text(
+            '{"proton": "%s", "version": "1700000000 GE-Proton9-20"}' % proton)
+        self.assertEqual(umu_tools.get_template(proton), template)
+
+        prefix = Path(self.tmp, "Games", "umu", "umu-1234")
+        # What umu's setup_pfx leaves before Proton runs still counts as empty
+        Path(prefix, "drive_c", "users", "steamuser").mkdir(parents=True)
+        Path(prefix, "drive_c", "users", "me").symlink_to("steamuser")
+        Path(prefix, "pfx").symlink_to(prefix)
+        Path(prefix, "tracked_files").touch()
+        self.assertTrue(umu_tools.is_empty_prefix(prefix))
+        Path(prefix, "drive_c", "users", "steamuser", "Documents").mkdir()
+        self.assertFalse(umu_tools.is_empty_prefix(prefix))
+        shutil.rmtree(Path(prefix, "drive_c", "users", "steamuser", "Documents"))
+
+        with patch.object(umu_tools, 'UMU_LOCAL', Path(self.tmp, "umu")):
+            stats = umu_tools.clone_prefix(proton, prefix)
+            # A populated prefix is left alone
+            self.assertIsNone(umu_tools.clone_prefix(proton, prefix))
+
+        self.assertEqual(stats["symlinks"], 2)
+        self.assertEqual(stats["reflinked"] + stats["hardlinked"] + stats["copied"], 2)
+        self.assertEqual(os.readlink(Path(prefix, "pfx")), str(prefix))
+        self.assertEqual(os.readlink(Path(prefix, "dosdevices", "c:")), "../drive_c")
+        # Directory mtimes survive the clone
+        self.assertEqual(Path(prefix, "drive_c", "windows", "system32").stat().st_mtime, 1600000000)
+        self.assertEqual(Path(prefix, "dosdevices").stat().st_mtime, 1600000000)
+        self.assertEqual(Path(prefix, "drive_c", "windows", "system32", "kernel32.dll").read_bytes(),
+                         b"MZ" * 100)
+        # Writable files are never shared with the template
+        self.assertNotEqual(Path(prefix, "user.reg").stat().st_ino, Path(template, "user.reg").stat().st_ino)
+
+        # A newer Proton build makes the template stale
+        Path(proton, "version").write_text("1710000000 GE-Proton9-21\n")
+        self.assertIsNone(umu_tools.get_template(proton))
+
+    def make_prefixes(self):
+        """Three synthetic prefixes sharing a read-only DLL and a writable font."""
+        games = Path(self.tmp, "Games", "umu")
+        dll = b"MZ" + b"\x00" * 8190
+        font = b"TTF" * 4000
+        for gameid in ("umu-1", "umu-2", "umu-3"):
+            system32 = Path(games, gameid, "drive_c", "windows", "system32")
+            fonts = Path(games, gameid, "drive_c", "windows", "Fonts")
+            system32.mkdir(parents=True)
+            fonts.mkdir()
+            Path(system32, "d3dx9_43.dll").write_bytes(dll)
+            Path(system32, "d3dx9_43.dll").chmod(0o444)
+            Path(fonts, "arial.ttf").write_bytes(font)
+            # Same size as the DLL, different content
+            Path(system32, f"{gameid}.dll").write_bytes(gameid.encode().ljust(8192, b"x"))
+            Path(games, gameid, "user.reg").write_text("small")
+        return games, len(dll), len(font)
+
+    def test_find_duplicates(self):
+        games, dll_size, font_size = self.make_prefixes()
+        with patch.object(umu_tools, 'UMU_GAMES', games):
+            prefixes = umu_tools.get_known_prefixes()
+        self.assertEqual(len(prefixes), 3)
+
+        groups = umu_tools.find_duplicates(prefixes, min_size=4096)
+        self.assertEqual(sorted(len(g) for g in groups), [3, 3])
+
+        report = umu_tools.dedupe(groups, dry_run=True)
+        self.assertEqual(report["duplicates"], 4)
+        self.assertEqual(report["reclaimable_bytes"], 2 * dll_size + 2 * font_size)
+        self.assertEqual(report["reclaimed_bytes"], 0)
+
+    def test_dedupe_links_duplicates(self):
+        games, dll_size, font_size = self.make_prefixes()
+        prefixes = sorted(games.iterdir())
+        report = umu_tools.dedupe(umu_tools.find_duplicates(prefixes))
+
+        self.assertEqual(report["reflink"] + report["hardlink"] + report["skipped"], 4)
+        dlls = [Path(p, "drive_c", "windows", "system32", "d3dx9_43.dll") for p in prefixes]
+        fonts = [Path(p, "drive_c", "windows", "Fonts", "arial.ttf") for p in prefixes]
+        if report["reflink"] == 0:
+            # Without reflinks only the read-only DLLs may share an inode
+            self.assertEqual(len({p.stat().st_ino for p in dlls}), 1)
+            self.assertEqual(len({p.stat().st_ino for p in fonts}), 3)
+            self.assertEqual(report["reclaimed_bytes"], 2 * dll_size)
+        for p in fonts:
+            self.assertEqual(p.read_bytes(), b"TTF" * 4000)
+
+        # Running again finds nothing new to share among the hardlinked DLLs
+        again = umu_tools.dedupe(umu_tools.find_duplicates(prefixes), dry_run=True)
+        self.assertLessEqual(again["duplicates"], 2)
+
+    def test_dedupe_skips_files_changed_after_hashing(self):
+        games, dll_size, font_size = self.make_prefixes()
+        prefixes = sorted(games.iterdir())
+        groups = umu_tools.find_duplicates(prefixes)
+        # Something rewrites one of the DLLs between the scan and the swap
+        changed = Path(prefixes[2], "drive_c", "windows", "system32", "d3dx9_43.dll")
+        changed.chmod(0o644)
+        changed.write_bytes(b"NEW".ljust(dll_size, b"\x00"))
+        changed.chmod(0o444)
+        report = umu_tools.dedupe(groups)
+        self.assertEqual(changed.read_bytes(), b"NEW".ljust(dll_size, b"\x00"))
+        self.assertGreaterEqual(report["skipped"], 1)
+
+    def test_duplicates_stay_on_one_filesystem(self):
+        games, dll_size, font_size = self.make_prefixes()
+        shutil.copytree(Path(games, "umu-3"), Path(games, "umu-4"))
+        prefixes = sorted(games.iterdir())
+        scan_prefix = umu_tools.scan_prefix
+
+        def scan_on_two_disks(prefix, min_size):
+            # umu-3 and umu-4 live on another disk
+            other = Path(prefix).name in ("umu-3", "umu-4")
+            return [(size, dev + other, *rest) for size, dev, *rest in scan_prefix(prefix, min_size)]
+
+        with patch.object(umu_tools, 'scan_prefix', scan_on_two_disks):
+            groups = umu_tools.find_duplicates(prefixes)
+        # The DLL, the font and umu-3.dll, which umu-4 got a copy of
+        self.assertEqual(sorted(len(g) for g in groups), [2, 2, 2, 2, 2])
+        for group in groups:
+            self.assertEqual(len({stamp[2] for _, _, _, stamp in group}), 1)
+
+    def test_dedupe_keeps_trying_reflinks_after_other_errors(self):
+        games, dll_size, font_size = self.make_prefixes()
+        groups = umu_tools.find_duplicates(sorted(games.iterdir()))
+        calls = []
+
+        def reflink(src, dst):
+            calls.append(dst)
+            if len(calls) == 1:
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            shutil.copyfile(src, dst)
+
+        with patch.object(umu_tools, 'can_reflink', return_value=True), \
+                patch.object(umu_tools, 'reflink', reflink):
+            report = umu_tools.dedupe(groups)
+        # One failed pair doesn't turn reflinks off for the whole filesystem
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(report["reflink"], 3)
+
+    def test_dedupe_reflinks_only_within_a_mount(self):
+        games, dll_size, font_size = self.make_prefixes()
+        groups = umu_tools.find_duplicates(sorted(games.iterdir()))
+        games = os.path.realpath(games)
+        # umu-3 is another btrfs filesystem mounted into the library
+        table = umu_tools.MountTable(
+            "21 1 0:31 / / rw - btrfs /dev/sdb1 rw\n"
+            "40 21 0:32 / %s/umu-3 rw - btrfs /dev/sdc1 rw\n" % games)
+        calls = []
+
+        def reflink(src, dst):
+            calls.append(dst)
+            shutil.copyfile(src, dst)
+
+        with patch.object(umu_tools, '_mount_table', table), patch.object(umu_tools, 'reflink', reflink):
+            report = umu_tools.dedupe(groups)
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(all("/umu-2/" in dst for dst in calls))
+        self.assertEqual(report["reflink"], 2)
+
+    def test_winetricks_missing_verbs(self):
+        pfx = Path(self.tmp, "pfx")
+        pfx.mkdir()
+        self.assertEqual(umu_tools.get_missing_verbs(pfx, ["vcrun2019", "d3dx9"]), ["vcrun2019", "d3dx9"])
+
+        Path(pfx, "winetricks.log").write_text("vcrun2019\nwin10\ncorefonts\n")
+        verbs = ["vcrun2019", "d3dx9", "win10", "fontsmooth=rgb", "d3dx9"]
+        # Settings verbs are always applied again
+        self.assertEqual(umu_tools.get_missing_verbs(pfx, verbs), ["d3dx9", "win10", "fontsmooth=rgb"])
+        # Only known settings: other key=value arguments are checked against the log
+        self.assertTrue(umu_tools.is_settings_verb("csmt=off"))
+        self.assertFalse(umu_tools.is_settings_verb("foo=bar"))
+        Path(pfx, "winetricks.log").write_text("foo=bar\n")
+        self.assertEqual(umu_tools.get_missing_verbs(pfx, ["foo=bar", "csmt=off"]), ["csmt=off"])
+
+    def test_winetricks_batches_prefixes(self):
+        prefixes = []
+        for name in ("a", "b", "c"):
+            pfx = Path(self.tmp, name)
+            pfx.mkdir()
+            prefixes.append(str(pfx))
+        Path(prefixes[0], "winetricks.log").write_text("vcrun2019\nd3dx9\n")
+        Path(prefixes[1], "winetricks.log").write_text("d3dx9\n")
+
+        calls = []
+        with patch.object(umu_tools, 'run_winetricks',
+                          side_effect=lambda p, v, u, l: calls.append((Path(p).name, v)) or 0):
+            args = umu_tools.build_parser().parse_args(
+                ["winetricks", "vcrun2019", "d3dx9", "-j", "2"] + [a for p in prefixes for a in ("-p", p)])
+            self.assertEqual(args.func(args), 0)
+        # One session per prefix that still misses something, with only the missing verbs
+        self.assertEqual(sorted(calls), [("b", ["vcrun2019"]), ("c", ["vcrun2019", "d3dx9"])])
+
+        # Prefixes with the same name still get their own log
+        logs = {umu_tools.winetricks_log_path(Path(self.tmp, lib, "pfx")) for lib in ("one", "two")}
+        self.assertEqual(len(logs), 2)
+        self.assertTrue(all(log.name.startswith("winetricks-pfx-") for log in logs))
+
+    def make_tool(self, parent, name, appid="1628350"):
+        path = Path(parent, name)
+        path.mkdir(parents=True)
+        Path(path, "proton").write_text("#!/usr/bin/env python3\n")
+        Path(path, "version").write_text(f"1700000000 {name}\n")
+        Path(path, "toolmanifest.vdf").write_text(
+            '"manifest"\n{\n  "require_tool_appid" "%s"\n}\n' % appid)
+        return path
+
+    def test_catalog(self):
+        data = Path(self.tmp, "data")
+        steam_compat = Path(data, "Steam", "compatibilitytools.d")
+        umu_local = Path(data, "umu")
+        with patch.object(umu_tools, 'STEAM_COMPAT', steam_compat), \
+                patch.object(umu_tools, 'UMU_LOCAL', umu_local), \
+                patch.object(umu_tools, 'UMU_COMPAT', Path(umu_local, "compatibilitytools")):
+            self.make_tool(steam_compat, "GE-Proton9-2")
+            newest = self.make_tool(steam_compat, "GE-Proton9-10")
+            self.make_tool(steam_compat, "UMU-Proton-9.0-3.2", appid="1391110")
+            Path(umu_local, "steamrt3", "sniper_platform_0.20240916.101795").mkdir(parents=True)
+
+            catalog = umu_tools.load_catalog()
+            self.assertEqual(len(catalog["tools"]), 4)
+            self.assertEqual(umu_tools.parse_tool_version("UMU-Proton-9.0-3.2"), ("UMU-Proton", (9, 0, 3, 2)))
+            # Natural version order, not string order
+            self.assertEqual(umu_tools.find_tool(catalog, "GE-Proton")["path"], str(newest))
+            self.assertEqual(umu_tools.resolve_proton("GE-Proton", catalog), str(newest))
+            self.assertEqual(umu_tools.resolve_proton("GE-Proton9-2", catalog), str(Path(steam_compat, "GE-Proton9-2")))
+            self.assertEqual(umu_tools.find_tool(catalog, "UMU-Proton")["runtime"], "steamrt2")
+            self.assertEqual(catalog["tools"][str(Path(umu_local, "steamrt3"))]["platforms"],
+                             ["sniper_platform_0.20240916.101795"])
+
+            # Unchanged directories are not listed again
+            with patch.object(umu_tools, 'read_tool_entry', side_effect=AssertionError):
+                umu_tools.load_catalog()
+
+            umu_tools.mark_tool_used(catalog, str(newest))
+            shutil.rmtree(Path(steam_compat, "GE-Proton9-2"))
+            catalog = umu_tools.load_catalog()
+            self.assertEqual(len(catalog["tools"]), 3)
+            self.assertGreater(catalog["tools"][str(newest)]["last_used"], 0)
+            self.assertGreater(catalog["tools"][str(Path(umu_local, "steamrt3"))]["last_used"], 0)
+
+    def test_mount_table(self):
+        mountinfo = (
+            "21 1 0:20 / / rw,relatime shared:1 - ext4 /dev/sda2 rw\n"
+            "30 21 0:31 / /home rw,relatime shared:2 - btrfs /dev/sdb1 rw,subvol=/home\n"
+            "31 30 0:31 /games /home/me/Games rw,relatime shared:2 - btrfs /dev/sdb1 rw\n"
+            "40 21 8:33 / /run/media/me/USB\\040STICK rw,nosuid master:5 - vfat /dev/sdc1 rw\n"
+            "41 21 0:40 / /tmp rw - tmpfs tmpfs rw,size=8G\n"
+            "42 21 0:41 / /tmp rw - tmpfs tmpfs rw,size=1G\n"
+        )
+        table = umu_tools.MountTable(mountinfo)
+        self.assertEqual(table.lookup("/home/me/Games/umu/umu-1/drive_c").mount_point, "/home/me/Games")
+        self.assertEqual(table.lookup("/home/me/Games").root, "/games")
+        self.assertEqual(table.lookup("/home/me/.local/share").fstype, "btrfs")
+        self.assertEqual(table.lookup("/usr/bin/env").fstype, "ext4")
+        self.assertEqual(table.lookup("/run/media/me/USB STICK/x").fstype, "vfat")
+        # The last mount on a point wins
+        self.assertIn("size=1G", table.lookup("/tmp/x").super_options)
+
+        # Bind mounts of one btrfs filesystem can share extents
+        self.assertTrue(umu_tools.can_reflink("/home/me/Games/a", "/home/me/b", table))
+        self.assertFalse(umu_tools.can_reflink("/home/me/a", "/tmp/b", table))
+        self.assertFalse(umu_tools.can_reflink("/usr/a", "/usr/b", table))
+
+        # A library linked in from another disk is on that disk
+        library = Path(self.tmp, "SteamLibrary")
+        library.symlink_to("/run/media/me/USB STICK/SteamLibrary")
+        self.assertEqual(table.lookup(library / "steamapps" / "common").fstype, "vfat")
+        Path(self.tmp, "games").symlink_to("/home/me/Games")
+        self.assertTrue(umu_tools.can_reflink(Path(self.tmp, "games", "a"), "/home/me/b", table))
+
+    def test_gc(self):
+        data = Path(self.tmp, "data")
+        steam_compat = Path(data, "Steam", "compatibilitytools.d")
+        umu_local = Path(data, "umu")
+        with patch.object(umu_tools, 'STEAM_COMPAT', steam_compat), \
+                patch.object(umu_tools, 'UMU_LOCAL', umu_local), \
+                patch.object(umu_tools, 'UMU_COMPAT', Path(umu_local, "compatibilitytools")), \
+                patch.object(umu_tools, 'UMU_CONFIG_DIR', Path(self.tmp, "config")):
+            for i in range(1, 6):
+                self.make_tool(steam_compat, f"GE-Proton9-{i}")
+            self.make_tool(steam_compat, "UMU-Proton-9.0-3.2", appid="1391110")
+            Path(umu_local, "steamrt2", "soldier_platform_0.1").mkdir(parents=True)
+            Path(umu_local, "steamrt3", "sniper_platform_0.1").mkdir(parents=True)
+            Path(umu_local, "steamrt3", "sniper_platform_0.2").mkdir(parents=True)
+            Path(umu_local, "steamrt4").mkdir(parents=True)
+
+            catalog = umu_tools.load_catalog()
+            for i, name in ((1, "GE-Proton9-1"), (2, "GE-Proton9-2")):
+                catalog["tools"][str(Path(steam_compat, name))]["last_used"] = 2000000000 + i
+            umu_tools.save_catalog(catalog)
+
+            config = Path(self.tmp, "game.toml")
+            config.write_text('[umu]\nproton = "%s"\n' % Path(steam_compat, "GE-Proton9-3"))
+
+            # The Steam client may use builds umu_tools never launched
+            plan, freed = umu_tools.run_gc(keep=2, config_paths=[str(config)], dry_run=True)
+            self.assertEqual(sorted(Path(p).name for p, _ in plan), ["sniper_platform_0.1", "steamrt4"])
+
+            plan, freed = umu_tools.run_gc(keep=2, config_paths=[str(config)], dry_run=True, unrecorded=True)
+            removed = sorted(Path(p).name for p, _ in plan)
+            # Kept: 9-1 and 9-2 (recently used), 9-3 (config), 9-5 (newest),
+            # UMU-Proton and steamrt2 it requires, steamrt3 as umu's default
+            self.assertEqual(removed, ["GE-Proton9-4", "sniper_platform_0.1", "steamrt4"])
+            self.assertTrue(Path(steam_compat, "GE-Proton9-4").is_dir())
+
+            # A launch keeps its own build and config even before umu-run starts Proton
+            ge4 = str(Path(steam_compat, "GE-Proton9-4"))
+            launch_config = Path(self.tmp, "launch.toml")
+            launch_config.write_text('[umu]\nproton = "%s"\nexe = "game.exe"\n' % ge4)
+            fake = Path(self.tmp, "umu-run")
+            fake.write_text("#!/bin/sh\nexit 0\n")
+            fake.chmod(0o755)
+            calls = []
+
+            def gc_at_launch(**kwargs):
+                calls.append(kwargs)
+                catalog = umu_tools.load_catalog()
+                plan = umu_tools.plan_gc(catalog, 2, set(kwargs["referenced"]) |
+                                         umu_tools.get_referenced_protons(catalog, kwargs["config_paths"]),
+                                         unrecorded=True)
+                self.assertNotIn(ge4, [p for p, _ in plan])
+                # Marked as used before gc looks at the catalog
+                self.assertGreater(catalog["tools"][ge4]["last_used"], 0)
+
+            with patch.object(umu_tools, 'UMU_RUN', fake), \
+                    patch.object(umu_tools, 'start_background_gc', gc_at_launch), \
+                    patch.dict(os.environ, {"GAMEID": "umu-1234", "WINEPREFIX": str(Path(self.tmp, "pfx"))}):
+                self.assertEqual(umu_tools.main(["launch", "--gc", "--no-prefetch", "--no-record",
+                                                 "--no-session", "--config", str(launch_config)]), 0)
+            self.assertEqual(calls[0]["referenced"], [ge4])
+            self.assertEqual(calls[0]["config_paths"], [launch_config])
+            catalog = umu_tools.load_catalog()
+            # Forget the launch for the rest of the test
+            catalog["tools"][ge4]["last_used"] = 0
+            catalog["configs"].remove(str(launch_config.resolve()))
+            umu_tools.save_catalog(catalog)
+
+            self.assertEqual(umu_tools.main(["gc", "-c", str(config)]), 0)
+            self.assertTrue(Path(steam_compat, "GE-Proton9-4").is_dir())
+            self.assertEqual(umu_tools.main(["gc", "--unrecorded", "-c", str(config)]), 0)
+            self.assertFalse(Path(steam_compat, "GE-Proton9-4").exists())
+            self.assertFalse(Path(umu_local, "steamrt3", "sniper_platform_0.1").exists())
+            self.assertTrue(Path(umu_local, "steamrt3", "sniper_platform_0.2").is_dir())
+            self.assertEqual(list(steam_compat.glob(".umu-gc-*")), [])
+            catalog = umu_tools.load_catalog()
+            self.assertNotIn(str(Path(steam_compat, "GE-Proton9-4")), catalog["tools"])
+            self.assertEqual(catalog["tools"][str(Path(umu_local, "steamrt3"))]["platforms"], ["sniper_platform_0.2"])
+            self.assertGreater(catalog["tools"][str(Path(steam_compat, "GE-Proton9-1"))]["last_used"], 0)
+
+    def test_library(self):
+        proton = Path(self.tmp, "GE-Proton9-20")
+        Path(proton, "proton").parent.mkdir()
+        Path(proton, "proton").write_text("")
+        exe = Path(self.tmp, "witcher3.exe")
+        exe.write_bytes(b"MZ")
+        config = Path(self.tmp, "library.toml")
+        config.write_text(
+            '[defaults]\nproton = "%s"\nstore = "gog"\n[defaults.env]\nDXVK_ASYNC = "1"\n\n'
+            '[games.witcher3]\nexe = "%s"\ngame_id = "umu-292030"\nlaunch_args = "-skipintro -dx12"\n'
+            '[games.witcher3.env]\nPROTON_ENABLE_NVAPI = 1\n\n'
+            '[games.missing]\nexe = "%s/missing.exe"\nproton = "GE-Proton"\nprefix = "%s"\n\n'
+            '[games.broken]\nexe = "x.exe"\nnice = 5\n'
+            % (proton, exe, self.tmp, exe))
+
+        game = umu_tools.get_library_game(config, "witcher3")
+        self.assertEqual(game["umu"]["proton"], str(proton))
+        self.assertEqual(game["umu"]["prefix"], str(umu_tools.UMU_GAMES / "witcher3"))
+        self.assertEqual(game["umu"]["store"], "gog")
+        self.assertEqual(game["umu"]["launch_args"], ["-skipintro", "-dx12"])
+        self.assertEqual(game["env"], {"DXVK_ASYNC": "1", "PROTON_ENABLE_NVAPI": "1"})
+        with self.assertRaisesRegex(ValueError, "unknown key"):
+            umu_tools.get_library_game(config, "broken")
+        with self.assertRaisesRegex(ValueError, "No game"):
+            umu_tools.get_library_game(config, "witcher4")
+
+        # An unchanged manifest is served from the cache
+        caches = list(Path(self.home, "library").glob("*.json"))
+        self.assertEqual(len(caches), 1)
+        with patch.object(umu_tools, 'compile_library_game', side_effect=AssertionError):
+            umu_tools.compile_library(config)
+        config.write_text(config.read_text().replace("-dx12", "-dx11"))
+        self.assertEqual(umu_tools.get_library_game(config, "witcher3")["umu"]["launch_args"], ["-skipintro", "-dx11"])
+        self.assertEqual(len(list(Path(self.home, "library").glob("*.json"))), 1)
+
+        library = umu_tools.compile_library(config)
+        results = umu_tools.validate_library(library, {"tools": {}}, workers=2)
+        self.assertEqual(results["witcher3"], [])
+        self.assertEqual(len(results["missing"]), 2)  # missing exe, prefix is a file
+        self.assertEqual(len(results["broken"]), 1)
+
+        with patch.object(umu_tools, 'UMU_CONFIG_DIR', Path(self.tmp, "config")):
+            referenced = umu_tools.get_referenced_protons({"tools": {}}, [str(config)])
+        self.assertIn(str(proton), referenced)
+
+        args = umu_tools.build_parser().parse_args(["launch", "--config", str(config), "--game", "witcher3"])
+        self.assertEqual((args.config, args.game, args.command), (str(config), "witcher3", []))
+
+        # A scalar section in [defaults] is a config error, not a crash
+        scalar = Path(self.tmp, "scalar.toml")
+        scalar.write_text('[defaults]\nenv = "x"\n[games.g]\nexe = "g.exe"\nproton = "GE-Proton"\n'
+                          '[games.g.env]\nA = "1"\n')
+        with self.assertRaisesRegex(ValueError, r"Game 'g' .*\[defaults\] 'env' must be a table"):
+            umu_tools.get_library_game(scalar, "g")
+
+    def test_get_gpu_driver(self):
+        sysfs = Path(self.tmp, "sys")
+        card = Path(sysfs, "class", "drm", "card0", "device")
+        card.mkdir(parents=True)
+        Path(sysfs, "bus", "pci", "drivers", "amdgpu").mkdir(parents=True)
+        Path(card, "driver").symlink_to(Path(sysfs, "bus", "pci", "drivers", "amdgpu"))
+        icd = Path(self.tmp, "icd.d")
+        icd.mkdir()
+        library = Path(self.tmp, "libvulkan_radeon.so")
+        library.write_bytes(b"ELF")
+        Path(icd, "radeon_icd.x86_64.json").write_text('{"ICD": {"library_path": "%s"}}' % library)
+
+        with patch.dict(os.environ, {}, clear=False):
+            os.environ.pop("UMU_SHADER_DRIVER", None)
+            driver = umu_tools.get_gpu_driver(sysfs, [icd])
+            self.assertRegex(driver, r"^amdgpu-[0-9a-f]{8}$")
+            # A driver update changes the id
+            os.utime(library, ns=(0, 0))
+            self.assertNotEqual(umu_tools.get_gpu_driver(sysfs, [icd]), driver)
+
+            Path(sysfs, "module", "nvidia").mkdir(parents=True)
+            Path(sysfs, "module", "nvidia", "version").write_text("550.78\n")
+            Path(card, "driver").unlink()
+            Path(card, "driver").symlink_to("../../../bus/pci/drivers/nvidia")
+            self.assertEqual(umu_tools.get_gpu_driver(sysfs, [icd]), "nvidia-550.78")
+
+    def test_shared_shader_cache(self):
+        games = Path(self.tmp, "Games", "umu")
+        prefix_a = Path(games, "umu-1")
+        prefix_b = Path(self.tmp, "other-prefix")
+        cache = Path(prefix_a, "shadercache", "dxvk")
+        cache.mkdir(parents=True)
+        Path(cache, "game.dxvk-cache").write_bytes(b"D" * 1000)
+
+        key = umu_tools.attach_shader_cache(prefix_a, "umu-1", "/x/GE-Proton9-20", "nvidia-550")
+        self.assertEqual(key.name, "nvidia-550--GE-Proton9-20")
+        self.assertEqual(os.readlink(Path(prefix_a, "shadercache")), str(key))
+        self.assertEqual(Path(key, "dxvk", "game.dxvk-cache").read_bytes(), b"D" * 1000)
+
+        # The same game in another prefix shares the cache
+        self.assertEqual(umu_tools.attach_shader_cache(prefix_b, "umu-1", "/x/GE-Proton9-20", "nvidia-550"), key)
+
+        # A driver update seeds a new cache from the previous one
+        newer = umu_tools.attach_shader_cache(prefix_b, "umu-1", "/x/GE-Proton9-20", "nvidia-555")
+        self.assertEqual(Path(newer, "dxvk", "game.dxvk-cache").read_bytes(), b"D" * 1000)
+        os.utime(key, (1, 1))
+
+        # Prefix A still links the old driver's cache, so it isn't pruned
+        with patch.object(umu_tools, 'UMU_GAMES', games):
+            self.assertEqual(umu_tools.prune_shader_caches(keep=1), [])
+            umu_tools.attach_shader_cache(prefix_a, "umu-1", "/x/GE-Proton9-20", "nvidia-555")
+            removed = umu_tools.prune_shader_caches(keep=1)
+        self.assertEqual([c for c, _ in removed], [key])
+        self.assertFalse(key.exists())
+
+    def test_prune_keeps_caches_of_prefixes_outside_games(self):
+        games = Path(self.tmp, "Games", "umu")
+        recorded = Path(self.tmp, "recorded-prefix")
+        library_prefix = Path(self.tmp, "library-prefix")
+        drivers = ["nvidia-545", "nvidia-550", "nvidia-555"]
+        keys = [umu_tools.attach_shader_cache(prefix, "umu-1", "/x/GE-Proton9-20", driver)
+                for prefix, driver in zip([recorded, library_prefix, games / "umu-1"], drivers)]
+        for age, key in enumerate(keys):
+            os.utime(key, (age + 1, age + 1))
+
+        # The library prefix reaches the store through a symlinked directory
+        alias = Path(self.tmp, "alias")
+        alias.symlink_to(umu_tools.shader_store())
+        link = Path(library_prefix, "shadercache")
+        link.unlink()
+        link.symlink_to(Path(alias, "umu-1", keys[1].name))
+
+        config = Path(self.tmp, "library.toml")
+        config.write_text('[games.game]\nexe = "game.exe"\nproton = "GE-Proton9-20"\nprefix = "%s"\n'
+                          % library_prefix)
+        catalog = {"tools": {}, "configs": [str(config)]}
+        umu_tools.remember_prefix(catalog, recorded)
+
+        with patch.object(umu_tools, 'UMU_GAMES', games):
+            self.assertEqual(umu_tools.prune_shader_caches(keep=1, catalog=catalog), [])
+            removed = umu_tools.prune_shader_caches(keep=1, catalog={"tools": {}})
+        self.assertEqual(sorted(c for c, _ in removed), sorted(keys[:2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -104,5 +104,542 @@ class TestUSBAnalyzer(unittest.TestCase):
         finally:
             shutil.rmtree(test_dir)
 
+    def test_scan_tree_parallel(self):
+        import tempfile
+        import shutil
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            for d in range(20):
+                sub = Path(test_dir, f"dir{d}", "nested", "deeper")
+                sub.mkdir(parents=True)
+                for f in range(15):
+                    Path(sub, f"file{f}.py").write_bytes(b"x" * (d * 15 + f))
+                Path(test_dir, f"dir{d}", "notes.TXT").write_bytes(b"")
+            Path(test_dir, "big.bin").write_bytes(b"x" * 5000)
+            Path(test_dir, "archive.tar.").write_bytes(b"")
+            # Listed like os.walk does: the dir link isn't followed, the dangling link is a file
+            os.symlink(Path(test_dir, "dir0"), Path(test_dir, "link"))
+            os.symlink(Path(test_dir, "missing"), Path(test_dir, "dangling.py"))
+
+            counted = []
+            stats = usb_analyzer.scan_tree(test_dir, workers=4, progress=lambda files, size: counted.append(files))
+
+            self.assertEqual(stats['file_count'], 20 * 16 + 3)
+            self.assertEqual(sum(counted), stats['file_count'])
+            self.assertEqual(stats['skipped_count'], 0)
+            self.assertEqual(stats['extensions']['.py'], 20 * 15 + 1)
+            self.assertEqual(stats['extensions']['.txt'], 20)
+            self.assertNotIn('.', stats['extensions'])
+            self.assertEqual(stats['languages']['Python'], 301)
+            self.assertEqual(stats['languages_size']['Python'],
+                             sum(range(300)) + len(str(Path(test_dir, "missing"))))
+            self.assertEqual(stats['size_bytes'], sum(range(300)) + 5000 + len(str(Path(test_dir, "missing"))))
+            sizes = [size for size, _ in stats['largest_files']]
+            self.assertEqual(sizes, [5000] + list(range(299, 290, -1)))
+            self.assertEqual(stats['largest_files'][0][1], str(Path(test_dir, "big.bin")))
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_incremental_rescan(self):
+        import tempfile
+        import shutil
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            drive = Path(test_dir, "drive")
+            for d in range(5):
+                sub = Path(drive, f"dir{d}", "sub")
+                sub.mkdir(parents=True)
+                Path(sub, "a.py").write_bytes(b"x" * (d + 1))
+                Path(drive, f"dir{d}", "b.md").write_bytes(b"")
+            # Old enough for their mtimes to be trusted
+            for directory in [drive, *drive.rglob("*")]:
+                if directory.is_dir():
+                    os.utime(directory, (1000000000, 1000000000))
+
+            with patch.object(usb_analyzer, 'INDEX_DIR', Path(test_dir, "index")):
+                first = usb_analyzer.analyze_directory(str(drive), uuid="1234-ABCD")
+                self.assertTrue(Path(test_dir, "index", "1234-ABCD.json").is_file())
+
+                with patch.object(usb_analyzer, 'add_file', side_effect=AssertionError):
+                    second = usb_analyzer.analyze_directory(str(drive), uuid="1234-ABCD")
+                self.assertEqual(second['file_count'], first['file_count'])
+                self.assertEqual(second['extensions'], first['extensions'])
+                self.assertEqual(second['largest_files'], first['largest_files'])
+
+                # Only dir3/sub is listed again
+                Path(drive, "dir3", "sub", "c.py").write_bytes(b"x" * 100)
+                index = usb_analyzer.load_index("1234-ABCD")
+                third = usb_analyzer.scan_tree(str(drive), workers=2, index=index)
+                self.assertEqual(index['reused'], 10)
+                self.assertEqual(third['file_count'], 11)
+                self.assertEqual(third['languages']['Python'], 6)
+                self.assertEqual(third['largest_files'][0], (100, str(Path(drive, "dir3", "sub", "c.py"))))
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_scan_devices_concurrently(self):
+        import io
+        import tempfile
+        import shutil
+        from contextlib import redirect_stdout
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            lsblk = {"blockdevices": [
+                {"name": "sdb", "tran": "usb", "children": [{"name": "sdb1"}, {"name": "sdb2"}]},
+                {"name": "sdc", "tran": "usb", "children": [{"name": "sdc1"}]},
+            ]}
+            devices = []
+            for name in ("sdb1", "sdc1", "sdb2"):
+                Path(test_dir, name).mkdir()
+                Path(test_dir, name, f"{name}.py").write_bytes(b"x" * 10)
+                devices.append({"name": name, "mountpoint": str(Path(test_dir, name)), "size": 1000})
+
+            groups = usb_analyzer.group_by_disk(lsblk, devices)
+            self.assertEqual([[d["name"] for d in g] for g in groups], [["sdb1", "sdb2"], ["sdc1"]])
+
+            out = io.StringIO()
+            with redirect_stdout(out), patch.object(usb_analyzer, 'INDEX_DIR', Path(test_dir, "index")):
+                usb_analyzer.scan_devices(devices, lsblk, workers=2, live=True)
+            text = out.getvalue()
+            for name in ("sdb1", "sdb2", "sdc1"):
+                self.assertIn(f"Device: {name}", text)
+            # The status lines are cleared again at the end
+            self.assertTrue(text.endswith("\033[3F\033[J"))
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_find_duplicates(self):
+        import tempfile
+        import shutil
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            usb = Path(test_dir, "usb")
+            home = Path(test_dir, "home")
+            Path(usb, "photos").mkdir(parents=True)
+            home.mkdir()
+            big = os.urandom(50000)
+            Path(usb, "photos", "a.jpg").write_bytes(big)
+            Path(home, "a copy.jpg").write_bytes(big)
+            Path(home, "another.jpg").write_bytes(big)
+            # Same size and ends, different middle: only the full hash tells them apart
+            Path(usb, "near.bin").write_bytes(big[:25000] + b"!" + big[25001:])
+            # A hard link is the same file, not a duplicate
+            os.link(Path(home, "another.jpg"), Path(home, "hardlink.jpg"))
+            Path(usb, "small1.txt").write_bytes(b"hello")
+            Path(home, "small2.txt").write_bytes(b"hello")
+            Path(home, "other.txt").write_bytes(b"world")
+            Path(usb, "empty1").write_bytes(b"")
+            Path(home, "empty2").write_bytes(b"")
+
+            groups = usb_analyzer.find_duplicates([str(usb), str(home)], workers=2, db_dir=test_dir)
+
+            self.assertEqual(len(groups), 2)
+            self.assertEqual(groups[0]['size'], 50000)
+            self.assertEqual(groups[0]['reclaimable'], 100000)
+            self.assertEqual(len(groups[0]['paths']), 3)
+            self.assertIn(str(Path(usb, "photos", "a.jpg")), groups[0]['paths'])
+            self.assertNotIn(str(Path(usb, "near.bin")), groups[0]['paths'])
+            self.assertEqual(groups[1]['paths'], [str(Path(home, "small2.txt")), str(Path(usb, "small1.txt"))])
+            # The candidate database is removed
+            self.assertEqual(list(Path(test_dir).glob("*.db")), [])
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_sniff_file_types(self):
+        import tempfile
+        import shutil
+
+        self.assertEqual(usb_analyzer.classify_header(b'\x89PNG\r\n\x1a\n' + b'\x00' * 20), 'Image')
+        self.assertEqual(usb_analyzer.classify_header(b'RIFF\x00\x00\x00\x00WAVEfmt '), 'Audio')
+        self.assertEqual(usb_analyzer.classify_header(b'\x00\x00\x00\x18ftypM4A \x00'), 'Audio')
+        self.assertEqual(usb_analyzer.classify_header(b'\x00\x00\x00\x18ftypisom\x00'), 'Video')
+        self.assertEqual(usb_analyzer.classify_header(b'#!/usr/bin/env python3\nprint()'), 'Python')
+        self.assertEqual(usb_analyzer.classify_header(b'#!/bin/bash\n'), 'Shell')
+        self.assertEqual(usb_analyzer.classify_header(b'\x00' * 257 + b'ustar\x0000'), 'Archive')
+        self.assertIsNone(usb_analyzer.classify_header(b'plain text'))
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            Path(test_dir, "photo").write_bytes(b'\xff\xd8\xff\xe0' + b'x' * 100)
+            Path(test_dir, "backup.dat").write_bytes(b'PK\x03\x04' + b'x' * 50)
+            Path(test_dir, "run").write_bytes(b'#!/bin/sh\necho hi\n')
+            Path(test_dir, "notes").write_bytes(b'just words')
+            Path(test_dir, "real.py").write_bytes(b'\x89PNG\r\n\x1a\n')
+            frames = Path(test_dir, "frames")
+            frames.mkdir()
+            for i in range(10):
+                Path(frames, f"frame{i}").write_bytes(b'GIF89a' + b'x' * 10)
+
+            plain = usb_analyzer.scan_tree(test_dir, workers=2)
+            self.assertEqual(plain['sniffed'], 0)
+            self.assertNotIn('Image', plain['languages'])
+
+            stats = usb_analyzer.scan_tree(test_dir, workers=2, sniff=1.0)
+            # Known extensions are trusted, the rest is read
+            self.assertEqual(stats['languages']['Python'], 1)
+            self.assertEqual(stats['languages']['Image'], 11)
+            self.assertEqual(stats['languages_size']['Image'], 104 + 10 * 16)
+            self.assertEqual(stats['languages']['Archive'], 1)
+            self.assertEqual(stats['languages']['Shell'], 1)
+            self.assertEqual(stats['sniffed'], 13)
+
+            # Sampling reads every 4th file of a directory and extrapolates
+            with patch.object(usb_analyzer, 'read_header', wraps=usb_analyzer.read_header) as reads:
+                sampled = usb_analyzer.scan_tree(str(frames), workers=1, sniff=0.25)
+            self.assertEqual(reads.call_count, 3)
+            self.assertEqual(sampled['languages']['Image'], 10)
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_estimate_tree(self):
+        import tempfile
+        import shutil
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            # Same shape everywhere, so every probe sees the whole tree's totals
+            for i in range(10):
+                for j in range(10):
+                    d = Path(test_dir, f"d{i}", f"e{j}")
+                    d.mkdir(parents=True)
+                    for k in range(4):
+                        Path(d, f"f{k}.py").write_bytes(b'x' * 10)
+                    Path(d, "notes.txt").write_bytes(b'y')
+
+            stats = usb_analyzer.estimate_tree(test_dir, seconds=60, max_files=30, seed=1)
+            estimate = stats['estimate']
+            self.assertFalse(estimate['exact'])
+            self.assertLess(estimate['files'], 500)
+            self.assertEqual(stats['file_count'], 500)
+            self.assertEqual(stats['size_bytes'], 4100)
+            self.assertEqual(stats['languages']['Python'], 400)
+            self.assertEqual(stats['extensions']['.txt'], 100)
+            self.assertEqual(estimate['margin']['file_count'], 0)
+
+            # Uneven: the margins say so, and a big enough budget lists it all
+            for k in range(50):
+                Path(test_dir, "d0", "e0", f"big{k}.mp4").write_bytes(b'z')
+            stats = usb_analyzer.estimate_tree(test_dir, seconds=60, max_files=300, seed=1)
+            margin = stats['estimate']['margin']
+            self.assertFalse(stats['estimate']['exact'])
+            self.assertGreater(margin['file_count'], 0)
+            self.assertLessEqual(abs(stats['file_count'] - 550), margin['file_count'])
+            self.assertEqual(margin['languages']['Python'], 0)
+
+            stats = usb_analyzer.estimate_tree(test_dir, seconds=60, seed=1)
+            self.assertTrue(stats['estimate']['exact'])
+            exact = usb_analyzer.scan_tree(test_dir, workers=2)
+            self.assertEqual(stats['file_count'], exact['file_count'])
+            self.assertEqual(dict(stats['languages']), dict(exact['languages']))
+        finally:
+            shutil.rmtree(test_dir)
+
+        self.assertEqual(usb_analyzer.parse_size("500M"), 500 * 1024**2)
+        self.assertEqual(usb_analyzer.parse_size("1.5TiB"), int(1.5 * 1024**4))
+        self.assertEqual(usb_analyzer.parse_size("4096"), 4096)
+
+    def test_benchmark_device(self):
+        import tempfile
+        import shutil
+        import io
+        from contextlib import redirect_stdout
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            paths = []
+            for i, size in enumerate((3 << 20, 1 << 20, 100)):
+                path = os.path.join(test_dir, f"file{i}.bin")
+                Path(path).write_bytes(os.urandom(size))
+                paths.append(path)
+
+            result = usb_analyzer.benchmark_device(test_dir, paths + [test_dir], seconds=0.2,
+                                                   write_bytes=2 << 20)
+            self.assertEqual(result['files'], 3)
+            self.assertGreater(result['seq_mb_s'], 0)
+            self.assertLessEqual(result['seq_bytes'], (4 << 20) + 100)
+            self.assertGreater(result['rand_iops'], 0)
+            self.assertGreater(result['write_mb_s'], 0)
+            # The write test cleans up after itself
+            self.assertEqual(sorted(os.listdir(test_dir)), ["file0.bin", "file1.bin", "file2.bin"])
+
+            out = io.StringIO()
+            with redirect_stdout(out):
+                usb_analyzer.format_output({'name': 'sdz', 'mountpoint': test_dir}, None, None, result)
+            self.assertIn("Sequential read:", out.getvalue())
+            self.assertIn("Sequential write:", out.getvalue())
+
+            # A file that can't be read is skipped, not the whole benchmark
+            open_uncached = usb_analyzer.open_uncached
+
+            def deny_file0(path, flags=os.O_RDONLY):
+                if path.endswith("file0.bin"):
+                    raise PermissionError(13, "Permission denied", path)
+                return open_uncached(path, flags)
+
+            with patch.object(usb_analyzer, 'open_uncached', deny_file0):
+                result = usb_analyzer.benchmark_device(test_dir, paths, seconds=0.2)
+            self.assertEqual(result['skipped'], 1)
+            self.assertGreater(result['seq_mb_s'], 0)
+            self.assertGreater(result['rand_iops'], 0)
+
+            # Sizes that aren't a whole number of blocks are written exactly
+            self.assertEqual(usb_analyzer.bench_write(test_dir, 10000, block=4096)[0], 10000)
+            self.assertEqual(usb_analyzer.bench_write(test_dir, (1 << 20) + 8192)[0], (1 << 20) + 8192)
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_manifest_snapshot_and_verify(self):
+        import tempfile
+        import shutil
+
+        test_dir = tempfile.mkdtemp()
+        manifest_file = os.path.join(tempfile.mkdtemp(), "m.json")
+        try:
+            Path(test_dir, "sub").mkdir()
+            for name in ("keep", "edit", "gone", "rot", "touch", "sub/deep"):
+                Path(test_dir, name).write_bytes(name.encode() * 1000)
+            Path(test_dir, "empty").write_bytes(b"")
+
+            manifest = usb_analyzer.snapshot_device(test_dir, manifest_file, workers=2)
+            self.assertEqual(len(manifest['files']), 7)
+            manifest = usb_analyzer.load_manifest(manifest_file)
+
+            report = usb_analyzer.verify_device(test_dir, manifest, workers=2)
+            self.assertEqual(report['ok'], 7)
+            self.assertEqual(report['hashed'], 0)
+
+            Path(test_dir, "edit").write_bytes(b"new")
+            os.remove(os.path.join(test_dir, "gone"))
+            Path(test_dir, "added").write_bytes(b"x")
+            # Same size and mtime, different bytes: only found by rehashing
+            rot = os.path.join(test_dir, "rot")
+            st = os.stat(rot)
+            Path(rot).write_bytes(b"R" * st.st_size)
+            os.utime(rot, ns=(st.st_atime_ns, st.st_mtime_ns))
+            # New mtime, same bytes: hashed and found intact
+            touch = os.path.join(test_dir, "touch")
+            os.utime(touch, ns=(os.stat(touch).st_atime_ns, os.stat(touch).st_mtime_ns + 10**9))
+
+            report = usb_analyzer.verify_device(test_dir, manifest, workers=2)
+            self.assertEqual(report['changed'], ["edit"])
+            self.assertEqual(report['missing'], ["gone"])
+            self.assertEqual(report['new'], ["added"])
+            self.assertEqual(report['corrupted'], [])
+            self.assertEqual(report['hashed'], 1)
+            self.assertEqual(report['ok'], 5)
+
+            report = usb_analyzer.verify_device(test_dir, manifest, workers=2, rehash=True)
+            self.assertEqual(report['corrupted'], ["rot"])
+            self.assertEqual(report['hashed'], 5)
+        finally:
+            shutil.rmtree(test_dir)
+            shutil.rmtree(os.path.dirname(manifest_file))
+
+    def test_read_sysfs_devices(self):
+        import tempfile
+        import shutil
+
+        root = tempfile.mkdtemp()
+        try:
+            def write(path, text):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                Path(path).write_text(text + "\n")
+
+            devices = os.path.join(root, "sys", "devices")
+            usb = os.path.join(devices, "pci0000:00", "0000:00:14.0", "usb2", "2-1", "2-1:1.0",
+                               "host6", "target6:0:0", "6:0:0:0")
+            sata = os.path.join(devices, "pci0000:00", "0000:00:17.0", "ata1", "host0",
+                                "target0:0:0", "0:0:0:0")
+            for scsi, name, size, removable, model in ((usb, "sdb", "60062500", "1", "Cruzer Blade"),
+                                                        (sata, "sda", "1953525168", "0", "Samsung SSD")):
+                write(os.path.join(scsi, "model"), model + "   ")
+                write(os.path.join(scsi, "vendor"), "ATA")
+                disk = os.path.join(scsi, "block", name)
+                write(os.path.join(disk, "size"), size)
+                write(os.path.join(disk, "removable"), removable)
+                write(os.path.join(disk, "ro"), "0")
+                write(os.path.join(disk, "dev"), "8:16" if name == "sdb" else "8:0")
+                os.symlink(scsi, os.path.join(disk, "device"))
+                os.makedirs(os.path.join(root, "sys", "block"), exist_ok=True)
+                os.symlink(disk, os.path.join(root, "sys", "block", name))
+            part = os.path.join(usb, "block", "sdb", "sdb1")
+            write(os.path.join(part, "partition"), "1")
+            write(os.path.join(part, "size"), "60060000")
+            write(os.path.join(part, "dev"), "8:17")
+            loop = os.path.join(devices, "virtual", "block", "loop0")
+            write(os.path.join(loop, "size"), "0")
+            os.symlink(loop, os.path.join(root, "sys", "block", "loop0"))
+
+            mountinfo = os.path.join(root, "mountinfo")
+            write(mountinfo, "\n".join([
+                "29 1 8:2 / / rw,relatime shared:1 - ext4 /dev/sda2 rw",
+                "80 29 8:17 /backup /mnt/bind rw - vfat /dev/sdb1 rw",
+                "81 29 8:17 / /run/media/me/MY\\040STICK rw,nosuid shared:40 - vfat /dev/sdb1 rw",
+            ]))
+            for kind, name in (("by-uuid", "1234-ABCD"), ("by-label", "MY\\x20STICK")):
+                os.makedirs(os.path.join(root, "disk", kind))
+                os.symlink("../../sdb1", os.path.join(root, "disk", kind, name))
+
+            data = usb_analyzer.read_sysfs_devices(os.path.join(root, "sys"), mountinfo,
+                                                   os.path.join(root, "disk"))
+            self.assertEqual([d['name'] for d in data['blockdevices']], ["sda", "sdb"])
+            sda, sdb = data['blockdevices']
+            self.assertEqual(sda['tran'], "sata")
+            self.assertNotIn('children', sda)
+            self.assertEqual(sdb['tran'], "usb")
+            self.assertEqual(sdb['model'], "Cruzer Blade")
+            self.assertEqual(sdb['size'], 60062500 * 512)
+            self.assertTrue(sdb['rm'])
+            self.assertIsNone(sdb['mountpoint'])
+            self.assertEqual(sdb['children'], [{
+                'name': "sdb1", 'tran': "usb", 'mountpoint': "/run/media/me/MY STICK", 'fstype': "vfat",
+                'size': 60060000 * 512, 'ro': False, 'rm': True, 'model': None, 'vendor': None,
+                'uuid': "1234-ABCD", 'label': "MY STICK",
+            }])
+
+            # The rest of the tool takes it as it took lsblk's output
+            self.assertEqual([d['name'] for d in usb_analyzer.select_devices(data)], ["sdb1"])
+
+            added, removed, known = usb_analyzer.mounted_changes(set(), usb_analyzer.select_devices(data))
+            self.assertEqual([d['name'] for d in added], ["sdb1"])
+            self.assertEqual(removed, [])
+            added, removed, known = usb_analyzer.mounted_changes(known, usb_analyzer.select_devices(data))
+            self.assertEqual((added, removed), ([], []))
+            added, removed, known = usb_analyzer.mounted_changes(known, [])
+            self.assertEqual(removed, [("sdb1", "1234-ABCD", "/run/media/me/MY STICK")])
+            self.assertEqual(known, set())
+        finally:
+            shutil.rmtree(root)
+
+    def test_read_sysfs_devices_by_mount_source_and_holders(self):
+        import tempfile
+        import shutil
+
+        root = tempfile.mkdtemp()
+        try:
+            def write(path, text):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                Path(path).write_text(text + "\n")
+
+            block = os.path.join(root, "sys", "block")
+            usb = os.path.join(root, "sys", "devices", "pci0000:00", "0000:00:14.0", "usb2", "2-1",
+                               "2-1:1.0", "host6", "target6:0:0", "6:0:0:0")
+            disk = os.path.join(usb, "block", "sdb")
+            write(os.path.join(disk, "size"), "1000000")
+            write(os.path.join(disk, "dev"), "8:16")
+            os.makedirs(block)
+            os.symlink(disk, os.path.join(block, "sdb"))
+            for number in (1, 2, 3):
+                part = os.path.join(disk, "sdb%d" % number)
+                write(os.path.join(part, "partition"), str(number))
+                write(os.path.join(part, "size"), "300000")
+                write(os.path.join(part, "dev"), "8:%d" % (16 + number))
+            # An opened LUKS volume on the third partition
+            dm = os.path.join(root, "sys", "devices", "virtual", "block", "dm-0")
+            write(os.path.join(dm, "size"), "290000")
+            write(os.path.join(dm, "dev"), "254:0")
+            write(os.path.join(dm, "dm", "name"), "luks-abc")
+            os.makedirs(os.path.join(dm, "slaves"))
+            os.symlink(os.path.join(disk, "sdb3"), os.path.join(dm, "slaves", "sdb3"))
+            os.makedirs(os.path.join(disk, "sdb3", "holders"))
+            os.symlink(dm, os.path.join(disk, "sdb3", "holders", "dm-0"))
+            os.symlink(dm, os.path.join(block, "dm-0"))
+
+            mountinfo = os.path.join(root, "mountinfo")
+            write(mountinfo, "\n".join([
+                "90 29 0:45 /@data /run/media/me/data rw - btrfs /dev/sdb1 rw,subvolid=256",
+                "91 29 0:50 / /run/media/me/WIN rw - fuseblk /dev/sdb2 rw,user_id=0",
+                "92 29 254:0 / /run/media/me/secret rw - ext4 /dev/mapper/luks-abc rw",
+            ]))
+            os.makedirs(os.path.join(root, "disk", "by-uuid"))
+            os.symlink("../../dm-0", os.path.join(root, "disk", "by-uuid", "cafe"))
+
+            data = usb_analyzer.read_sysfs_devices(os.path.join(root, "sys"), mountinfo,
+                                                   os.path.join(root, "disk"))
+            self.assertEqual([d['name'] for d in data['blockdevices']], ["sdb"])
+            sdb1, sdb2, sdb3 = data['blockdevices'][0]['children']
+            self.assertEqual((sdb1['mountpoint'], sdb1['fstype']), ("/run/media/me/data", "btrfs"))
+            self.assertEqual((sdb2['mountpoint'], sdb2['fstype']), ("/run/media/me/WIN", "fuseblk"))
+            self.assertIsNone(sdb3['mountpoint'])
+            self.assertEqual(sdb3['children'], [{
+                'name': "luks-abc", 'tran': "usb", 'mountpoint': "/run/media/me/secret", 'fstype': "ext4",
+                'size': 290000 * 512, 'ro': False, 'rm': False, 'model': None, 'vendor': None,
+                'uuid': "cafe", 'label': None,
+            }])
+            self.assertEqual([d['name'] for d in usb_analyzer.select_devices(data)],
+                             ["luks-abc", "sdb1", "sdb2"])
+        finally:
+            shutil.rmtree(root)
+
+    def test_dir_tree(self):
+        import tempfile
+        import shutil
+        import json
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            sizes = {"a/x/deep/deeper": 1000, "a/x": 100, "a/y": 50, "b": 10, "c": 5, "d": 1, "": 7}
+            for rel, size in sizes.items():
+                d = Path(test_dir, rel)
+                d.mkdir(parents=True, exist_ok=True)
+                Path(d, "data.bin").write_bytes(b"x" * size)
+                Path(d, "small.py").write_bytes(b"p" * (size // 2))
+            Path(test_dir, "empty").mkdir()
+
+            tree = usb_analyzer.DirTree(test_dir, max_depth=2, max_children=2)
+            stats = usb_analyzer.scan_tree(test_dir, workers=4, tree=tree)
+            result = tree.to_dict()
+            self.assertEqual(tree.open, {})
+
+            root = result['tree']
+            self.assertEqual(root['size'], stats['size_bytes'])
+            self.assertEqual(root['files'], stats['file_count'])
+            # b, c, d and the empty directory are summed up
+            self.assertEqual([c['name'] for c in root['children']], ["a", "b", "(other)"])
+            self.assertEqual(root['children'][2]['size'], 5 + 2 + 1 + 0)
+            a = root['children'][0]
+            self.assertEqual(a['size'], 1500 + 150 + 75)
+            self.assertEqual([c['name'] for c in a['children']], ["x", "y"])
+            # Depth 2 keeps its total but not its subdirectories
+            self.assertEqual(a['children'][0]['size'], 1500 + 150)
+            self.assertNotIn('children', a['children'][0])
+
+            largest = [(size, os.path.relpath(path, test_dir)) for size, path in result['largest_dirs']]
+            self.assertEqual(largest[:5], [(root['size'], "."), (1725, "a"), (1650, "a/x"),
+                                           (1500, "a/x/deep/deeper"), (1500, "a/x/deep")])
+
+            py = stats['largest_by_language']['Python']
+            self.assertEqual([size for size, _ in py[:3]], [500, 50, 25])
+
+            # Reused index entries keep the per-language largest files
+            for directory in [Path(test_dir), *Path(test_dir).rglob("*")]:
+                if directory.is_dir():
+                    os.utime(directory, (1000000000, 1000000000))
+            index_dir = tempfile.mkdtemp()
+            try:
+                with patch.object(usb_analyzer, 'INDEX_DIR', index_dir):
+                    usb_analyzer.scan_with_index(test_dir, 2, "tree-uuid")
+                    again, index = usb_analyzer.scan_with_index(test_dir, 2, "tree-uuid")
+            finally:
+                shutil.rmtree(index_dir)
+            self.assertEqual(index['reused'], len(sizes) + 3)
+            self.assertEqual(again['largest_by_language']['Python'][:3], py[:3])
+
+            export = os.path.join(test_dir, "export.json")
+            stats['dirs'] = result
+            usb_analyzer.export_scan(export, [({'name': "sdz1", 'mountpoint': test_dir}, stats), ({'name': "sdz2"}, None)])
+            with open(export) as f:
+                data = json.load(f)
+            sdz1, sdz2 = data['devices']
+            self.assertEqual(sdz1['languages']['Python']['largest'][0]['size'], 500)
+            self.assertEqual(sdz1['tree']['children'][0]['name'], "a")
+            self.assertEqual(sdz2, {'name': "sdz2", 'mountpoint': None, 'uuid': None, 'label': None, 'size': None})
+        finally:
+            shutil.rmtree(test_dir)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,659 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the umu package bundled in umu-run.
+
+Every benchmark builds its own fixtures in a scratch directory: a synthetic
+/proc tree, a local HTTP server standing in for GitHub (release JSON,
+tarballs, checksums and CBOR patches) and synthetic Proton directories. Runs
+never touch the network or the real umu install, so results taken on the
+same machine can be compared between commits.
+
+    umu_bench.py run [-o results.json] [--baseline old.json]
+    umu_bench.py compare old.json new.json
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from importlib.util import find_spec
+from pathlib import Path
+from unittest.mock import patch
+
+import umu_tools
+
+RESULTS_VERSION = 1
+
+# A benchmark is flagged when its median is this much slower than the baseline
+DEFAULT_THRESHOLD = 0.10
+
+MIB = 1024 * 1024
+
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark whose optional dependencies are missing."""
+
+
+def results_dir():
+    return umu_tools.TOOLS_HOME / "bench"
+
+
+def load_umu(scratch):
+    """
+    Imports umu from the umu-run zipapp. umu works out its cache and data
+    directories at import time, so they are pointed at the scratch directory
+    first.
+    """
+    os.environ["XDG_CACHE_HOME"] = str(Path(scratch, "cache"))
+    os.environ["XDG_DATA_HOME"] = str(Path(scratch, "data"))
+    if str(umu_tools.UMU_RUN) not in sys.path:
+        sys.path.insert(0, str(umu_tools.UMU_RUN))
+    import umu
+    from umu import umu_log
+    umu_log.log.setLevel("WARNING")
+    return umu
+
+
+def measure(fn, repeat, setup=None):
+    """Runs fn repeat times, calling setup untimed before each run."""
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return {"median": statistics.median(runs), "min": min(runs), "runs": runs}
+
+
+def make_proc(root, count, fanout=4):
+    """Builds a /proc with count processes, each parent having fanout children."""
+    for pid in range(1, count + 1):
+        ppid = (pid - 2) // fanout + 1 if pid > 1 else 0
+        d = Path(root, str(pid))
+        d.mkdir(parents=True)
+        Path(d, "status").write_text(f"Name:\tproc{pid}\nState:\tS (sleeping)\nTgid:\t{pid}\n"
+                                     f"Pid:\t{pid}\nPPid:\t{ppid}\n")
+        Path(d, "stat").write_text(f"{pid} (proc{pid}) S {ppid} {pid} {pid} 0 -1\n")
+    Path(root, "self").mkdir()
+
+
+def make_proton(path, size, seed=0):
+    """
+    Builds a Proton like directory of about size bytes. File contents are
+    half random and half repeated, so they compress about as well as a
+    real build.
+    """
+    rng = random.Random(seed)
+    Path(path, "files", "lib", "wine").mkdir(parents=True)
+    Path(path, "proton").write_text("#!/bin/sh\nexit 0\n")
+    Path(path, "proton").chmod(0o755)
+    Path(path, "toolmanifest.vdf").write_text(
+        '"manifest"\n{\n  "commandline" "/proton %verb%"\n  "require_tool_appid" "1628350"\n}\n')
+    Path(path, "version").write_text(f"{seed} {Path(path).name}\n")
+    written = 0
+    index = 0
+    while written < size:
+        length = min(rng.choice((4096, 65536, 1 * MIB, 4 * MIB)), size - written)
+        data = rng.randbytes(length // 2) + bytes([index % 256]) * (length - length // 2)
+        Path(path, "files", "lib", "wine", f"lib{index}.so").write_bytes(data)
+        written += length
+        index += 1
+    return written
+
+
+def make_tarball(src, dest):
+    """Writes src as dest (.tar.gz, .tar.xz or plain .tar), with src's name at the top."""
+    mode = {"xz": "w:xz", "gz": "w:gz"}.get(dest.name.rsplit(".", 1)[-1], "w")
+    with tarfile.open(dest, mode) as tar:
+        tar.add(src, arcname=Path(src).name)
+    return dest
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve_directory(root):
+    """Serves root over HTTP on a free local port, yields the base URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(root)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def make_pool_manager(base):
+    """
+    Returns a urllib3 PoolManager sending every request to the local server,
+    keeping the path. umu insists on https URLs, so the fixtures use those
+    and the pool rewrites them.
+    """
+    from urllib3.poolmanager import PoolManager
+    from urllib3.util import parse_url
+
+    class LocalPoolManager(PoolManager):
+        def urlopen(self, method, url, redirect=True, **kw):
+            parsed = parse_url(url)
+            path = parsed.path or "/"
+            if parsed.query:
+                path += f"?{parsed.query}"
+            return super().urlopen(method, f"{base}{path}", redirect=redirect, **kw)
+
+    return LocalPoolManager()
+
+
+def make_release(root, proton, tarball):
+    """Writes a GitHub release JSON for tarball and its checksum file to root."""
+    digest = hashlib.sha512(tarball.read_bytes()).hexdigest()
+    sumfile = Path(root, "download", f"{proton}.sha512sum")
+    sumfile.parent.mkdir(parents=True, exist_ok=True)
+    sumfile.write_text(f"{digest} {tarball.name}\n")
+    shutil.copy(tarball, Path(root, "download", tarball.name))
+    release = Path(root, "repos", "GloriousEggroll", "proton-ge-custom", "releases", "latest")
+    release.parent.mkdir(parents=True, exist_ok=True)
+    assets = [
+        {"name": sumfile.name, "browser_download_url": f"https://github.com/download/{sumfile.name}"},
+        {"name": tarball.name, "browser_download_url": f"https://github.com/download/{tarball.name}"},
+    ]
+    release.write_text(json.dumps({"tag_name": proton, "assets": assets}))
+
+
+def bench_pstree(scratch, args):
+    """umu_run.get_pstree_from_pid over a synthetic /proc."""
+    from umu import umu_run
+    root = Path(scratch, "proc")
+    make_proc(root, args.procs)
+
+    def proc_path(*parts):
+        path = str(Path(*parts))
+        if path == "/proc" or path.startswith("/proc/"):
+            path = str(root) + path[len("/proc"):]
+        return Path(path)
+
+    descendants = set()
+    with patch.object(umu_run, "Path", proc_path):
+        result = measure(lambda: descendants.update(umu_run.get_pstree_from_pid(1)), args.repeat)
+    if len(descendants) != args.procs - 1:
+        raise RuntimeError(f"Expected {args.procs - 1} descendants, got {len(descendants)}")
+    result["procs"] = args.procs
+    return result
+
+
+def bench_fetch(scratch, args):
+    """Release lookup and Proton download (umu_proton._fetch_releases/_fetch_proton)."""
+    from umu import umu_proton
+    proton = "GE-Proton9-99"
+    www = Path(scratch, "www")
+    src = Path(scratch, "src", proton)
+    size = make_proton(src, args.size * MIB)
+    tarball = make_tarball(src, Path(scratch, f"{proton}.tar.gz"))
+    make_release(www, proton, tarball)
+    tmpfs = Path(scratch, "tmpfs")
+    tmpfs.mkdir()
+
+    with serve_directory(www) as base, ThreadPoolExecutor() as pool, \
+            patch.dict(os.environ, {"PROTONPATH": "GE-Proton"}):
+        os.environ.pop("UMU_ZENITY", None)
+        session_pools = (pool, make_pool_manager(base))
+
+        def fetch():
+            assets = umu_proton._fetch_releases(session_pools)
+            if not assets:
+                raise RuntimeError("No release assets found")
+            umu_proton._fetch_proton({}, (tmpfs, Path(scratch, "cache")), assets, session_pools)
+
+        def clean():
+            for path in tmpfs.iterdir():
+                path.unlink()
+
+        result = measure(fetch, args.repeat, clean)
+    result["bytes"] = tarball.stat().st_size
+    result["mb_s"] = result["bytes"] / MIB / result["median"]
+    result["uncompressed_bytes"] = size
+    return result
+
+
+def bench_extract(scratch, args):
+    """umu_util.extract_tarfile on the same tree as .tar.gz and .tar.xz."""
+    from umu import umu_util
+    src = Path(scratch, "src", "SteamLinuxRuntime_sniper")
+    size = make_proton(src, args.size * MIB, seed=1)
+    dest = Path(scratch, "dest")
+    result = {"uncompressed_bytes": size}
+    for suffix in ("gz", "xz"):
+        archive = make_tarball(src, Path(scratch, f"{src.name}.tar.{suffix}"))
+
+        def clean():
+            shutil.rmtree(dest, ignore_errors=True)
+            dest.mkdir()
+
+        timing = measure(lambda: umu_util.extract_tarfile(archive, dest), args.repeat, clean)
+        timing["bytes"] = archive.stat().st_size
+        timing["mb_s"] = size / MIB / timing["median"]
+        result[suffix] = timing
+    # The slower of the two is what a fresh install waits on
+    result.update({k: max(result["gz"][k], result["xz"][k]) for k in ("median", "min")})
+    shutil.rmtree(dest, ignore_errors=True)
+    return result
+
+
+# Decompression backends compared by bench_backends, per archive suffix.
+# None is umu's own extract_tarfile; the rest are multithreaded (or at least
+# out of process) decompressors piped into tarfile's stream mode.
+BACKENDS = {
+    "gz": {"tarfile": None, "pigz": ["pigz", "-dc"], "gzip": ["gzip", "-dc"]},
+    "xz": {"tarfile": None, "xz -T0": ["xz", "-dc", "-T0"]},
+    "zst": {"zstd -T0": ["zstd", "-dc", "-T0"]},
+}
+
+
+def extract_piped(command, archive, dest):
+    """
+    Extracts archive the way umu_util.extract_tarfile does (tar_filter where
+    Python has it), with command doing the decompression in another process.
+    """
+    with open(archive, "rb") as src:
+        proc = subprocess.Popen(command, stdin=src, stdout=subprocess.PIPE)
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+            if hasattr(tarfile, "tar_filter"):
+                tar.extraction_filter = tarfile.tar_filter
+            tar.extractall(path=dest)
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+    if returncode:
+        raise RuntimeError(f"{command[0]} exited with {returncode}")
+
+
+def bench_backends(scratch, args):
+    """
+    Decompression backends on the same tree: umu's extract_tarfile against
+    pigz, xz -T0 and zstd -T0 piped into tarfile, where installed. The
+    headline figure is extract_tarfile on .tar.xz, what a fresh runtime
+    install waits on today.
+    """
+    from umu import umu_util
+    src = Path(scratch, "src", "SteamLinuxRuntime_sniper")
+    size = make_proton(src, args.size * MIB, seed=1)
+    expected = sum(1 for _ in src.rglob("*"))
+    dest = Path(scratch, "dest")
+    archives = {suffix: make_tarball(src, Path(scratch, f"{src.name}.tar.{suffix}"))
+                for suffix in ("gz", "xz")}
+    if shutil.which("zstd"):
+        plain = make_tarball(src, Path(scratch, f"{src.name}.tar"))
+        archives["zst"] = Path(scratch, f"{src.name}.tar.zst")
+        subprocess.run(["zstd", "-q", "-T0", "-o", str(archives["zst"]), str(plain)], check=True)
+        plain.unlink()
+
+    def clean():
+        shutil.rmtree(dest, ignore_errors=True)
+        dest.mkdir()
+
+    result = {"uncompressed_bytes": size, "backends": {}}
+    for suffix, archive in archives.items():
+        for name, command in BACKENDS[suffix].items():
+            if command is None:
+                run = functools.partial(umu_util.extract_tarfile, archive, dest)
+            elif shutil.which(command[0]):
+                run = functools.partial(extract_piped, command, archive, dest)
+            else:
+                continue
+            timing = measure(run, args.repeat, clean)
+            extracted = sum(1 for _ in Path(dest, src.name).rglob("*"))
+            if extracted != expected:
+                raise RuntimeError(f"{name} extracted {extracted} of {expected} entries from {archive.name}")
+            timing["bytes"] = archive.stat().st_size
+            timing["mb_s"] = size / MIB / timing["median"]
+            result["backends"][f"{suffix}/{name}"] = timing
+    result.update({k: result["backends"]["xz/tarfile"][k] for k in ("median", "min")})
+    shutil.rmtree(dest, ignore_errors=True)
+    return result
+
+
+def make_patch(old, new, zstd, xxh3):
+    """
+    Builds umu_bspatch Content turning directory old into new: files only
+    in new are added, changed files get a zstd delta with the old file as
+    prefix dictionary, files only in old are deleted.
+    """
+    content = {"manifest": [], "add": [], "update": [], "delete": [],
+               "source": old.name, "target": new.name}
+    for path in sorted(new.rglob("*")):
+        name = str(path.relative_to(new))
+        st = path.lstat()
+        if path.is_dir():
+            if not Path(old, name).is_dir():
+                content["add"].append({"name": name, "type": "dir", "mode": st.st_mode,
+                                       "data": b"", "xxhash": 0, "time": st.st_mtime, "size": 0})
+            continue
+        data = path.read_bytes()
+        entry = {"name": name, "type": "file", "mode": st.st_mode, "xxhash": xxh3(data),
+                 "time": st.st_mtime, "size": len(data)}
+        content["manifest"].append({k: entry[k] for k in ("name", "mode", "xxhash", "size", "time")})
+        previous = Path(old, name)
+        if not previous.is_file():
+            content["add"].append({**entry, "data": zstd.compress(data)})
+        elif previous.read_bytes() != data:
+            prefix = zstd.ZstdDict(previous.read_bytes(), is_raw=True).as_prefix
+            delta = zstd.compress(data, zstd_dict=prefix)
+            content["update"].append({**entry, "data": delta})
+    for path in sorted(old.rglob("*")):
+        name = str(path.relative_to(old))
+        if not Path(new, name).exists():
+            content["delete"].append({"name": name, "type": "dir" if path.is_dir() else "file",
+                                      "mode": 0, "data": b"", "xxhash": 0, "time": 0, "size": 0})
+    return content
+
+
+def bench_patch(scratch, args):
+    """umu_bspatch.CustomPatcher patch and verify throughput, plus CBOR patch fetching."""
+    if not find_spec("pyzstd") or not find_spec("xxhash"):
+        raise SkipBenchmark("needs pyzstd and xxhash, like umu's delta updates")
+    import pyzstd
+    from xxhash import xxh3_64_intdigest
+    from umu import umu_bspatch, umu_proton
+
+    old = Path(scratch, "GE-Proton9-98")
+    new = Path(scratch, "GE-Proton9-99")
+    make_proton(old, args.size * MIB, seed=2)
+    shutil.copytree(old, new, symlinks=True)
+    # Touch about a quarter of the files, add and drop a few
+    files = sorted(Path(new, "files", "lib", "wine").iterdir())
+    rng = random.Random(3)
+    for path in files[::4]:
+        data = bytearray(path.read_bytes())
+        for _ in range(8):
+            offset = rng.randrange(len(data))
+            data[offset:offset + 64] = rng.randbytes(64)
+        path.write_bytes(bytes(data))
+    files[-1].unlink()
+    Path(new, "files", "lib", "wine", "added.so").write_bytes(rng.randbytes(MIB))
+    Path(new, "files", "share").mkdir()
+    content = make_patch(old, new, pyzstd, xxh3_64_intdigest)
+    size = sum(entry["size"] for entry in content["manifest"])
+
+    work = Path(scratch, "work")
+    with ThreadPoolExecutor() as pool:
+        def reset():
+            shutil.rmtree(work, ignore_errors=True)
+            shutil.copytree(old, work, symlinks=True)
+
+        def apply():
+            patcher = umu_bspatch.CustomPatcher(content, work, pool)
+            patcher.add_binaries()
+            patcher.update_binaries()
+            patcher.delete_binaries()
+            _, added, updated = patcher.result()
+            for future in wait([*added, *updated]).done:
+                future.result()
+
+        def verify():
+            patcher = umu_bspatch.CustomPatcher(content, work, pool)
+            patcher.verify_integrity()
+            for future in wait(patcher.result()[0]).done:
+                future.result()
+
+        result = {"patch": measure(apply, args.repeat, reset)}
+        result["verify"] = measure(verify, args.repeat)
+    result["patch"]["mb_s"] = size / MIB / result["patch"]["median"]
+    result["verify"]["mb_s"] = size / MIB / result["verify"]["median"]
+    result.update({k: result["patch"][k] for k in ("median", "min")})
+    shutil.rmtree(work, ignore_errors=True)
+
+    if find_spec("cbor2"):
+        import cbor2
+        www = Path(scratch, "www")
+        patch_file = Path(www, "download", "GE-Latest.cbor")
+        patch_file.parent.mkdir(parents=True)
+        patch_file.write_bytes(cbor2.dumps({"contents": [content], "signature": (b"", b""),
+                                            "public_key": (b"", b"")}))
+        release = Path(www, "repos", "Open-Wine-Components", "umu-mkpatch", "releases", "latest")
+        release.parent.mkdir(parents=True)
+        release.write_text(json.dumps({"assets": [{
+            "name": patch_file.name,
+            "browser_download_url": f"https://github.com/download/{patch_file.name}",
+        }]}))
+        with serve_directory(www) as base, ThreadPoolExecutor() as pool, \
+                patch.dict(os.environ, {"PROTONPATH": "GE-Latest"}):
+            session_pools = (pool, make_pool_manager(base))
+            result["fetch_patch"] = measure(
+                lambda: cbor2.loads(umu_proton._fetch_patch(session_pools)), args.repeat)
+        result["fetch_patch"]["bytes"] = patch_file.stat().st_size
+    return result
+
+
+def bench_launch(scratch, args):
+    """
+    Warm launch latency of umu-run: runtime and Proton already installed,
+    runtime updates off, so this is umu's own startup overhead. The runtime
+    entry point and Proton are stubs that exit at once.
+    """
+    if os.geteuid() == 0:
+        raise SkipBenchmark("umu-run refuses to run as root")
+    data = Path(scratch, "launch", "data")
+    runtime = Path(data, "umu", "steamrt3")
+    runtime.mkdir(parents=True)
+    for name in ("_v2-entry-point", "umu-shim"):
+        Path(runtime, name).write_text("#!/bin/sh\nexit 0\n")
+        Path(runtime, name).chmod(0o755)
+    Path(runtime, "umu").symlink_to("_v2-entry-point")
+    proton = Path(scratch, "launch", "UMU-Proton-9.0")
+    make_proton(proton, 0)
+    exe = Path(scratch, "launch", "game.exe")
+    exe.write_bytes(b"MZ")
+
+    env = {
+        "PATH": os.environ.get("PATH", "/usr/bin:/bin"),
+        "HOME": str(Path(scratch, "launch")),
+        "XDG_DATA_HOME": str(data),
+        "XDG_CACHE_HOME": str(Path(scratch, "launch", "cache")),
+        "PROTONPATH": str(proton),
+        "WINEPREFIX": str(Path(scratch, "launch", "pfx")),
+        "GAMEID": "umu-bench",
+        "UMU_RUNTIME_UPDATE": "0",
+    }
+    command = [sys.executable, str(umu_tools.UMU_RUN), str(exe)]
+
+    def launch():
+        proc = subprocess.run(command, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, text=True)
+        if proc.returncode:
+            lines = proc.stderr.strip().splitlines()
+            raise RuntimeError(f"umu-run exited with {proc.returncode}: {lines[-1] if lines else ''}")
+
+    # The first launch creates the prefix
+    launch()
+    return measure(launch, args.repeat)
+
+
+BENCHMARKS = {
+    "pstree": bench_pstree,
+    "fetch": bench_fetch,
+    "extract": bench_extract,
+    "backends": bench_backends,
+    "patch": bench_patch,
+    "launch": bench_launch,
+}
+
+
+def get_commit():
+    """Returns the commit of the checkout this script lives in, if any."""
+    try:
+        proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(os.path.realpath(__file__)).parent, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+    return proc.stdout.strip() if proc.returncode == 0 else ""
+
+
+def run_benchmarks(names, args):
+    """Runs the named benchmarks, each in its own scratch directory."""
+    saved = {k: os.environ.get(k) for k in ("XDG_CACHE_HOME", "XDG_DATA_HOME")}
+    with tempfile.TemporaryDirectory(prefix="umu-bench-") as scratch:
+        umu = load_umu(scratch)
+        results = {
+            "version": RESULTS_VERSION,
+            "commit": get_commit(),
+            "umu": umu.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created": int(time.time()),
+            "size_mib": args.size,
+            "results": {},
+        }
+        try:
+            for name in names:
+                workdir = Path(scratch, name)
+                workdir.mkdir()
+                print(f"{name}...", file=sys.stderr, flush=True)
+                try:
+                    results["results"][name] = BENCHMARKS[name](workdir, args)
+                except SkipBenchmark as e:
+                    results["results"][name] = {"skipped": str(e)}
+                except Exception as e:
+                    results["results"][name] = {"error": f"{type(e).__name__}: {e}"}
+                shutil.rmtree(workdir, ignore_errors=True)
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+    return results
+
+
+def compare_results(old, new, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares the medians of two result sets. Returns a list of
+    (name, old median, new median, ratio, regressed) for benchmarks both ran.
+    """
+    rows = []
+    for name, result in new["results"].items():
+        before = old["results"].get(name, {})
+        if "median" not in result or "median" not in before:
+            continue
+        ratio = result["median"] / before["median"] if before["median"] else 1.0
+        rows.append((name, before["median"], result["median"], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def print_results(results):
+    for name, result in results["results"].items():
+        if "skipped" in result:
+            print(f"{name:<10} skipped: {result['skipped']}")
+        elif "error" in result:
+            print(f"{name:<10} \033[31merror: {result['error']}\033[0m")
+        else:
+            rate = f"  {result['mb_s']:.1f} MB/s" if "mb_s" in result else ""
+            print(f"{name:<10} {result['median'] * 1000:>10.2f} ms (min {result['min'] * 1000:.2f}){rate}")
+            for key in ("gz", "xz", "patch", "verify", "fetch_patch"):
+                if isinstance(result.get(key), dict):
+                    sub = result[key]
+                    rate = f"  {sub['mb_s']:.1f} MB/s" if "mb_s" in sub else ""
+                    print(f"  {key:<12} {sub['median'] * 1000:>8.2f} ms{rate}")
+            for key, sub in result.get("backends", {}).items():
+                print(f"  {key:<12} {sub['median'] * 1000:>8.2f} ms  {sub['mb_s']:.1f} MB/s")
+
+
+def print_comparison(rows, threshold):
+    print(f"{'Benchmark':<10} {'Before':>12} {'After':>12} {'Change':>8}")
+    for name, before, after, ratio, regressed in rows:
+        flag = f"  \033[31mregression (>{threshold:.0%})\033[0m" if regressed else ""
+        print(f"{name:<10} {before * 1000:>9.2f} ms {after * 1000:>9.2f} ms {ratio - 1:>+8.1%}{flag}")
+    return any(row[4] for row in rows)
+
+
+def load_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def cmd_run(args):
+    names = args.only or list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmark(s): {', '.join(unknown)}", file=sys.stderr)
+        return 1
+
+    results = run_benchmarks(names, args)
+    print_results(results)
+
+    if args.output:
+        output = Path(args.output)
+    else:
+        output = results_dir() / f"{results['created']}-{results['commit'] or 'unknown'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        regressed = print_comparison(compare_results(load_results(args.baseline), results, args.threshold),
+                                     args.threshold)
+        return 1 if regressed else 0
+    return 1 if any("error" in r for r in results["results"].values()) else 0
+
+
+def cmd_compare(args):
+    rows = compare_results(load_results(args.old), load_results(args.new), args.threshold)
+    if not rows:
+        print("No benchmarks in common")
+        return 1
+    return 1 if print_comparison(rows, args.threshold) else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="umu_bench.py",
+        description="Benchmarks and regression checks for the bundled umu package",
+    )
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("run", help="run the benchmarks and store the results as JSON")
+    p.add_argument("only", nargs="*", help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    p.add_argument("-o", "--output", help=f"results file (default: {results_dir()}/<time>-<commit>.json)")
+    p.add_argument("-r", "--repeat", type=int, default=5, help="timed runs per benchmark")
+    p.add_argument("-s", "--size", type=int, default=64, help="size of the synthetic Proton builds (MiB)")
+    p.add_argument("--procs", type=int, default=2000, help="processes in the synthetic /proc")
+    p.add_argument("-b", "--baseline", help="earlier results to compare against")
+    p.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                   help="slowdown flagged as a regression (default: 0.10)")
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("compare", help="compare two results files")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                   help="slowdown flagged as a regression (default: 0.10)")
+    p.set_defaults(func=cmd_compare)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2400 @@
+#!/usr/bin/env python3
+"""
+Companion helpers for the bundled umu-run launcher.
+
+umu-run is a vendored zipapp build of umu-launcher, so everything here works
+from the outside: it wraps the launch and works on the on-disk layout umu
+uses (prefixes under ~/Games/umu, Proton builds in compatibilitytools.d and
+the runtime platforms in $XDG_DATA_HOME/umu).
+"""
+import argparse
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import stat
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+PROC = Path("/proc")
+SYS = Path("/sys")
+
+XDG_DATA_HOME = Path(os.environ.get("XDG_DATA_HOME") or Path.home() / ".local" / "share")
+XDG_CONFIG_HOME = Path(os.environ.get("XDG_CONFIG_HOME") or Path.home() / ".config")
+
+# umu-run sits next to this script; fall back to whatever is on the PATH
+UMU_RUN = Path(os.path.realpath(__file__)).parent / "umu-run"
+
+# Locations used by umu itself, see umu_consts.py in umu-run
+UMU_LOCAL = XDG_DATA_HOME / "umu"
+UMU_COMPAT = UMU_LOCAL / "compatibilitytools"
+STEAM_COMPAT = XDG_DATA_HOME / "Steam" / "compatibilitytools.d"
+UMU_GAMES = Path.home() / "Games" / "umu"
+
+# Where gc looks for umu TOML configs besides the ones seen at launch
+UMU_CONFIG_DIR = XDG_CONFIG_HOME / "umu"
+
+# Vulkan ICD manifests, read to tell which GPU driver the games run on
+VULKAN_ICD_DIRS = [Path("/usr/share/vulkan/icd.d"), Path("/etc/vulkan/icd.d")]
+
+# State kept by these helpers, separate from umu's own $XDG_DATA_HOME/umu
+TOOLS_HOME = XDG_DATA_HOME / "umu-tools"
+
+# How long after launch the game's mapped files are recorded, and how often
+SAMPLE_INTERVAL = 1.0
+PREFETCH_WINDOW = 60.0
+
+PREFETCH_WORKERS = 4
+
+# Steam Linux Runtime app IDs from toolmanifest.vdf and umu's directory names
+RUNTIME_APPIDS = {
+    "1628350": "steamrt3",  # sniper
+    "1391110": "steamrt2",  # soldier
+    "4183110": "steamrt4",
+}
+
+
+def log(msg):
+    """Prints a status line to stderr so the game's own output stays clean."""
+    print(f"\033[1;36m[umu-tools]\033[0m {msg}", file=sys.stderr, flush=True)
+
+
+def human_readable_size(size_bytes):
+    """Converts bytes to a human readable string."""
+    size = float(size_bytes)
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def get_gameid(env):
+    """Returns the GAMEID umu will use for this launch."""
+    return env.get("GAMEID") or "umu-default"
+
+
+def get_pstree_from_pid(root_pid, proc=PROC):
+    """
+    Returns the PIDs descending from root_pid.
+    Reads every /proc/<pid>/stat once and walks a parent -> children map.
+    """
+    children = {}
+    for entry in os.scandir(proc):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(os.path.join(entry.path, "stat"), "rb") as f:
+                data = f.read()
+        except OSError:
+            continue
+        # comm may contain spaces or parens, the fields after it do not
+        fields = data[data.rfind(b")") + 2:].split()
+        try:
+            ppid = int(fields[1])
+        except (IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry.name))
+
+    descendants = set()
+    stack = [root_pid]
+    while stack:
+        for pid in children.get(stack.pop(), ()):
+            if pid not in descendants:
+                descendants.add(pid)
+                stack.append(pid)
+    return descendants
+
+
+def read_mapped_files(pid, proc=PROC):
+    """Returns the file paths mapped by a process, in the order of its maps."""
+    paths = []
+    try:
+        with open(proc / str(pid) / "maps", "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                # address perms offset dev inode pathname
+                parts = line.split(None, 5)
+                if len(parts) < 6:
+                    continue
+                path = parts[5].rstrip("\n")
+                if path.startswith("/") and not path.endswith(" (deleted)"):
+                    paths.append(path)
+    except OSError:
+        pass
+    return paths
+
+
+def is_prefetchable(path, roots):
+    """Only regular files under the game, prefix or Proton directories are kept."""
+    if roots and not any(path == r or path.startswith(r + "/") for r in roots):
+        return False
+    return os.path.isfile(path)
+
+
+class PrefetchRecorder:
+    """Collects the files the game's process tree maps during its first minute."""
+
+    def __init__(self, roots, window=PREFETCH_WINDOW, proc=PROC):
+        self.roots = [r.rstrip("/") for r in roots if r]
+        self.window = window
+        self.proc = proc
+        self.started = time.monotonic()
+        self.seen = set()
+        self.files = []
+
+    def sample(self, pids):
+        if time.monotonic() - self.started > self.window:
+            return
+        for pid in pids:
+            for path in read_mapped_files(pid, self.proc):
+                if path in self.seen:
+                    continue
+                self.seen.add(path)
+                if is_prefetchable(path, self.roots):
+                    self.files.append(path)
+
+
+def prefetch_list_path(gameid):
+    return TOOLS_HOME / "prefetch" / f"{gameid}.json"
+
+
+def load_prefetch_list(gameid):
+    """Returns the recorded files for a GAMEID, or an empty list."""
+    try:
+        with open(prefetch_list_path(gameid), "r", encoding="utf-8") as f:
+            return json.load(f).get("files", [])
+    except (OSError, ValueError):
+        return []
+
+
+def save_prefetch_list(gameid, files):
+    """
+    Merges newly recorded files into the GAMEID's prefetch list.
+    Files from earlier launches keep their position; missing ones are dropped.
+    """
+    merged = [p for p in load_prefetch_list(gameid) if os.path.isfile(p)]
+    known = set(merged)
+    merged.extend(p for p in files if p not in known)
+
+    path = prefetch_list_path(gameid)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"gameid": gameid, "updated": int(time.time()), "files": merged}, f, indent=1)
+    os.replace(tmp, path)
+    return merged
+
+
+def fadvise_willneed(path):
+    """Asks the kernel to start reading a whole file into the page cache."""
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOATIME)
+    except PermissionError:
+        # O_NOATIME is refused for files we don't own
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return False
+    except OSError:
+        return False
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+def prefetch_files(files, workers=PREFETCH_WORKERS):
+    """
+    Issues WILLNEED hints for files with a few requests in flight, so the
+    disk can reorder them. Returns the number of files hinted.
+    """
+    if not files:
+        return 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(fadvise_willneed, files))
+
+
+def start_prefetch(gameid):
+    """Starts prefetching a GAMEID's recorded files in the background."""
+    files = load_prefetch_list(gameid)
+    if not files:
+        return None
+
+    def run():
+        started = time.monotonic()
+        count = prefetch_files(files)
+        log(f"Prefetched {count}/{len(files)} files in {time.monotonic() - started:.2f}s")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def get_install_path(env, command):
+    """Mirrors how umu derives STEAM_COMPAT_INSTALL_PATH from the executable."""
+    if env.get("STEAM_COMPAT_INSTALL_PATH"):
+        return env["STEAM_COMPAT_INSTALL_PATH"]
+    if command and os.path.isfile(os.path.expanduser(command[0])):
+        return str(Path(command[0]).expanduser().resolve().parent)
+    return ""
+
+
+def get_required_runtime(proton):
+    """Returns the runtime a Proton build asks for in its toolmanifest.vdf."""
+    try:
+        with open(Path(proton, "toolmanifest.vdf"), "r", encoding="utf-8") as f:
+            match = re.search(r'"require_tool_appid"\s+"(\d+)"', f.read())
+    except OSError:
+        return ""
+    return RUNTIME_APPIDS.get(match.group(1), match.group(1)) if match else ""
+
+
+def get_launch_paths(env, command, toml=None, catalog=None):
+    """
+    Returns the install path, prefix and Proton directory umu will use,
+    taken from the TOML config when launching with --config.
+    """
+    table = (toml or {}).get("umu", {})
+    exe = [table["exe"]] if table.get("exe") else command
+    prefix = table.get("prefix") or env.get("WINEPREFIX")
+    if not prefix:
+        prefix = str(UMU_GAMES / get_gameid(env))
+    return {
+        "install": get_install_path(env, exe),
+        "prefix": str(Path(prefix).expanduser()),
+        "proton": resolve_proton(table.get("proton") or env.get("PROTONPATH", ""), catalog),
+    }
+
+
+def resolve_proton(value, catalog=None):
+    """
+    Resolves PROTONPATH the way umu does: a directory name is looked up in
+    compatibilitytools.d, and a codename (or no PROTONPATH) means the latest
+    installed build of that family. umu may still update to a newer build
+    at launch.
+    """
+    if "/" in value:
+        return str(Path(value).expanduser())
+    if value and (STEAM_COMPAT / value).is_dir():
+        return str(STEAM_COMPAT / value)
+    if value and value not in PROTON_CODENAMES:
+        return ""
+    entry = find_tool(catalog or load_catalog(), value or "UMU-Proton")
+    return entry["path"] if entry else ""
+
+
+# PROTONPATH codenames umu resolves itself. GE-Latest and UMU-Latest are
+# installed under those names in $XDG_DATA_HOME/umu/compatibilitytools
+PROTON_CODENAMES = {"GE-Proton", "GE-Latest", "UMU-Latest"}
+
+CATALOG_VERSION = 1
+
+
+def catalog_path():
+    return TOOLS_HOME / "catalog.json"
+
+
+def parse_tool_version(name):
+    """Splits a tool directory name into a family and a version tuple.
+
+    GE-Proton9-20 -> ("GE-Proton", (9, 20)), UMU-Proton-9.0-3.2 -> ("UMU-Proton", (9, 0, 3, 2))
+    """
+    match = re.search(r"-?\d", name)
+    family = name[:match.start()] if match else name
+    return family, tuple(int(n) for n in re.findall(r"\d+", name[len(family):]))
+
+
+def get_tool_stamp(path):
+    """Changes whenever a tool is installed, replaced or patched in place."""
+    stamp = 0
+    for p in (path, path / "version", path / "toolmanifest.vdf"):
+        try:
+            stamp = max(stamp, os.stat(p).st_mtime_ns)
+        except OSError:
+            pass
+    return stamp
+
+
+def read_tool_entry(path, kind):
+    """Reads everything the catalog keeps about one installed tool."""
+    family, version = parse_tool_version(path.name)
+    entry = {
+        "name": path.name,
+        "path": str(path),
+        "kind": kind,
+        "family": family,
+        "version": list(version),
+        "stamp": get_tool_stamp(path),
+        "installed": int(path.stat().st_mtime),
+        "last_used": 0,
+    }
+    if kind == "proton":
+        entry["runtime"] = get_required_runtime(path)
+        # The version file holds "<build timestamp> <name>"
+        entry["build_id"] = get_proton_version(path).split(" ")[0]
+    else:
+        entry["platforms"] = sorted(p.name for p in path.glob("*_platform_*") if p.is_dir())
+    return entry
+
+
+def scan_tool_dirs():
+    """Returns the directories whose contents the catalog mirrors, with their kind."""
+    return [(STEAM_COMPAT, "proton"), (UMU_COMPAT, "proton"), (UMU_LOCAL, "runtime")]
+
+
+def list_tools(parent, kind):
+    try:
+        entries = [p for p in parent.iterdir() if p.is_dir() and not p.name.startswith(".")]
+    except OSError:
+        return []
+    if kind == "runtime":
+        # umu keeps one directory per runtime variant, e.g. steamrt3
+        return [p for p in entries if p.name.startswith("steamrt")]
+    return [p for p in entries if (p / "proton").is_file()]
+
+
+def refresh_catalog(catalog):
+    """
+    Brings the catalog up to date. A tool directory is only listed again
+    when its mtime changed, which happens whenever a tool is added,
+    removed or renamed in it. Returns True if anything changed.
+    """
+    changed = False
+    for parent, kind in scan_tool_dirs():
+        try:
+            mtime = os.stat(parent).st_mtime_ns
+        except OSError:
+            mtime = 0
+        if catalog["dirs"].get(str(parent)) == mtime:
+            continue
+        changed = True
+        catalog["dirs"][str(parent)] = mtime
+
+        present = {str(p): p for p in list_tools(parent, kind)}
+        for key in [k for k, e in catalog["tools"].items()
+                    if e["kind"] == kind and Path(k).parent == parent and k not in present]:
+            del catalog["tools"][key]
+        for key, path in present.items():
+            old = catalog["tools"].get(key)
+            if old and old["stamp"] == get_tool_stamp(path):
+                continue
+            entry = read_tool_entry(path, kind)
+            if old:
+                entry["last_used"] = old.get("last_used", 0)
+            catalog["tools"][key] = entry
+    return changed
+
+
+def load_catalog():
+    """Returns the catalog of installed tools, refreshed and saved if stale."""
+    try:
+        with open(catalog_path(), "r", encoding="utf-8") as f:
+            catalog = json.load(f)
+        if catalog.get("version") != CATALOG_VERSION:
+            raise ValueError
+    except (OSError, ValueError):
+        catalog = {"version": CATALOG_VERSION, "dirs": {}, "tools": {}}
+    if refresh_catalog(catalog):
+        save_catalog(catalog)
+    return catalog
+
+
+def save_catalog(catalog):
+    path = catalog_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def find_tool(catalog, name):
+    """
+    Looks up a tool by path or name. A family name such as GE-Proton gives
+    its newest installed build.
+    """
+    tools = catalog["tools"]
+    if name in tools:
+        return tools[name]
+    exact = [e for e in tools.values() if e["name"] == name]
+    if exact:
+        return exact[0]
+    family = [e for e in tools.values() if e["kind"] == "proton" and e["family"] == name]
+    return max(family, key=lambda e: e["version"], default=None)
+
+
+def mark_tool_used(catalog, proton):
+    """Records a launch of a Proton build and of the runtime it requires."""
+    now = int(time.time())
+    entry = catalog["tools"].get(str(proton))
+    if entry is None:
+        return
+    # Patched in place since the last listing (umu applies deltas to UMU-Proton)
+    path = Path(proton)
+    if entry["stamp"] != get_tool_stamp(path) and path.is_dir():
+        entry.update({k: v for k, v in read_tool_entry(path, "proton").items() if k != "last_used"})
+    entry["last_used"] = now
+    runtime = catalog["tools"].get(str(UMU_LOCAL / entry.get("runtime", "")))
+    if runtime and entry.get("runtime"):
+        runtime["last_used"] = now
+    save_catalog(catalog)
+
+
+def set_child_subreaper():
+    """Keeps orphaned game processes parented to us so they stay in the pstree."""
+    import ctypes
+    import ctypes.util
+
+    PR_SET_CHILD_SUBREAPER = 36
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        return libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+    except OSError:
+        return False
+
+
+def reap_children(keep=None):
+    """
+    Collects any reparented children that have exited. The child keep
+    (umu-run's Popen) is left alone, so Popen still gets its exit status.
+    """
+    while True:
+        try:
+            info = os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOHANG | os.WNOWAIT)
+        except ChildProcessError:
+            return
+        if info is None or info.si_pid == keep:
+            return
+        try:
+            os.waitpid(info.si_pid, 0)
+        except ChildProcessError:
+            return
+
+
+def get_config_path(command):
+    """Returns the TOML file when umu-run is called as `umu-run --config <file>`."""
+    if len(command) >= 2 and command[0] == "--config":
+        return Path(command[1]).expanduser()
+    return None
+
+
+def load_toml(path):
+    """Reads a TOML file, or returns an empty dict when it can't be read."""
+    try:
+        import tomllib
+    except ModuleNotFoundError:
+        log("tomllib requires Python 3.11, ignoring TOML config")
+        return {}
+    try:
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        log(f"Could not read {path}: {e}")
+        return {}
+
+
+# Keys a game may set in a library manifest: those of umu's [umu] table,
+# plus extra env variables and a [sched] table
+LIBRARY_KEYS = {"proton", "prefix", "exe", "game_id", "store", "launch_args", "env", "sched"}
+
+LIBRARY_VERSION = 1
+
+
+def library_cache_path(config, digest):
+    """Compiled libraries are named by the manifest's path and content hash."""
+    source = hashlib.blake2b(str(config).encode(), digest_size=8).hexdigest()
+    return TOOLS_HOME / "library" / f"{source}-{digest}.json"
+
+
+def compile_library_game(name, defaults, table):
+    """
+    Merges a game's table over the library defaults into an umu style config
+    ({"umu": ..., "sched": ..., "env": ...}). The prefix defaults to
+    ~/Games/umu/<name>. Raises ValueError for a malformed entry.
+    """
+    if not isinstance(table, dict):
+        raise ValueError("not a table")
+    merged = {**defaults, **table}
+    for key in ("env", "sched"):
+        # Tables are merged key by key, so both sides have to be tables
+        for where, source in (("[defaults] ", defaults), ("", table)):
+            if not isinstance(source.get(key, {}), dict):
+                raise ValueError(f"{where}'{key}' must be a table")
+        merged[key] = {**defaults.get(key, {}), **table.get(key, {})}
+    unknown = set(merged) - LIBRARY_KEYS
+    if unknown:
+        raise ValueError(f"unknown key(s): {', '.join(sorted(unknown))}")
+    merged.setdefault("prefix", str(UMU_GAMES / name))
+
+    umu = {}
+    for key in ("proton", "prefix", "exe", "game_id", "store"):
+        if key not in merged:
+            if key in ("proton", "exe"):
+                raise ValueError(f"'{key}' is required")
+            continue
+        if not isinstance(merged[key], str) or not merged[key]:
+            raise ValueError(f"'{key}' must be a non-empty string")
+        umu[key] = merged[key]
+    for key in ("prefix", "exe"):
+        umu[key] = str(Path(umu[key]).expanduser())
+    if "/" in umu["proton"]:
+        umu["proton"] = str(Path(umu["proton"]).expanduser())
+
+    # Same as umu: a string is split on spaces
+    launch_args = merged.get("launch_args", [])
+    if isinstance(launch_args, str):
+        launch_args = launch_args.split(" ")
+    if not isinstance(launch_args, list):
+        raise ValueError("'launch_args' must be a list or a string")
+    umu["launch_args"] = [str(arg) for arg in launch_args]
+
+    try:
+        load_sched_policy({}, merged)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"[sched]: {e}")
+    return {
+        "umu": umu,
+        "sched": merged["sched"],
+        "env": {key: str(value) for key, value in merged["env"].items()},
+    }
+
+
+def compile_library(config):
+    """
+    Returns the compiled form of a library manifest: its [defaults] merged
+    into every [games.<name>] table. The result is cached by the file's
+    content hash, so an unchanged manifest is only hashed, not parsed. A
+    malformed game is kept as {"error": ...} so the rest of the library
+    still works. Raises ValueError when the file isn't a library.
+    """
+    config = Path(config).expanduser().resolve()
+    data = config.read_bytes()
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    cache = library_cache_path(config, digest)
+    try:
+        with open(cache, "r", encoding="utf-8") as f:
+            library = json.load(f)
+        if library.get("version") == LIBRARY_VERSION:
+            return library
+    except (OSError, ValueError):
+        pass
+
+    try:
+        import tomllib
+    except ModuleNotFoundError:
+        raise ValueError("tomllib requires Python 3.11")
+    try:
+        toml = tomllib.loads(data.decode("utf-8"))
+    except (UnicodeDecodeError, tomllib.TOMLDecodeError) as e:
+        raise ValueError(f"Could not read {config}: {e}")
+    if not isinstance(toml.get("games"), dict):
+        raise ValueError(f"No [games] table in {config}")
+    defaults = toml.get("defaults", {})
+    if not isinstance(defaults, dict):
+        raise ValueError(f"[defaults] in {config} is not a table")
+
+    games = {}
+    for name, table in toml["games"].items():
+        try:
+            games[name] = compile_library_game(name, defaults, table)
+        except ValueError as e:
+            games[name] = {"error": str(e)}
+    library = {"version": LIBRARY_VERSION, "source": str(config), "digest": digest, "games": games}
+
+    # Drop the caches of earlier versions of this manifest
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    for old in cache.parent.glob(cache.name.split("-", 1)[0] + "-*.json"):
+        old.unlink(missing_ok=True)
+    tmp = cache.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(library, f, indent=1, sort_keys=True)
+    os.replace(tmp, cache)
+    return library
+
+
+def get_library_game(config, name):
+    """Returns a compiled game from a library, or raises ValueError."""
+    game = compile_library(config)["games"].get(name)
+    if game is None:
+        raise ValueError(f"No game '{name}' in {config}")
+    if "error" in game:
+        raise ValueError(f"Game '{name}' in {config}: {game['error']}")
+    return game
+
+
+def check_library_game(game, catalog):
+    """Returns what would keep umu from launching a compiled game."""
+    if "error" in game:
+        return [game["error"]]
+    umu = game["umu"]
+    problems = []
+    if not os.path.isfile(umu["exe"]):
+        problems.append(f"exe is not a file: {umu['exe']}")
+    # Codenames are downloaded by umu when missing
+    if umu["proton"] not in PROTON_CODENAMES:
+        proton = resolve_proton(umu["proton"], catalog)
+        if not proton or not os.path.isfile(os.path.join(proton, "proton")):
+            problems.append(f"proton is not a Proton directory: {umu['proton']}")
+    # umu creates a missing prefix
+    if os.path.exists(umu["prefix"]) and not os.path.isdir(umu["prefix"]):
+        problems.append(f"prefix is not a directory: {umu['prefix']}")
+    return problems
+
+
+def validate_library(library, catalog, workers=8):
+    """Checks every game of a compiled library in parallel: {name: [problems]}."""
+    names = sorted(library["games"])
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda name: check_library_game(library["games"][name], catalog), names)
+        return dict(zip(names, results))
+
+
+def parse_cpu_list(value):
+    """Parses a cpuset style list such as "0-3,6" into a set of CPU numbers."""
+    cpus = set()
+    for part in str(value).replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+IOPRIO_CLASSES = {"rt": 1, "be": 2, "idle": 3}
+
+
+def parse_ioprio(value):
+    """Parses "be:4", "rt:0" or "idle" into an ioprio (class, level) pair."""
+    cls, _, level = str(value).partition(":")
+    if cls not in IOPRIO_CLASSES:
+        raise ValueError(f"Unknown I/O scheduling class: '{cls}'")
+    level = int(level) if level else 4
+    if not 0 <= level <= 7:
+        raise ValueError(f"I/O priority level out of range 0-7: {level}")
+    return IOPRIO_CLASSES[cls], level
+
+
+# [sched] keys in the umu TOML config and the env variables overriding them
+SCHED_KEYS = {
+    "affinity": "UMU_SCHED_AFFINITY",
+    "nice": "UMU_SCHED_NICE",
+    "ioprio": "UMU_SCHED_IOPRIO",
+    "cgroup": "UMU_SCHED_CGROUP",
+    "cpu_weight": "UMU_SCHED_CPU_WEIGHT",
+    "io_weight": "UMU_SCHED_IO_WEIGHT",
+}
+
+
+def load_sched_policy(env, toml=None):
+    """
+    Builds the scheduling policy for a launch from the [sched] table of the
+    umu TOML config, with UMU_SCHED_* env variables taking precedence.
+    Returns None when no policy was asked for.
+    """
+    table = dict((toml or {}).get("sched", {}))
+    for key, var in SCHED_KEYS.items():
+        if env.get(var):
+            table[key] = env[var]
+    if not table:
+        return None
+
+    policy = {}
+    if "affinity" in table:
+        policy["affinity"] = parse_cpu_list(table["affinity"])
+    if "nice" in table:
+        policy["nice"] = int(table["nice"])
+    if "ioprio" in table:
+        policy["ioprio"] = parse_ioprio(table["ioprio"])
+    if str(table.get("cgroup", "")).lower() in {"1", "true", "yes"}:
+        policy["cgroup"] = True
+        policy["cpu_weight"] = int(table.get("cpu_weight", 0)) or None
+        policy["io_weight"] = int(table.get("io_weight", 0)) or None
+    return policy
+
+
+def ioprio_set(tid, cls, level):
+    """Sets the I/O priority of a thread through the ioprio_set syscall."""
+    import ctypes
+    import ctypes.util
+    import platform
+
+    SYS_ioprio_set = {"x86_64": 251, "aarch64": 30, "i686": 289}.get(platform.machine())
+    if SYS_ioprio_set is None:
+        raise OSError(f"ioprio_set is not known on {platform.machine()}")
+    IOPRIO_WHO_PROCESS = 1
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    if libc.syscall(SYS_ioprio_set, IOPRIO_WHO_PROCESS, tid, (cls << 13) | level) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def get_cgroup_root():
+    """Returns the cgroup v2 directory of this process, or None without cgroup v2."""
+    try:
+        with open(PROC / "self" / "cgroup", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    path = Path("/sys/fs/cgroup") / line[3:].strip().lstrip("/")
+                    return path if (path / "cgroup.procs").exists() else None
+    except OSError:
+        pass
+    return None
+
+
+class SchedPolicy:
+    """
+    Applies a scheduling policy to every thread of the game's pstree.
+    Runs on each sample so processes spawned late by launchers or shader
+    compilers are caught too.
+    """
+
+    def __init__(self, policy, gameid, proc=PROC):
+        self.policy = policy
+        self.proc = proc
+        self.applied = set()
+        self.warned = set()
+        self.cgroup = None
+        if policy.get("cgroup"):
+            self.cgroup = self.create_cgroup(gameid)
+
+    def warn_once(self, what, e):
+        if what not in self.warned:
+            self.warned.add(what)
+            log(f"Could not set {what}: {e}")
+
+    def create_cgroup(self, gameid):
+        """Creates a sibling cgroup for the game next to our own one."""
+        own = get_cgroup_root()
+        if own is None:
+            self.warn_once("cgroup", "cgroup v2 is not mounted")
+            return None
+        group = own.parent / f"umu-{gameid}.{os.getpid()}"
+        self.sweep_cgroups(own.parent)
+        try:
+            (own.parent / "cgroup.subtree_control").write_text("+cpu +io")
+        except OSError:
+            pass  # Usually already enabled by systemd
+        try:
+            group.mkdir(exist_ok=True)
+        except OSError as e:
+            self.warn_once("cgroup", e)
+            return None
+        # A controller that isn't delegated to us only loses its own knob
+        knobs = {}
+        if self.policy.get("cpu_weight"):
+            knobs["cpu.weight"] = str(self.policy["cpu_weight"])
+        if self.policy.get("io_weight"):
+            knobs["io.weight"] = f"default {self.policy['io_weight']}"
+        for knob, value in knobs.items():
+            try:
+                (group / knob).write_text(value)
+            except OSError as e:
+                self.warn_once(knob, e)
+        return group
+
+    def sweep_cgroups(self, parent):
+        """Removes the empty cgroups of earlier launches whose umu_tools has exited."""
+        try:
+            groups = [p for p in parent.iterdir() if p.name.startswith("umu-")]
+        except OSError:
+            return
+        for group in groups:
+            pid = group.name.rsplit(".", 1)[-1]
+            if not pid.isdigit() or (self.proc / pid).exists():
+                continue
+            try:
+                group.rmdir()
+            except OSError:
+                pass  # Still has processes in it; the next launch tries again
+
+    def remove_cgroup(self, attempts=10, delay=0.2):
+        """
+        Removes the game's cgroup. Stragglers still exiting keep it busy
+        (EBUSY) for a moment, so this retries, reaping them in between. A
+        group that stays busy is swept by the next launch.
+        """
+        if self.cgroup is None:
+            return
+        for attempt in range(attempts):
+            try:
+                self.cgroup.rmdir()
+                return
+            except FileNotFoundError:
+                return
+            except OSError as e:
+                if e.errno != errno.EBUSY or attempt == attempts - 1:
+                    log(f"Could not remove {self.cgroup}: {e}")
+                    return
+            time.sleep(delay)
+            reap_children()
+
+    def get_threads(self, pid):
+        try:
+            return [int(t) for t in os.listdir(self.proc / str(pid) / "task")]
+        except OSError:
+            return []
+
+    def apply(self, tid):
+        if "affinity" in self.policy:
+            try:
+                os.sched_setaffinity(tid, self.policy["affinity"])
+            except OSError as e:
+                self.warn_once("CPU affinity", e)
+        if "nice" in self.policy:
+            try:
+                os.setpriority(os.PRIO_PROCESS, tid, self.policy["nice"])
+            except OSError as e:
+                self.warn_once("nice", e)
+        if "ioprio" in self.policy:
+            try:
+                ioprio_set(tid, *self.policy["ioprio"])
+            except OSError as e:
+                self.warn_once("ioprio", e)
+
+    def sample(self, pids):
+        for pid in pids:
+            if self.cgroup is not None and pid not in self.applied:
+                try:
+                    (self.cgroup / "cgroup.procs").write_text(str(pid))
+                except OSError as e:
+                    self.warn_once("cgroup", e)
+            # setaffinity and setpriority act on single threads on Linux
+            for tid in self.get_threads(pid):
+                if tid not in self.applied:
+                    self.applied.add(tid)
+                    self.apply(tid)
+            self.applied.add(pid)
+
+
+@contextmanager
+def unix_flock(path):
+    """Holds an exclusive flock(2) on a lock file shared with umu-run."""
+    fd = os.open(path, os.O_CREAT | os.O_WRONLY, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield fd
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class Mount:
+    """One line of /proc/self/mountinfo."""
+
+    def __init__(self, mount_id, device, root, mount_point, options, fstype, source, super_options):
+        self.mount_id = mount_id
+        self.device = device  # major:minor, shared by bind mounts of the same filesystem
+        self.root = root  # directory of the filesystem mounted here, "/" unless bind mounted
+        self.mount_point = mount_point
+        self.options = options
+        self.fstype = fstype
+        self.source = source
+        self.super_options = super_options
+
+    def __repr__(self):
+        return f"Mount({self.mount_point!r}, {self.fstype!r}, {self.source!r})"
+
+
+def unescape_mountinfo(field):
+    """Decodes the octal escapes (\\040 for a space) the kernel uses in mountinfo."""
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), field)
+
+
+def parse_mountinfo(text):
+    """Parses mountinfo into a dict of mount point -> Mount, see proc_pid_mountinfo(5)."""
+    mounts = {}
+    for line in text.splitlines():
+        fields = line.split()
+        try:
+            # Optional fields run up to a lone "-"
+            sep = fields.index("-", 6)
+            mount = Mount(
+                mount_id=int(fields[0]),
+                device=fields[2],
+                root=unescape_mountinfo(fields[3]),
+                mount_point=unescape_mountinfo(fields[4]),
+                options=fields[5].split(","),
+                fstype=fields[sep + 1],
+                source=unescape_mountinfo(fields[sep + 2]),
+                super_options=fields[sep + 3].split(",") if len(fields) > sep + 3 else [],
+            )
+        except (ValueError, IndexError):
+            continue
+        # Later mounts on the same point hide the earlier ones
+        mounts[mount.mount_point] = mount
+    return mounts
+
+
+class MountTable:
+    """
+    The mounts of this process's namespace, parsed once. A lookup resolves
+    symlinks (a Steam library linked in from another disk lives on that
+    disk), then walks up the path's components with dict lookups only, so
+    it sees bind mounts and Flatpak namespaces as the kernel does.
+    """
+
+    def __init__(self, text=None):
+        if text is None:
+            with open(PROC / "self" / "mountinfo", "r", encoding="utf-8") as f:
+                text = f.read()
+        self.mounts = parse_mountinfo(text)
+
+    def lookup(self, path):
+        """Returns the Mount a path lives on (the longest matching mount point)."""
+        path = os.path.realpath(path)
+        while True:
+            if path in self.mounts:
+                return self.mounts[path]
+            if path == "/":
+                return None
+            path = os.path.dirname(path)
+
+
+_mount_table = None
+
+
+def get_mount_table():
+    global _mount_table
+    if _mount_table is None:
+        _mount_table = MountTable()
+    return _mount_table
+
+
+# Filesystems implementing FICLONE
+REFLINK_FS = {"btrfs", "xfs", "bcachefs", "zfs", "ocfs2"}
+
+
+def can_reflink(src, dst, table=None):
+    """True when src and dst share a filesystem that supports reflinks."""
+    table = table or get_mount_table()
+    a, b = table.lookup(src), table.lookup(dst)
+    return a is not None and b is not None and a.device == b.device and a.fstype in REFLINK_FS
+
+
+# ioctl from linux/fs.h cloning a whole file into another (reflink)
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Creates dst as a copy-on-write clone of src. Raises OSError if unsupported."""
+    with open(src, "rb") as fsrc:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(fd, FICLONE, fsrc.fileno())
+        except OSError:
+            os.close(fd)
+            os.unlink(dst)
+            raise
+        os.close(fd)
+
+
+def is_read_only(st):
+    return not st.st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+
+def clone_file(src, dst, st, stats):
+    """
+    Clones one file by reflink, hardlinks read-only files where reflinks are
+    not supported and copies the rest. Counts the method used in stats.
+    """
+    if stats.get("reflink", True) is not False:
+        try:
+            reflink(src, dst)
+            shutil.copystat(src, dst)
+            stats["reflinked"] += 1
+            return
+        except OSError:
+            # Don't retry on every file once the filesystem said no
+            stats["reflink"] = False
+    if is_read_only(st):
+        try:
+            os.link(src, dst)
+            stats["hardlinked"] += 1
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    stats["copied"] += 1
+    stats["copied_bytes"] += st.st_size
+
+
+def clone_tree(src, dst):
+    """
+    Clones a prefix directory tree. Symlinks are recreated, with absolute
+    links into src (such as umu's pfx link) pointing into dst instead.
+    Directory stats are applied once the whole tree is in place, since
+    filling a directory changes its mtime.
+    """
+    src = str(src).rstrip("/")
+    dst = str(dst).rstrip("/")
+    stats = {"reflinked": 0, "hardlinked": 0, "copied": 0, "copied_bytes": 0, "symlinks": 0}
+    if not can_reflink(src, os.path.dirname(dst)):
+        stats["reflink"] = False
+
+    made = []
+    for root, dirs, files in os.walk(src):
+        rel = os.path.relpath(root, src)
+        target_root = dst if rel == "." else os.path.join(dst, rel)
+        os.makedirs(target_root, exist_ok=True)
+        made.append((root, target_root))
+
+        for name in dirs + files:
+            source = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            st = os.lstat(source)
+            if stat.S_ISLNK(st.st_mode):
+                link = os.readlink(source)
+                if link == src or link.startswith(src + "/"):
+                    link = dst + link[len(src):]
+                os.symlink(link, target)
+                stats["symlinks"] += 1
+                # os.walk lists symlinked directories in dirs but won't follow them
+                if name in dirs:
+                    dirs.remove(name)
+            elif stat.S_ISREG(st.st_mode):
+                clone_file(source, target, st, stats)
+    # Deepest first, so read-only directories are locked after their contents
+    for root, target_root in reversed(made):
+        shutil.copystat(root, target_root)
+    stats.pop("reflink", None)
+    return stats
+
+
+def get_proton_version(proton):
+    """Returns the build string from a Proton directory's version file."""
+    try:
+        return Path(proton, "version").read_text(encoding="utf-8").strip()
+    except OSError:
+        return Path(proton).name
+
+
+def template_path(proton):
+    return TOOLS_HOME / "templates" / Path(proton).name
+
+
+def get_template(proton):
+    """Returns the template prefix for a Proton build, or None if it is missing or stale."""
+    path = template_path(proton)
+    try:
+        with open(path / "umu-template.json", "r", encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if info.get("version") != get_proton_version(proton):
+        return None
+    return path / "prefix"
+
+
+def create_template(proton, umu_run):
+    """
+    Lets Proton populate a fresh prefix once and keeps it as the template
+    for this build. Returns the template prefix path.
+    """
+    path = template_path(proton)
+    staging = path.with_name(path.name + ".new")
+    shutil.rmtree(staging, ignore_errors=True)
+    prefix = staging / "prefix"
+    prefix.mkdir(parents=True)
+
+    env = os.environ.copy()
+    env.update({"WINEPREFIX": str(prefix), "PROTONPATH": str(proton), "GAMEID": "umu-default"})
+    ret = subprocess.run([umu_run, "createprefix"], env=env).returncode
+    if ret != 0:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise RuntimeError(f"umu-run createprefix exited with status {ret}")
+
+    info = {"proton": str(proton), "version": get_proton_version(proton), "created": int(time.time())}
+    with open(staging / "umu-template.json", "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=1)
+
+    # The pfx link umu created points into the staging directory
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(staging, path)
+    pfx = path / "prefix" / "pfx"
+    if pfx.is_symlink():
+        pfx.unlink()
+        pfx.symlink_to(path / "prefix")
+    return path / "prefix"
+
+
+def is_empty_prefix(prefix):
+    """
+    True for a prefix Proton hasn't populated yet: missing, or holding only
+    what umu's prefix setup creates (the pfx link, tracked_files, and
+    drive_c/users with an empty steamuser directory and links to it).
+    """
+    try:
+        if set(os.listdir(prefix)) - {"pfx", "tracked_files", "drive_c"}:
+            return False
+        drive_c = os.path.join(prefix, "drive_c")
+        if not os.path.lexists(drive_c):
+            return True
+        if set(os.listdir(drive_c)) - {"users"}:
+            return False
+        users = os.path.join(drive_c, "users")
+        if not os.path.lexists(users):
+            return True
+        for name in os.listdir(users):
+            path = os.path.join(users, name)
+            if os.path.islink(path):
+                continue
+            if not os.path.isdir(path) or os.listdir(path):
+                return False
+        return True
+    except FileNotFoundError:
+        return True
+    except NotADirectoryError:
+        return False
+
+
+def clone_prefix(proton, prefix):
+    """
+    Clones the Proton build's template into a new prefix under umu's prefix
+    lock. Returns the clone stats, or None when there was nothing to do.
+    """
+    template = get_template(proton)
+    if template is None:
+        return None
+    UMU_LOCAL.mkdir(parents=True, exist_ok=True)
+    with unix_flock(str(UMU_LOCAL / "pfx.lock")):
+        if not is_empty_prefix(prefix):
+            return None
+        shutil.rmtree(prefix, ignore_errors=True)
+        return clone_tree(template, prefix)
+
+
+def get_hasher():
+    """Returns a fast 128-bit hash constructor: xxh3 if installed, else BLAKE2b."""
+    try:
+        import xxhash
+        return xxhash.xxh3_128
+    except ImportError:
+        return lambda: hashlib.blake2b(digest_size=16)
+
+
+def hash_file(path, new_hash=None, bufsize=1 << 20):
+    """Hashes a file in chunks. Returns None if it can't be read."""
+    h = (new_hash or get_hasher())()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(bufsize):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def scan_prefix(prefix, min_size=1):
+    """Returns (size, dev, ino, path, read_only, mtime_ns) for every regular file in a prefix."""
+    files = []
+    stack = [str(prefix)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            if st.st_size >= min_size:
+                                files.append((st.st_size, st.st_dev, st.st_ino, entry.path,
+                                              is_read_only(st), st.st_mtime_ns))
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return files
+
+
+def get_known_prefixes():
+    """Returns the prefixes umu created under ~/Games/umu."""
+    try:
+        return sorted(p for p in UMU_GAMES.iterdir() if p.is_dir() and not p.is_symlink())
+    except OSError:
+        return []
+
+
+def find_duplicates(prefixes, min_size=4096, workers=4):
+    """
+    Groups identical files across prefixes: by filesystem and size first,
+    then by hash of the remaining candidates. Only files on one filesystem
+    can share extents, so a group never spans two. Files already sharing an
+    inode count once. Returns lists of [(path, size, read_only, stamp), ...],
+    stamp being the file's (size, mtime_ns, dev, ino) when it was scanned.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        scans = list(pool.map(lambda p: scan_prefix(p, min_size), prefixes))
+
+    by_size = {}
+    seen_inodes = set()
+    for files in scans:
+        for size, dev, ino, path, read_only, mtime in files:
+            if (dev, ino) in seen_inodes:
+                continue
+            seen_inodes.add((dev, ino))
+            by_size.setdefault((dev, size), []).append((path, size, read_only, (size, mtime, dev, ino)))
+
+    candidates = [group for group in by_size.values() if len(group) > 1]
+    new_hash = get_hasher()
+    flat = [f for group in candidates for f in group]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = pool.map(lambda f: hash_file(f[0], new_hash), flat)
+
+    by_digest = {}
+    for entry, digest in zip(flat, digests):
+        if digest is not None:
+            by_digest.setdefault((entry[3][2], entry[1], digest), []).append(entry)
+    return [group for group in by_digest.values() if len(group) > 1]
+
+
+def is_unchanged(path, stamp):
+    """True if path is still the file find_duplicates hashed: same size, mtime, dev and inode."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return (st.st_size, st.st_mtime_ns, st.st_dev, st.st_ino) == stamp
+
+
+def replace_with_link(keep, dup, reflink_ok, try_reflink=True):
+    """
+    Replaces dup by a reflink of keep, or by a hardlink when both files are
+    read-only. keep and dup are find_duplicates entries. A running game can
+    still write to a prefix, so neither file may have changed since it was
+    hashed. reflink_ok maps filesystems (st_dev) to whether they support
+    reflinks, and is filled in from the first clone tried on each;
+    try_reflink=False goes straight to hardlinking. Returns
+    the method used, "changed" if one of the files did, or None if linking
+    isn't safe.
+    """
+    keep, _, keep_read_only, keep_stamp = keep
+    dup, _, dup_read_only, dup_stamp = dup
+    dev = keep_stamp[2]
+
+    def swap(tmp):
+        if not (is_unchanged(keep, keep_stamp) and is_unchanged(dup, dup_stamp)):
+            os.unlink(tmp)
+            return False
+        os.replace(tmp, dup)
+        return True
+
+    tmp = f"{dup}.umu-dedupe"
+    if try_reflink and reflink_ok.get(dev, True):
+        try:
+            reflink(keep, tmp)
+            reflink_ok[dev] = True
+            shutil.copystat(dup, tmp)
+            return "reflink" if swap(tmp) else "changed"
+        except OSError as e:
+            # Only the filesystem refusing clones says anything about the
+            # next file; EXDEV, EACCES and such are about this pair
+            if e.errno in (errno.EOPNOTSUPP, errno.EINVAL):
+                reflink_ok[dev] = False
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+    # A hardlink shares writes too, so only files nobody writes to qualify
+    if dup_read_only and keep_read_only:
+        try:
+            os.link(keep, tmp)
+            return "hardlink" if swap(tmp) else "changed"
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+    return None
+
+
+def dedupe(groups, dry_run=False):
+    """Links duplicates to the first file of each group and reports what was reclaimed."""
+    report = {"groups": len(groups), "duplicates": 0, "reflink": 0, "hardlink": 0,
+              "skipped": 0, "reclaimable_bytes": 0, "reclaimed_bytes": 0}
+    reflink_ok = {}
+    for group in groups:
+        keep = group[0][0]
+        for dup in group[1:]:
+            size = dup[1]
+            report["duplicates"] += 1
+            report["reclaimable_bytes"] += size
+            if dry_run:
+                continue
+            # A prefix reached through a symlink or bind mount can sit on
+            # another filesystem than the keeper, whatever st_dev says
+            method = replace_with_link(group[0], dup, reflink_ok, can_reflink(keep, dup[0]))
+            if method in ("changed", None):
+                report["skipped"] += 1
+                continue
+            report[method] += 1
+            report["reclaimed_bytes"] += size
+    return report
+
+
+# Winetricks settings verbs, bare or as key=value. Settings may be applied
+# again at any time, so they never count as installed. Taken from the
+# WINETRICKS_SETTINGS_VERBS list in umu_consts.py.
+WINETRICKS_SETTINGS = {
+    "alldlls=builtin", "alldlls=default", "autostart_winedbg=disabled",
+    "autostart_winedbg=enabled", "bad", "cfc=disabled", "cfc=enabled", "csmt=force", "csmt=off",
+    "csmt=on", "fontfix", "fontsmooth=bgr", "fontsmooth=disable", "fontsmooth=gray",
+    "fontsmooth=rgb", "forcemono", "good", "grabfullscreen=n", "grabfullscreen=y", "gsm=0",
+    "gsm=1", "gsm=2", "gsm=3", "heapcheck", "hidewineexports=disable", "hidewineexports=enable",
+    "hosts", "isolate_home", "macdriver=mac", "macdriver=x11", "mackeyremap=both",
+    "mackeyremap=left", "mackeyremap=none", "mimeassoc=off", "mimeassoc=on", "mwo=disable",
+    "mwo=enabled", "mwo=force", "native_mdac", "native_oleaut32", "nocrashdialog", "npm=repack",
+    "nt351", "nt40", "orm=backbuffer", "orm=fbo", "psm=0", "psm=1", "psm=2", "psm=3",
+    "remove_mono", "renderer=gdi", "renderer=gl", "renderer=no3d", "renderer=vulkan",
+    "rtlm=auto", "rtlm=disabled", "rtlm=readdraw", "rtlm=readtex", "rtlm=texdraw",
+    "rtlm=textex", "sandbox", "set_mididevice", "set_userpath", "shader_backend=arb",
+    "shader_backend=glsl", "shader_backend=none", "sound=alsa", "sound=coreaudio",
+    "sound=disabled", "sound=oss", "sound=pulse", "ssm=disabled", "ssm=enabled",
+    "usetakefocus=n", "usetakefocus=y", "vd=1024x768", "vd=1280x1024", "vd=1440x900",
+    "vd=640x480", "vd=800x600", "vd=off", "videomemorysize=1024", "videomemorysize=2048",
+    "videomemorysize=512", "videomemorysize=default", "vista", "vsm=0", "vsm=1", "vsm=2",
+    "vsm=3", "win10", "win11", "win20", "win2k", "win2k3", "win2k8", "win2k8r2", "win30",
+    "win31", "win7", "win8", "win81", "win95", "win98", "windowmanagerdecorated=n",
+    "windowmanagerdecorated=y", "windowmanagermanaged=n", "windowmanagermanaged=y", "winme",
+    "winver=", "winxp",
+}
+
+WINETRICKS_VERB = re.compile(r"^[a-zA-Z_0-9-]+(=[a-zA-Z0-9]*)?$")
+
+
+def is_settings_verb(verb):
+    return verb in WINETRICKS_SETTINGS
+
+
+def read_winetricks_log(prefix):
+    """Returns the set of verbs recorded in a prefix's winetricks.log."""
+    try:
+        with open(Path(prefix, "winetricks.log"), "r", encoding="utf-8", errors="replace") as f:
+            return {line.strip() for line in f if line.strip()}
+    except OSError:
+        return set()
+
+
+def get_missing_verbs(prefix, verbs):
+    """Returns the verbs still to install in a prefix, keeping their order."""
+    installed = read_winetricks_log(prefix)
+    missing = []
+    for verb in verbs:
+        if verb in missing:
+            continue
+        if is_settings_verb(verb) or verb not in installed:
+            missing.append(verb)
+    return missing
+
+
+def run_winetricks(prefix, verbs, umu_run, log_file=None):
+    """Installs verbs into a prefix in a single umu-run session. Returns the exit status."""
+    env = os.environ.copy()
+    env["WINEPREFIX"] = str(prefix)
+    env.setdefault("GAMEID", "umu-default")
+    Path(prefix).mkdir(parents=True, exist_ok=True)
+    if log_file is None:
+        return subprocess.run([umu_run, "winetricks", *verbs], env=env).returncode
+    with open(log_file, "w", encoding="utf-8") as out:
+        return subprocess.run([umu_run, "winetricks", *verbs], env=env,
+                              stdout=out, stderr=subprocess.STDOUT).returncode
+
+
+# Runtime umu falls back to when PROTONPATH is unset or a codename
+DEFAULT_RUNTIME = "steamrt3"
+
+
+def remember_config(catalog, config):
+    """Keeps track of TOML configs used at launch so gc won't remove their Proton."""
+    configs = catalog.setdefault("configs", [])
+    config = str(Path(config).resolve())
+    if config not in configs:
+        configs.append(config)
+
+
+def remember_prefix(catalog, prefix):
+    """Keeps track of prefixes linked to the shared shader store so prune keeps their caches."""
+    prefixes = catalog.setdefault("prefixes", [])
+    prefix = os.path.realpath(prefix)
+    if prefix not in prefixes:
+        prefixes.append(prefix)
+
+
+def get_known_umu_tables(catalog, config_paths=()):
+    """Returns the [umu] tables of the known configs and of every library game in them."""
+    files = set(catalog.get("configs", []))
+    for path in [UMU_CONFIG_DIR, *config_paths]:
+        path = Path(path).expanduser()
+        if path.is_dir():
+            files.update(str(p) for p in path.glob("*.toml"))
+        else:
+            files.add(str(path))
+
+    tables = []
+    for config in files:
+        if not os.path.isfile(config):
+            continue
+        toml = load_toml(config)
+        if "games" in toml:
+            try:
+                games = compile_library(config)["games"].values()
+            except (OSError, ValueError) as e:
+                log(f"Ignoring library {config}: {e}")
+                continue
+            tables.extend(game["umu"] for game in games if "umu" in game)
+        elif isinstance(toml.get("umu"), dict):
+            tables.append(toml["umu"])
+    return tables
+
+
+def get_referenced_protons(catalog, config_paths=()):
+    """Returns the Proton directories named by the known umu TOML configs."""
+    referenced = set()
+    for table in get_known_umu_tables(catalog, config_paths):
+        if table.get("proton"):
+            referenced.add(resolve_proton(str(table["proton"]), catalog))
+    referenced.discard("")
+    return referenced
+
+
+def get_known_prefix_paths(catalog):
+    """
+    Returns every prefix umu_tools knows of: those under ~/Games/umu, those
+    recorded in the catalog at launch and those named by known configs.
+    """
+    prefixes = {str(p) for p in get_known_prefixes()}
+    prefixes.update(catalog.get("prefixes", []))
+    for table in get_known_umu_tables(catalog):
+        if isinstance(table.get("prefix"), str) and table["prefix"]:
+            prefixes.add(str(Path(table["prefix"]).expanduser()))
+    return prefixes
+
+
+def get_paths_in_use(paths, proc=PROC):
+    """Returns which of paths appear in a running process's command line."""
+    in_use = set()
+    needles = {p: p.encode() for p in paths}
+    for entry in os.scandir(proc):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(os.path.join(entry.path, "cmdline"), "rb") as f:
+                cmdline = f.read()
+        except OSError:
+            continue
+        in_use.update(p for p, needle in needles.items() if needle in cmdline)
+    return in_use
+
+
+def plan_gc(catalog, keep=2, referenced=(), in_use=(), unrecorded=False):
+    """
+    Picks Proton builds and runtime platforms to remove. Per family the
+    `keep` most recently used (or installed) builds stay, as does the newest
+    build umu would pick for a codename, anything referenced by a config,
+    anything running and builds in umu's own compatibilitytools directory.
+    The Steam client uses compatibilitytools.d too without us seeing it, so
+    builds never launched through umu_tools stay unless unrecorded is set.
+    Runtimes stay while a kept build requires them. Returns a list of
+    (path, reason) pairs.
+    """
+    remove = []
+    protons = [e for e in catalog["tools"].values() if e["kind"] == "proton"]
+    families = {}
+    for entry in protons:
+        families.setdefault(entry["family"], []).append(entry)
+
+    kept = []
+    for family in families.values():
+        by_recency = sorted(family, key=lambda e: max(e["last_used"], e["installed"]), reverse=True)
+        newest = max(family, key=lambda e: e["version"])
+        for i, entry in enumerate(by_recency):
+            if (i < keep or entry is newest or entry["path"] in referenced
+                    or entry["path"] in in_use or Path(entry["path"]).parent == UMU_COMPAT
+                    or (not entry["last_used"] and not unrecorded)):
+                kept.append(entry)
+            else:
+                remove.append((entry["path"], f"not used in the last {keep} builds of {entry['family']}"))
+
+    needed = {e.get("runtime") for e in kept} | {DEFAULT_RUNTIME}
+    for entry in catalog["tools"].values():
+        if entry["kind"] != "runtime":
+            continue
+        if entry["name"] not in needed and entry["path"] not in in_use:
+            remove.append((entry["path"], "runtime not required by any kept build"))
+            continue
+        # umu runs the newest platform directory, see _update_umu
+        for platform in sorted(entry.get("platforms", []))[:-1]:
+            remove.append((str(Path(entry["path"], platform)), "superseded runtime platform"))
+    return remove
+
+
+def get_gc_lock(path):
+    """Returns the umu lock file guarding a Proton or runtime directory."""
+    path = Path(path)
+    if path.parent in (STEAM_COMPAT, UMU_COMPAT):
+        return str(UMU_LOCAL / "compatibilitytools.d.lock")
+    return str(UMU_LOCAL / "umu.lock")
+
+
+def remove_tools(plan):
+    """
+    Moves each directory aside under umu's lock for it, so umu never sees a
+    half deleted tool, then deletes it outside the lock. Returns bytes freed.
+    """
+    trash = []
+    for path, _ in plan:
+        path = Path(path)
+        if not path.is_dir():
+            continue
+        with unix_flock(get_gc_lock(path)):
+            target = path.with_name(f".umu-gc-{path.name}")
+            try:
+                os.replace(path, target)
+            except OSError as e:
+                log(f"Could not remove {path}: {e}")
+                continue
+        trash.append(target)
+
+    freed = 0
+    for target in trash:
+        for root, _, files in os.walk(target):
+            for name in files:
+                try:
+                    freed += os.lstat(os.path.join(root, name)).st_blocks * 512
+                except OSError:
+                    pass
+        shutil.rmtree(target, ignore_errors=True)
+    return freed
+
+
+def run_gc(keep=2, config_paths=(), dry_run=False, referenced=(), unrecorded=False):
+    """
+    Plans and runs a garbage collection. Builds in referenced are kept on
+    top of those the configs name. Returns (plan, bytes freed).
+    """
+    catalog = load_catalog()
+    referenced = get_referenced_protons(catalog, config_paths) | set(referenced)
+    in_use = get_paths_in_use([e["path"] for e in catalog["tools"].values()])
+    plan = plan_gc(catalog, keep, referenced, in_use, unrecorded)
+    if dry_run or not plan:
+        return plan, 0
+    freed = remove_tools(plan)
+    # Platforms are removed inside a runtime directory, so list everything again
+    catalog["dirs"].clear()
+    refresh_catalog(catalog)
+    save_catalog(catalog)
+    return plan, freed
+
+
+def start_background_gc(keep=2, config_paths=(), referenced=()):
+    """
+    Collects old tools in an idle I/O priority thread while the game runs.
+    umu-run may not have started Proton yet, so the launch's own build and
+    config have to be passed in to be kept.
+    """
+
+    def run():
+        try:
+            ioprio_set(threading.get_native_id(), IOPRIO_CLASSES["idle"], 0)
+        except OSError:
+            pass
+        plan, freed = run_gc(keep, config_paths, referenced=referenced)
+        if plan:
+            log(f"Removed {len(plan)} old tool(s), freed {human_readable_size(freed)}")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+# Kernel driver -> name fragment of its Mesa Vulkan ICD manifest
+MESA_ICDS = {"amdgpu": "radeon", "radeon": "radeon", "i915": "intel", "xe": "intel", "nouveau": "nouveau"}
+
+
+def shader_store():
+    return TOOLS_HOME / "shadercache"
+
+
+def get_gpu_driver(sysfs=SYS, icd_dirs=None):
+    """
+    Returns a short id for the GPU driver build, e.g. nvidia-550.78 or
+    amdgpu-3f2a9c1e. Mesa has no version in sysfs, so its Vulkan driver
+    library's size and mtime stand in for the build.
+    """
+    if os.environ.get("UMU_SHADER_DRIVER"):
+        return os.environ["UMU_SHADER_DRIVER"]
+
+    drivers = set()
+    for card in (sysfs / "class" / "drm").glob("card[0-9]*"):
+        try:
+            drivers.add(os.path.basename(os.readlink(card / "device" / "driver")))
+        except OSError:
+            continue
+
+    if "nvidia" in drivers:
+        try:
+            return "nvidia-" + (sysfs / "module" / "nvidia" / "version").read_text().strip()
+        except OSError:
+            return "nvidia"
+
+    for driver in sorted(drivers):
+        fragment = MESA_ICDS.get(driver)
+        if not fragment:
+            continue
+        for icd_dir in icd_dirs or VULKAN_ICD_DIRS:
+            for manifest in sorted(icd_dir.glob(f"*{fragment}*.json")):
+                try:
+                    library = json.loads(manifest.read_text())["ICD"]["library_path"]
+                    st = os.stat(library)
+                except (OSError, ValueError, KeyError):
+                    continue
+                build = hashlib.blake2b(f"{library}:{st.st_size}:{st.st_mtime_ns}".encode(), digest_size=4)
+                return f"{driver}-{build.hexdigest()}"
+        return driver
+    return "unknown"
+
+
+def get_shader_key(driver, proton):
+    """Names the store directory for one driver build and Proton build."""
+    return f"{driver}--{Path(proton).name or 'proton'}"
+
+
+def dir_size(path):
+    """Returns the bytes used by the files under path."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+def get_shader_caches(gameid):
+    """Returns a GAMEID's store directories, most recently used first."""
+    try:
+        caches = [p for p in (shader_store() / gameid).iterdir() if p.is_dir()]
+    except OSError:
+        return []
+    return sorted(caches, key=lambda p: p.stat().st_mtime, reverse=True)
+
+
+def merge_into(src, dst):
+    """Moves files from src into dst without replacing what dst already has."""
+    for root, _, files in os.walk(src):
+        target_root = Path(dst, os.path.relpath(root, src))
+        target_root.mkdir(parents=True, exist_ok=True)
+        for name in files:
+            target = target_root / name
+            if not target.exists():
+                shutil.move(os.path.join(root, name), target)
+    shutil.rmtree(src, ignore_errors=True)
+
+
+def attach_shader_cache(prefix, gameid, proton, driver=None):
+    """
+    Points a prefix's shadercache (umu's STEAM_COMPAT_SHADER_PATH) at the
+    shared store entry for this GAMEID, GPU driver and Proton build. A new
+    entry is seeded from the GAMEID's most recent cache, and caches already
+    in the prefix are moved into the store. Returns the store directory.
+    """
+    key = shader_store() / gameid / get_shader_key(driver or get_gpu_driver(), proton)
+    link = Path(prefix, "shadercache")
+
+    if not key.is_dir():
+        previous = get_shader_caches(gameid)
+        key.parent.mkdir(parents=True, exist_ok=True)
+        if previous:
+            # Pipeline state caches stay useful across driver and DXVK updates;
+            # entries the new build can't use are just recompiled
+            clone_tree(previous[0], key)
+        else:
+            key.mkdir()
+
+    if link.is_symlink():
+        if os.readlink(link) == str(key):
+            os.utime(key)
+            return key
+        link.unlink()
+    elif link.is_dir():
+        merge_into(link, key)
+
+    Path(prefix).mkdir(parents=True, exist_ok=True)
+    link.symlink_to(key)
+    os.utime(key)
+    return key
+
+
+def prune_shader_caches(keep=1, dry_run=False, catalog=None):
+    """
+    Removes all but the `keep` most recently used caches of each GAMEID.
+    Caches still linked from a known prefix are kept.
+    """
+    removed = []
+    try:
+        gameids = sorted(p.name for p in shader_store().iterdir() if p.is_dir())
+    except OSError:
+        return removed
+    if catalog is None:
+        catalog = load_catalog()
+    linked = {os.path.realpath(Path(p, "shadercache")) for p in get_known_prefix_paths(catalog)}
+    for gameid in gameids:
+        for cache in get_shader_caches(gameid)[keep:]:
+            if os.path.realpath(cache) in linked:
+                continue
+            removed.append((cache, dir_size(cache)))
+            if not dry_run:
+                shutil.rmtree(cache, ignore_errors=True)
+    return removed
+
+
+def read_proc_usage(pid, proc=PROC):
+    """
+    Returns the cumulative CPU time, major faults, I/O bytes and current and
+    peak RSS of a process, or None once it has gone.
+    """
+    base = proc / str(pid)
+    try:
+        with open(base / "stat", "rb") as f:
+            data = f.read()
+        with open(base / "status", "r", encoding="utf-8") as f:
+            status = f.read()
+    except OSError:
+        return None
+
+    # Fields counted from the state field that follows comm, see proc(5)
+    fields = data[data.rfind(b")") + 2:].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    usage = {
+        "majflt": int(fields[9]),
+        "utime": int(fields[11]) / ticks,
+        "stime": int(fields[12]) / ticks,
+        "rss_kb": 0,
+        "hwm_kb": 0,
+        "read_bytes": 0,
+        "write_bytes": 0,
+    }
+    for line in status.splitlines():
+        if line.startswith("VmRSS:"):
+            usage["rss_kb"] = int(line.split()[1])
+        elif line.startswith("VmHWM:"):
+            usage["hwm_kb"] = int(line.split()[1])
+
+    try:
+        with open(base / "io", "r", encoding="utf-8") as f:
+            for line in f:
+                key, _, val = line.partition(":")
+                if key in ("read_bytes", "write_bytes"):
+                    usage[key] = int(val)
+    except OSError:
+        pass  # io is only readable for our own processes
+    return usage
+
+
+class SessionAccounting:
+    """
+    Tracks resource usage of the whole game pstree. Each process keeps its
+    last seen counters, so usage of processes that exit between samples is
+    still counted up to their last sample.
+    """
+
+    def __init__(self, proc=PROC):
+        self.proc = proc
+        self.last = {}
+        self.peak_tree_rss_kb = 0
+        self.peak_process_rss_kb = 0
+        self.max_processes = 0
+
+    def sample(self, pids):
+        tree_rss = 0
+        for pid in pids:
+            usage = read_proc_usage(pid, self.proc)
+            if usage is None:
+                continue
+            self.last[pid] = usage
+            tree_rss += usage["rss_kb"]
+            self.peak_process_rss_kb = max(self.peak_process_rss_kb, usage["hwm_kb"])
+        self.peak_tree_rss_kb = max(self.peak_tree_rss_kb, tree_rss)
+        self.max_processes = max(self.max_processes, len(pids))
+
+    def totals(self):
+        totals = {
+            "processes_seen": len(self.last),
+            "max_processes": self.max_processes,
+            "peak_tree_rss_kb": self.peak_tree_rss_kb,
+            "peak_process_rss_kb": self.peak_process_rss_kb,
+        }
+        for key in ("utime", "stime", "majflt", "read_bytes", "write_bytes"):
+            totals[key] = sum(u[key] for u in self.last.values())
+        totals["utime"] = round(totals["utime"], 2)
+        totals["stime"] = round(totals["stime"], 2)
+        return totals
+
+
+def get_rusage_children():
+    """Returns the kernel's totals for all reaped descendants of this process."""
+    import resource
+
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "utime": round(ru.ru_utime, 2),
+        "stime": round(ru.ru_stime, 2),
+        "maxrss_kb": ru.ru_maxrss,
+        "majflt": ru.ru_majflt,
+        "inblock": ru.ru_inblock,
+        "oublock": ru.ru_oublock,
+    }
+
+
+def sessions_path(gameid):
+    return TOOLS_HOME / "sessions" / f"{gameid}.jsonl"
+
+
+def write_session_record(gameid, record):
+    """Appends a session record to the GAMEID's JSON lines file."""
+    path = sessions_path(gameid)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+    return path
+
+
+def load_session_records(gameid):
+    records = []
+    try:
+        with open(sessions_path(gameid), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return records
+
+
+def read_cgroup_usage(group):
+    """Returns CPU, memory and I/O totals kept by a cgroup v2 group."""
+    usage = {}
+    try:
+        for line in (group / "cpu.stat").read_text().splitlines():
+            key, val = line.split()
+            if key in ("usage_usec", "user_usec", "system_usec"):
+                usage[key] = int(val)
+    except (OSError, ValueError):
+        pass
+    try:
+        usage["memory_peak"] = int((group / "memory.peak").read_text())
+    except (OSError, ValueError):
+        pass
+    return usage
+
+
+def watch_game(proc, samplers, interval=SAMPLE_INTERVAL):
+    """Hands the game's pstree to each sampler until umu-run exits."""
+    me = os.getpid()
+    while proc.poll() is None:
+        pids = get_pstree_from_pid(me)
+        for sampler in samplers:
+            sampler.sample(pids)
+        reap_children(proc.pid)
+        time.sleep(interval)
+    return proc.returncode
+
+
+def get_umu_run():
+    return str(UMU_RUN) if UMU_RUN.is_file() else "umu-run"
+
+
+def cmd_template(args):
+    if args.action == "list":
+        for info_file in sorted((TOOLS_HOME / "templates").glob("*/umu-template.json")):
+            try:
+                info = json.loads(info_file.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            current = get_template(info.get("proton", "")) is not None
+            state = "" if current else "  \033[33m(stale)\033[0m"
+            print(f"{info_file.parent.name:<28} {info.get('version', '?')}{state}")
+        return 0
+
+    proton = resolve_proton(args.proton)
+    if not proton or not Path(proton, "proton").is_file():
+        print(f"Not a Proton directory: {args.proton}", file=sys.stderr)
+        return 1
+
+    if args.action == "create":
+        try:
+            path = create_template(proton, get_umu_run())
+        except RuntimeError as e:
+            print(f"Error creating template: {e}", file=sys.stderr)
+            return 1
+        print(f"Template for {Path(proton).name} created in {path}")
+        return 0
+
+    # clone
+    if not args.prefix:
+        print("clone needs a prefix path", file=sys.stderr)
+        return 1
+    prefix = Path(args.prefix).expanduser()
+    if not is_empty_prefix(prefix):
+        print(f"Prefix already populated: {prefix}", file=sys.stderr)
+        return 1
+    stats = clone_prefix(proton, prefix)
+    if stats is None:
+        print(f"No current template for {Path(proton).name}", file=sys.stderr)
+        return 1
+    print(f"Cloned into {prefix}: {stats['reflinked']} reflinked, {stats['hardlinked']} hardlinked, "
+          f"{stats['copied']} copied ({human_readable_size(stats['copied_bytes'])})")
+    return 0
+
+
+def cmd_dedupe(args):
+    prefixes = [Path(p).expanduser() for p in args.prefixes] or get_known_prefixes()
+    if not prefixes:
+        print(f"No prefixes found in {UMU_GAMES}")
+        return 1
+
+    started = time.monotonic()
+    print(f"Scanning {len(prefixes)} prefix(es)...")
+    groups = find_duplicates(prefixes, args.min_size, args.jobs)
+
+    if args.dry_run:
+        report = dedupe(groups, dry_run=True)
+    else:
+        # Keep umu from setting up a prefix while files are swapped
+        UMU_LOCAL.mkdir(parents=True, exist_ok=True)
+        with unix_flock(str(UMU_LOCAL / "pfx.lock")):
+            report = dedupe(groups)
+
+    print(f"  Duplicate groups: {report['groups']}")
+    print(f"  Duplicate files:  {report['duplicates']}")
+    print(f"  Reclaimable:      {human_readable_size(report['reclaimable_bytes'])}")
+    if not args.dry_run:
+        print(f"  Reflinked: {report['reflink']}  Hardlinked: {report['hardlink']}  "
+              f"Skipped: {report['skipped']}")
+        print(f"  Reclaimed:        {human_readable_size(report['reclaimed_bytes'])}")
+    print(f"  Done in {time.monotonic() - started:.1f}s")
+    return 0
+
+
+def winetricks_log_path(prefix):
+    """
+    Logs are named by the prefix's full path, since prefixes are often all
+    called pfx or share a GAMEID under different libraries.
+    """
+    prefix = Path(prefix).expanduser().resolve()
+    source = hashlib.blake2b(str(prefix).encode(), digest_size=4).hexdigest()
+    return TOOLS_HOME / "logs" / f"winetricks-{prefix.name}-{source}.log"
+
+
+def cmd_winetricks(args):
+    bad = [v for v in args.verbs if not WINETRICKS_VERB.match(v)]
+    if bad:
+        print(f"Not winetricks verbs: {' '.join(bad)}", file=sys.stderr)
+        return 1
+
+    prefixes = [Path(p).expanduser() for p in args.prefix]
+    if not prefixes:
+        default = os.environ.get("WINEPREFIX") or UMU_GAMES / get_gameid(os.environ)
+        prefixes = [Path(default).expanduser()]
+
+    jobs = []
+    for prefix in prefixes:
+        missing = get_missing_verbs(prefix, args.verbs)
+        if missing:
+            jobs.append((prefix, missing))
+        else:
+            print(f"  {prefix}: all verbs already installed")
+    if not jobs:
+        return 0
+
+    umu_run = get_umu_run()
+    if len(jobs) > 1:
+        (TOOLS_HOME / "logs").mkdir(parents=True, exist_ok=True)
+
+    def install(job):
+        prefix, missing = job
+        # Output of parallel sessions would interleave, so it goes to a file
+        log_file = winetricks_log_path(prefix) if len(jobs) > 1 else None
+        if log_file is None:
+            print(f"  {prefix}: installing {' '.join(missing)}")
+        else:
+            print(f"  {prefix}: installing {' '.join(missing)}, log: {log_file}")
+        return run_winetricks(prefix, missing, umu_run, log_file), log_file
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        for (prefix, missing), (ret, log_file) in zip(jobs, pool.map(install, jobs)):
+            status = "\033[32mok\033[0m" if ret == 0 else f"\033[31mfailed ({ret})\033[0m"
+            detail = f", log: {log_file}" if log_file else ""
+            print(f"  {prefix}: {' '.join(missing)} {status}{detail}")
+            failed += ret != 0
+    return 1 if failed else 0
+
+
+def cmd_tools(args):
+    catalog = load_catalog()
+    if args.json:
+        print(json.dumps(catalog["tools"], indent=1, sort_keys=True))
+        return 0
+    if not catalog["tools"]:
+        print("No compatibility tools or runtimes installed")
+        return 0
+
+    def when(ts):
+        return time.strftime("%Y-%m-%d", time.localtime(ts)) if ts else "never"
+
+    print(f"{'Name':<28} {'Kind':<8} {'Runtime':<9} {'Installed':<11} {'Last used':<11}")
+    for entry in sorted(catalog["tools"].values(), key=lambda e: (e["kind"], e["family"], e["version"])):
+        runtime = entry.get("runtime", "") if entry["kind"] == "proton" else ""
+        print(f"{entry['name']:<28} {entry['kind']:<8} {runtime or '-':<9} "
+              f"{when(entry['installed']):<11} {when(entry['last_used']):<11}")
+    return 0
+
+
+def cmd_gc(args):
+    plan, freed = run_gc(args.keep, args.config, args.dry_run, unrecorded=args.unrecorded)
+    if not plan:
+        print("Nothing to collect")
+        return 0
+    for path, reason in plan:
+        print(f"  {'would remove' if args.dry_run else 'removed'} {path} ({reason})")
+    if not args.dry_run:
+        print(f"Freed {human_readable_size(freed)}")
+    return 0
+
+
+def cmd_shaders(args):
+    if args.action == "list":
+        print(f"{'GAMEID':<24} {'Cache':<40} {'Size':>10}")
+        for prefix in get_known_prefixes():
+            cache = Path(prefix, "shadercache")
+            if cache.is_dir() and not cache.is_symlink():
+                print(f"{prefix.name:<24} {'(in prefix)':<40} {human_readable_size(dir_size(cache)):>10}")
+        try:
+            gameids = sorted(p.name for p in shader_store().iterdir() if p.is_dir())
+        except OSError:
+            gameids = []
+        for gameid in gameids:
+            for cache in get_shader_caches(gameid):
+                print(f"{gameid:<24} {cache.name:<40} {human_readable_size(dir_size(cache)):>10}")
+        return 0
+
+    if args.action == "prune":
+        removed = prune_shader_caches(args.keep, args.dry_run, load_catalog())
+        for cache, size in removed:
+            print(f"  {'would remove' if args.dry_run else 'removed'} {cache} ({human_readable_size(size)})")
+        print(f"{'Reclaimable' if args.dry_run else 'Freed'}: "
+              f"{human_readable_size(sum(size for _, size in removed))}")
+        return 0
+
+    # relocate / seed
+    if not args.gameid:
+        print(f"{args.action} needs a GAMEID", file=sys.stderr)
+        return 1
+    prefix = Path(args.prefix).expanduser() if args.prefix else UMU_GAMES / args.gameid
+    proton = resolve_proton(args.proton or os.environ.get("PROTONPATH", ""))
+    if args.action == "seed" and not get_shader_caches(args.gameid):
+        print(f"No shader cache stored for {args.gameid}", file=sys.stderr)
+        return 1
+    UMU_LOCAL.mkdir(parents=True, exist_ok=True)
+    with unix_flock(str(UMU_LOCAL / "pfx.lock")):
+        key = attach_shader_cache(prefix, args.gameid, proton)
+    catalog = load_catalog()
+    remember_prefix(catalog, prefix)
+    save_catalog(catalog)
+    print(f"{prefix / 'shadercache'} -> {key} ({human_readable_size(dir_size(key))})")
+    return 0
+
+
+def cmd_launch(args):
+    command = args.command
+    if command and command[0] == "--":
+        command = command[1:]
+
+    env = os.environ.copy()
+    config = Path(args.config).expanduser() if args.config else get_config_path(command)
+    if args.game:
+        if not config:
+            print("--game needs a library given with --config", file=sys.stderr)
+            return 1
+        try:
+            toml = get_library_game(config, args.game)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        # Launched the way umu-run is without a config: env plus executable
+        table = toml["umu"]
+        env.update(toml["env"])
+        env["WINEPREFIX"] = table["prefix"]
+        env["PROTONPATH"] = table["proton"]
+        for key, var in (("game_id", "GAMEID"), ("store", "STORE")):
+            if table.get(key):
+                env[var] = table[key]
+        command = [table["exe"], *table["launch_args"], *command]
+    else:
+        toml = load_toml(config) if config else {}
+        if args.config:
+            command = ["--config", str(config), *command]
+    if toml.get("umu", {}).get("game_id"):
+        env.setdefault("GAMEID", toml["umu"]["game_id"])
+    gameid = get_gameid(env)
+    catalog = load_catalog()
+    paths = get_launch_paths(env, command, toml, catalog)
+    umu_run = get_umu_run()
+
+    if args.from_template or env.get("UMU_PREFIX_TEMPLATE") == "1":
+        if not paths["proton"]:
+            log("No Proton directory to pick a template for, skipping template")
+        elif is_empty_prefix(paths["prefix"]):
+            started = time.monotonic()
+            stats = clone_prefix(paths["proton"], paths["prefix"])
+            if stats is None:
+                log(f"No template for {Path(paths['proton']).name}, "
+                    "create one with `umu_tools.py template create`")
+            else:
+                log(f"Cloned template into {paths['prefix']} in {time.monotonic() - started:.2f}s "
+                    f"({stats['reflinked']} reflinked, {stats['hardlinked']} hardlinked, "
+                    f"{stats['copied']} copied)")
+
+    if args.shared_shaders or env.get("UMU_SHARED_SHADERS") == "1":
+        try:
+            key = attach_shader_cache(paths["prefix"], gameid, paths["proton"])
+            remember_prefix(catalog, paths["prefix"])
+            log(f"Using shared shader cache {key.parent.name}/{key.name}")
+        except OSError as e:
+            log(f"Could not use the shared shader cache: {e}")
+
+    if not args.no_prefetch:
+        start_prefetch(gameid)
+
+    if config:
+        remember_config(catalog, config)
+    save_catalog(catalog)
+
+    set_child_subreaper()
+    samplers = []
+    sched = None
+    try:
+        policy = load_sched_policy(env, toml)
+    except ValueError as e:
+        log(f"Ignoring scheduling policy: {e}")
+        policy = None
+    if policy:
+        sched = SchedPolicy(policy, gameid)
+        samplers.append(sched)
+
+    accounting = None
+    if not args.no_session:
+        accounting = SessionAccounting()
+        samplers.append(accounting)
+
+    recorder = None
+    if not args.no_record:
+        recorder = PrefetchRecorder(paths.values())
+        samplers.append(recorder)
+
+    # Recorded before gc runs, so this build counts as recently used
+    if paths["proton"]:
+        mark_tool_used(catalog, paths["proton"])
+
+    started = time.time()
+    with subprocess.Popen([umu_run, *command], env=env) as proc:
+        if args.gc or env.get("UMU_TOOLS_GC") == "1":
+            start_background_gc(config_paths=[config] if config else (),
+                                referenced=[paths["proton"]] if paths["proton"] else ())
+        try:
+            ret = watch_game(proc, samplers)
+        except KeyboardInterrupt:
+            ret = proc.wait()
+    reap_children()
+
+    # umu may have installed or updated the build during the launch
+    catalog = load_catalog()
+
+    if accounting:
+        record = {
+            "gameid": gameid,
+            "started": int(started),
+            "duration": round(time.time() - started, 1),
+            "returncode": ret,
+            "proton": Path(paths["proton"] or env.get("PROTONPATH", "")).name,
+            "runtime": (catalog["tools"].get(paths["proton"]) or {}).get("runtime", ""),
+            "tree": accounting.totals(),
+            "rusage_children": get_rusage_children(),
+        }
+        if sched and sched.cgroup is not None:
+            record["cgroup"] = read_cgroup_usage(sched.cgroup)
+        write_session_record(gameid, record)
+
+    if sched:
+        sched.remove_cgroup()
+
+    if recorder and recorder.files:
+        files = save_prefetch_list(gameid, recorder.files)
+        log(f"Recorded {len(files)} files to prefetch for {gameid}")
+
+    return ret
+
+
+def cmd_library(args):
+    try:
+        library = compile_library(args.config)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    games = library["games"]
+
+    if args.action == "list":
+        for name, game in sorted(games.items()):
+            if "error" in game:
+                print(f"{name:<24} \033[31m{game['error']}\033[0m")
+                continue
+            table = game["umu"]
+            print(f"{name:<24} {table.get('game_id', '-'):<16} {Path(table['proton']).name:<20} {table['exe']}")
+        return 0
+
+    # validate
+    started = time.monotonic()
+    results = validate_library(library, load_catalog(), args.jobs)
+    failed = 0
+    for name, problems in results.items():
+        if not problems:
+            continue
+        failed += 1
+        for problem in problems:
+            print(f"{name}: {problem}")
+    print(f"Checked {len(results)} game(s) in {time.monotonic() - started:.2f}s, "
+          f"{failed} with problems")
+    return 1 if failed else 0
+
+
+def cmd_sessions(args):
+    records = load_session_records(args.gameid)
+    if not records:
+        print(f"No sessions recorded for {args.gameid}")
+        return 1
+    if args.json:
+        for record in records:
+            print(json.dumps(record, sort_keys=True))
+        return 0
+
+    # Per Proton build and runtime: sessions, mean CPU seconds per minute
+    # played, peak RSS, major faults and bytes read
+    groups = {}
+    for record in records:
+        groups.setdefault((record.get("proton", ""), record.get("runtime", "")), []).append(record)
+
+    print(f"{'Proton':<24} {'Runtime':<10} {'Runs':>4} {'CPU s/min':>9} "
+          f"{'Peak RSS':>10} {'Maj flt':>8} {'Read':>10}")
+    for (proton, runtime), group in sorted(groups.items()):
+        minutes = sum(max(r["duration"], 1) for r in group) / 60
+        cpu = sum(r["tree"]["utime"] + r["tree"]["stime"] for r in group)
+        rss = max(r["tree"]["peak_tree_rss_kb"] for r in group) * 1024
+        majflt = sum(r["tree"]["majflt"] for r in group) // len(group)
+        read = sum(r["tree"]["read_bytes"] for r in group) // len(group)
+        print(f"{proton or '-':<24} {runtime or '-':<10} {len(group):>4} {cpu / minutes:>9.1f} "
+              f"{human_readable_size(rss):>10} {majflt:>8} {human_readable_size(read):>10}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="umu_tools.py",
+        description="Companion helpers for umu-run",
+    )
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("launch", help="run umu-run with prefetching of the game's files")
+    p.add_argument("--no-prefetch", action="store_true", help="don't prefetch recorded files")
+    p.add_argument("--no-record", action="store_true", help="don't record mapped files")
+    p.add_argument("--no-session", action="store_true", help="don't write a session record")
+    p.add_argument("--from-template", action="store_true",
+                   help="populate a new prefix from the Proton build's template")
+    p.add_argument("--gc", action="store_true", help="remove old Proton builds in the background")
+    p.add_argument("--shared-shaders", action="store_true",
+                   help="keep the prefix's shader cache in the shared store")
+    p.add_argument("--config", help="umu TOML config, or a library manifest with --game")
+    p.add_argument("--game", help="game to launch from the library given with --config")
+    p.add_argument("command", nargs=argparse.REMAINDER, help="arguments passed to umu-run")
+    p.set_defaults(func=cmd_launch)
+
+    p = sub.add_parser("template", help="manage pristine prefix templates per Proton build")
+    p.add_argument("action", choices=["create", "clone", "list"])
+    p.add_argument("proton", nargs="?", default="", help="Proton directory or name in compatibilitytools.d")
+    p.add_argument("prefix", nargs="?", help="new prefix to clone into")
+    p.set_defaults(func=cmd_template)
+
+    p = sub.add_parser("dedupe", help="share identical files across prefixes")
+    p.add_argument("prefixes", nargs="*", help=f"prefixes to scan (default: all in {UMU_GAMES})")
+    p.add_argument("-n", "--dry-run", action="store_true", help="only report what would be reclaimed")
+    p.add_argument("--min-size", type=int, default=4096, help="ignore files smaller than this (bytes)")
+    p.add_argument("-j", "--jobs", type=int, default=4, help="parallel scan and hash workers")
+    p.set_defaults(func=cmd_dedupe)
+
+    p = sub.add_parser("winetricks", help="install only missing verbs, in one session per prefix")
+    p.add_argument("verbs", nargs="+", help="winetricks verbs")
+    p.add_argument("-p", "--prefix", action="append", default=[],
+                   help="prefix to install into, may be repeated (default: WINEPREFIX or GAMEID's)")
+    p.add_argument("-j", "--jobs", type=int, default=2, help="prefixes handled at the same time")
+    p.set_defaults(func=cmd_winetricks)
+
+    p = sub.add_parser("tools", help="list installed Proton builds and runtimes")
+    p.add_argument("--json", action="store_true", help="print the raw catalog entries")
+    p.set_defaults(func=cmd_tools)
+
+    p = sub.add_parser("gc", help="remove least recently used Proton builds and runtimes")
+    p.add_argument("-k", "--keep", type=int, default=2, help="builds to keep per family")
+    p.add_argument("-c", "--config", action="append", default=[],
+                   help=f"TOML config or directory whose Proton must stay (default: {UMU_CONFIG_DIR})")
+    p.add_argument("-n", "--dry-run", action="store_true", help="only show what would be removed")
+    p.add_argument("--unrecorded", action="store_true",
+                   help="also remove builds never launched through umu_tools (Steam may still use them)")
+    p.set_defaults(func=cmd_gc)
+
+    p = sub.add_parser("shaders", help="share, report and prune shader caches")
+    p.add_argument("action", choices=["list", "relocate", "seed", "prune"])
+    p.add_argument("gameid", nargs="?", help="GAMEID for relocate and seed")
+    p.add_argument("--prefix", help="prefix to use (default: ~/Games/umu/<GAMEID>)")
+    p.add_argument("--proton", help="Proton build (default: PROTONPATH)")
+    p.add_argument("-k", "--keep", type=int, default=1, help="caches to keep per GAMEID when pruning")
+    p.add_argument("-n", "--dry-run", action="store_true", help="only show what prune would remove")
+    p.set_defaults(func=cmd_shaders)
+
+    p = sub.add_parser("library", help="list or check the games of a library manifest")
+    p.add_argument("action", choices=["list", "validate"])
+    p.add_argument("config", help="library manifest (TOML with [defaults] and [games.<name>] tables)")
+    p.add_argument("-j", "--jobs", type=int, default=8, help="games checked at the same time")
+    p.set_defaults(func=cmd_library)
+
+    p = sub.add_parser("sessions", help="compare recorded sessions of a game")
+    p.add_argument("gameid", help="GAMEID of the game")
+    p.add_argument("--json", action="store_true", help="print the raw records")
+    p.set_defaults(func=cmd_sessions)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,28 @@
 #!/usr/bin/env python3
+import argparse
 import subprocess
 import json
 import shutil
 import os
+import queue
+import stat
 import sys
+import tempfile
+import threading
 import time
 import heapq
+import hashlib
+import errno
+import itertools
+import math
+import mmap
+import random
+import re
+import select
+import socket
+import sqlite3
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
 def print_title():
@@ -23,7 +39,7 @@ def print_title():
     print("\033[1;37m       USB Device Discovery & Content Scanner\033[0m")
     print("\n" + "="*60 + "\n")
 
-def get_drive_info():
+def run_lsblk():
     """
     Runs lsblk to get information about all block devices.
     Returns a dictionary of devices.
@@ -35,13 +51,161 @@ def get_drive_info():
         ]
         result = subprocess.run(cmd, capture_output=True, text=True, check=True)
         return json.loads(result.stdout)
-    except subprocess.CalledProcessError as e:
+    except (OSError, subprocess.CalledProcessError) as e:
         print(f"Error running lsblk: {e}")
         return None
     except json.JSONDecodeError as e:
         print(f"Error parsing lsblk output: {e}")
         return None
 
+def read_attr(path, default=None):
+    """Reads a sysfs attribute, stripped, or default if it isn't there."""
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+def unescape_mount(text):
+    """Undoes the octal escapes (\\040 for a space) of /proc/self/mountinfo."""
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), text)
+
+def read_mountinfo(path='/proc/self/mountinfo'):
+    """
+    Maps both "major:minor" and the mount source ("/dev/sdb1") to
+    (mountpoint, fstype). btrfs and fuseblk mounts report an anonymous
+    "0:NN" device, so only their source names the disk. Whole filesystems
+    win over mounts of a subdirectory (bind mounts, btrfs subvolumes), and
+    otherwise the first mount wins.
+    """
+    whole, partial = {}, {}
+    try:
+        with open(path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+            for line in f:
+                fields = line.split()
+                if ' - ' not in line or len(fields) < 5:
+                    continue
+                after = line.split(' - ', 1)[1].split()
+                if not after:
+                    continue
+                mounts = whole if fields[3] == '/' else partial
+                mount = (unescape_mount(fields[4]), after[0])
+                mounts.setdefault(fields[2], mount)
+                if len(after) > 1 and after[1].startswith('/dev/'):
+                    mounts.setdefault(unescape_mount(after[1]), mount)
+    except OSError:
+        pass
+    return {**partial, **whole}
+
+def read_disk_links(directory):
+    """Maps device names to the names of their /dev/disk/by-* links (UUIDs, labels)."""
+    links = {}
+    try:
+        for name in os.listdir(directory):
+            target = os.path.basename(os.readlink(os.path.join(directory, name)))
+            # udev escapes spaces and such as \x20
+            links[target] = re.sub(r'\\x([0-9a-fA-F]{2})', lambda m: chr(int(m.group(1), 16)), name)
+    except OSError:
+        pass
+    return links
+
+def transport(device_path):
+    """Tells the transport (as lsblk's TRAN) from a block device's sysfs path."""
+    parts = device_path.split('/')
+    if any(re.fullmatch(r'usb\d+', part) for part in parts):
+        return 'usb'
+    if any(part.startswith('nvme') for part in parts):
+        return 'nvme'
+    if any(re.fullmatch(r'ata\d+', part) for part in parts):
+        return 'sata'
+    return None
+
+def read_sysfs_devices(sys_root='/sys', mountinfo='/proc/self/mountinfo', dev_disk='/dev/disk'):
+    """
+    Builds the same dictionary as `lsblk -J -b` from /sys/block, the mount
+    table and the /dev/disk/by-uuid and by-label links, without running
+    anything. Empty devices (unused loop devices and such) are left out,
+    as lsblk does.
+    """
+    mounts = read_mountinfo(mountinfo)
+    uuids = read_disk_links(os.path.join(dev_disk, 'by-uuid'))
+    labels = read_disk_links(os.path.join(dev_disk, 'by-label'))
+    block = os.path.join(sys_root, 'block')
+
+    def describe(path, tran, removable, model, vendor):
+        kname = os.path.basename(path)
+        # Device mapper devices (LUKS, LVM) go by their dm name, as in /dev/mapper
+        dm_name = read_attr(os.path.join(path, 'dm', 'name'))
+        sources = [read_attr(os.path.join(path, 'dev'), ''), '/dev/' + kname]
+        if dm_name:
+            sources.append('/dev/mapper/' + dm_name)
+        mountpoint, fstype = next((mounts[s] for s in sources if s in mounts), (None, None))
+        device = {
+            'name': dm_name or kname,
+            'tran': tran,
+            'mountpoint': mountpoint,
+            'fstype': fstype,
+            'size': int(read_attr(os.path.join(path, 'size'), '0') or 0) * 512,
+            'ro': read_attr(os.path.join(path, 'ro')) == '1',
+            'rm': removable,
+            'model': model,
+            'vendor': vendor,
+            'uuid': uuids.get(kname),
+            'label': labels.get(kname),
+        }
+        children = holders(path, tran, removable)
+        if children:
+            device['children'] = children
+        return device
+
+    def holders(path, tran, removable):
+        """The devices built on top of this one, such as an opened LUKS volume."""
+        try:
+            names = sorted(os.listdir(os.path.join(path, 'holders')))
+        except OSError:
+            return []
+        return [describe(os.path.join(block, holder), tran, removable, None, None) for holder in names]
+
+    devices = []
+    try:
+        names = sorted(os.listdir(block))
+    except OSError:
+        return None
+    for name in names:
+        path = os.path.join(block, name)
+        if read_attr(os.path.join(path, 'size'), '0') == '0':
+            continue
+        # Listed under the devices they're built on instead, as lsblk does
+        try:
+            if os.listdir(os.path.join(path, 'slaves')):
+                continue
+        except OSError:
+            pass
+        tran = transport(os.path.realpath(path))
+        removable = read_attr(os.path.join(path, 'removable')) == '1'
+        disk = describe(path, tran, removable,
+                        read_attr(os.path.join(path, 'device', 'model')),
+                        read_attr(os.path.join(path, 'device', 'vendor')))
+        children = [describe(os.path.join(path, part), tran, removable, None, None)
+                    for part in sorted(os.listdir(path))
+                    if os.path.exists(os.path.join(path, part, 'partition'))]
+        children += disk.pop('children', [])
+        if children:
+            disk['children'] = children
+        devices.append(disk)
+    return {'blockdevices': devices}
+
+def get_drive_info():
+    """
+    Gets information about all block devices, in lsblk's JSON shape: read
+    from sysfs, or from lsblk where there is no /sys/block.
+    Returns a dictionary of devices.
+    """
+    data = read_sysfs_devices()
+    if data is None:
+        return run_lsblk()
+    return data
+
 def find_usb_devices(lsblk_data):
     """
     Filters lsblk output for USB devices.
@@ -63,87 +227,1268 @@ def find_usb_devices(lsblk_data):
     recurse_devices(lsblk_data['blockdevices'])
     return usb_devices
 
-def analyze_directory(path):
+EXT_MAP = {
+    '.py': 'Python', '.js': 'JavaScript', '.ts': 'TypeScript', '.jsx': 'React (JS)', '.tsx': 'React (TS)',
+    '.vue': 'Vue.js', '.c': 'C', '.cpp': 'C++', '.h': 'C/C++ Header', '.cs': 'C#',
+    '.java': 'Java', '.go': 'Go', '.rs': 'Rust', '.swift': 'Swift', '.kt': 'Kotlin',
+    '.rb': 'Ruby', '.php': 'PHP', '.html': 'HTML', '.htm': 'HTML',
+    '.css': 'CSS', '.scss': 'Sass', '.less': 'Less',
+    '.sh': 'Shell', '.bash': 'Shell', '.zsh': 'Shell', '.bat': 'Batch', '.ps1': 'PowerShell',
+    '.md': 'Markdown', '.txt': 'Text', '.json': 'JSON', '.yaml': 'YAML', '.yml': 'YAML',
+    '.xml': 'XML', '.sql': 'SQL', '.toml': 'TOML', '.ini': 'INI',
+    '.jpg': 'Image', '.jpeg': 'Image', '.png': 'Image', '.gif': 'Image', '.svg': 'Image', '.webp': 'Image',
+    '.mp4': 'Video', '.mkv': 'Video', '.mov': 'Video', '.avi': 'Video', '.webm': 'Video',
+    '.mp3': 'Audio', '.wav': 'Audio', '.flac': 'Audio', '.m4a': 'Audio', '.ogg': 'Audio',
+    '.zip': 'Archive', '.tar': 'Archive', '.gz': 'Archive', '.7z': 'Archive', '.rar': 'Archive',
+    '.pdf': 'PDF', '.doc': 'Document', '.docx': 'Document', '.xls': 'Spreadsheet', '.xlsx': 'Spreadsheet',
+    '.ppt': 'Presentation', '.pptx': 'Presentation'
+}
+
+# Threads scanning a device. USB HDDs and flash drives both do better with
+# several requests in flight than with one directory read at a time.
+SCAN_WORKERS = 8
+
+# Number of largest files kept in the stats
+TOP_FILES = 10
+
+# Files a scan thread counts before reporting progress
+PROGRESS_EVERY = 256
+
+# Per-UUID scan indexes, so an unchanged drive isn't read again
+INDEX_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'usb_analyzer')
+INDEX_VERSION = 3
+
+# Directories modified this close to the scan may still be changing (and
+# FAT only keeps mtimes to 2 seconds), so they aren't trusted next time
+RACY_NS = 3 * 10**9
+
+# Default time budget for estimating a device's contents by sampling
+ESTIMATE_SECONDS = 30
+# Devices using less than this are scanned exactly even when sampling
+EXACT_BELOW = 64 * 1024**3
+
+# Bytes read from the start of a file to recognise its type
+SNIFF_BYTES = 512
+
+# Magic numbers by offset, and the category they mean. "riff", "ftyp" and
+# "#!" need a second look at the header (see classify_header).
+SIGNATURES = {
+    0: {
+        b'\x89PNG\r\n\x1a\n': 'Image', b'\xff\xd8\xff': 'Image', b'GIF87a': 'Image', b'GIF89a': 'Image',
+        b'BM': 'Image', b'II*\x00': 'Image', b'MM\x00*': 'Image', b'<svg': 'Image',
+        b'RIFF': 'riff', b'\x1a\x45\xdf\xa3': 'Video', b'\x00\x00\x01\xba': 'Video',
+        b'ID3': 'Audio', b'\xff\xfb': 'Audio', b'\xff\xf3': 'Audio', b'fLaC': 'Audio', b'OggS': 'Audio',
+        b'PK\x03\x04': 'Archive', b'\x1f\x8b': 'Archive', b'7z\xbc\xaf\x27\x1c': 'Archive',
+        b'Rar!\x1a\x07': 'Archive', b'\xfd7zXZ\x00': 'Archive', b'BZh': 'Archive',
+        b'\x28\xb5\x2f\xfd': 'Archive',
+        b'%PDF-': 'PDF', b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1': 'Document',
+        b'\x7fELF': 'Executable', b'MZ': 'Executable',
+        b'SQLite format 3\x00': 'Database',
+        b'<?xml': 'XML', b'<!DOCTYPE html': 'HTML', b'<!doctype html': 'HTML', b'<html': 'HTML',
+        b'<?php': 'PHP', b'#!': '#!',
+    },
+    4: {b'ftyp': 'ftyp'},
+    257: {b'ustar': 'Archive'},
+}
+
+RIFF_TYPES = {b'WEBP': 'Image', b'WAVE': 'Audio', b'AVI ': 'Video'}
+
+# ISO media brands that aren't video
+FTYP_BRANDS = {b'M4A ': 'Audio', b'M4B ': 'Audio', b'heic': 'Image', b'heix': 'Image',
+               b'mif1': 'Image', b'avif': 'Image'}
+
+INTERPRETERS = {'python': 'Python', 'sh': 'Shell', 'bash': 'Shell', 'zsh': 'Shell', 'dash': 'Shell',
+                'node': 'JavaScript', 'ruby': 'Ruby', 'php': 'PHP'}
+
+def build_trie(signatures):
+    """Turns {bytes: category} into nested dicts, with the category under None."""
+    trie = {}
+    for magic, category in signatures.items():
+        node = trie
+        for byte in magic:
+            node = node.setdefault(byte, {})
+        node[None] = category
+    return trie
+
+SIGNATURE_TRIES = {offset: build_trie(sigs) for offset, sigs in SIGNATURES.items()}
+
+def classify_header(header):
+    """Returns the category of a file from its first bytes, or None."""
+    for offset, trie in SIGNATURE_TRIES.items():
+        node = trie
+        found = None
+        for byte in header[offset:offset + 32]:
+            node = node.get(byte)
+            if node is None:
+                break
+            found = node.get(None, found)
+        if found == 'riff':
+            return RIFF_TYPES.get(header[8:12])
+        if found == 'ftyp':
+            return FTYP_BRANDS.get(header[8:12], 'Video')
+        if found == '#!':
+            interpreter = header[2:].split(b'\n', 1)[0].split()
+            if interpreter and os.path.basename(interpreter[0]) == b'env':
+                interpreter = interpreter[1:]
+            name = os.path.basename(interpreter[0]).decode('ascii', 'replace') if interpreter else ''
+            return INTERPRETERS.get(name.rstrip('0123456789.'), 'Script')
+        if found:
+            return found
+    return None
+
+def read_header(path, size=SNIFF_BYTES):
     """
-    Walks a directory to count file extensions and estimate languages.
-    Updates a progress indicator on the same line.
+    Reads the first bytes of a file. Readahead is turned off for the read
+    and the pages dropped afterwards, so sniffing a USB stick reads a few
+    sectors per file instead of a readahead window, and doesn't push the
+    user's data out of the page cache.
+    """
+    flags = os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0)
+    try:
+        fd = os.open(path, flags | getattr(os, 'O_NOATIME', 0))
+    except PermissionError:
+        # O_NOATIME needs ownership of the file
+        fd = os.open(path, flags)
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, size, os.POSIX_FADV_RANDOM)
+        header = os.pread(fd, size, 0)
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, size, os.POSIX_FADV_DONTNEED)
+        return header
+    finally:
+        os.close(fd)
+
+def sniff_files(stats, candidates, sample=1.0):
     """
-    stats = {
+    Classifies a directory's files that have no known extension by their
+    content and counts them in stats. candidates are (inode, path, size)
+    tuples; they are read in inode order, which is close to disk order on
+    most filesystems. With sample below 1, only every 1/sample-th file is
+    read and the files in between are taken to be of the same type as the
+    last one read, since a directory's files are usually alike.
+    """
+    step = max(1, round(1 / sample))
+    kind = None
+    for i, (_, path, file_size) in enumerate(sorted(candidates)):
+        if i % step == 0:
+            try:
+                kind = classify_header(read_header(path))
+            except OSError:
+                kind = None
+        if kind:
+            stats['languages'][kind] += 1
+            stats['languages_size'][kind] += file_size
+            stats['sniffed'] += 1
+            push_largest(stats['largest_by_language'][kind], (file_size, path))
+
+def new_stats():
+    """Returns an empty stats dict as produced by analyze_directory."""
+    return {
         'file_count': 0,
         'skipped_count': 0,
         'extensions': defaultdict(int),
         'languages': defaultdict(int),
         'languages_size': defaultdict(int),
         'size_bytes': 0,
-        'largest_files': [] # List of tuples (size, path)
+        'largest_files': [], # List of tuples (size, path)
+        'largest_by_language': defaultdict(list), # Same, per language
+        'sniffed': 0 # Files classified by content rather than extension
     }
-    
-    ext_map = {
-        '.py': 'Python', '.js': 'JavaScript', '.ts': 'TypeScript', '.jsx': 'React (JS)', '.tsx': 'React (TS)',
-        '.vue': 'Vue.js', '.c': 'C', '.cpp': 'C++', '.h': 'C/C++ Header', '.cs': 'C#',
-        '.java': 'Java', '.go': 'Go', '.rs': 'Rust', '.swift': 'Swift', '.kt': 'Kotlin',
-        '.rb': 'Ruby', '.php': 'PHP', '.html': 'HTML', '.htm': 'HTML',
-        '.css': 'CSS', '.scss': 'Sass', '.less': 'Less',
-        '.sh': 'Shell', '.bash': 'Shell', '.zsh': 'Shell', '.bat': 'Batch', '.ps1': 'PowerShell',
-        '.md': 'Markdown', '.txt': 'Text', '.json': 'JSON', '.yaml': 'YAML', '.yml': 'YAML',
-        '.xml': 'XML', '.sql': 'SQL', '.toml': 'TOML', '.ini': 'INI',
-        '.jpg': 'Image', '.jpeg': 'Image', '.png': 'Image', '.gif': 'Image', '.svg': 'Image', '.webp': 'Image',
-        '.mp4': 'Video', '.mkv': 'Video', '.mov': 'Video', '.avi': 'Video', '.webm': 'Video',
-        '.mp3': 'Audio', '.wav': 'Audio', '.flac': 'Audio', '.m4a': 'Audio', '.ogg': 'Audio',
-        '.zip': 'Archive', '.tar': 'Archive', '.gz': 'Archive', '.7z': 'Archive', '.rar': 'Archive',
-        '.pdf': 'PDF', '.doc': 'Document', '.docx': 'Document', '.xls': 'Spreadsheet', '.xlsx': 'Spreadsheet',
-        '.ppt': 'Presentation', '.pptx': 'Presentation'
+
+def push_largest(heap, item):
+    """Keeps the TOP_FILES largest (size, path) items in a min-heap."""
+    if len(heap) < TOP_FILES:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+def add_file(stats, path, name, file_size):
+    """
+    Counts one file in stats. largest_files and largest_by_language are
+    kept as min-heaps. Returns whether the extension told what kind of
+    file it is.
+    """
+    stats['file_count'] += 1
+    stats['size_bytes'] += file_size
+    push_largest(stats['largest_files'], (file_size, path))
+
+    # Same as Path.suffix: "name." and ".bashrc" have no extension
+    suffix = os.path.splitext(name)[1].lower()
+    if suffix and suffix != '.':
+        stats['extensions'][suffix] += 1
+        if suffix in EXT_MAP:
+            lang = EXT_MAP[suffix]
+            stats['languages'][lang] += 1
+            stats['languages_size'][lang] += file_size
+            push_largest(stats['largest_by_language'][lang], (file_size, path))
+            return True
+    return False
+
+def merge_stats(parts):
+    """Merges the stats of several scan threads into one."""
+    stats = new_stats()
+    for part in parts:
+        stats['file_count'] += part['file_count']
+        stats['skipped_count'] += part['skipped_count']
+        stats['size_bytes'] += part['size_bytes']
+        stats['sniffed'] += part['sniffed']
+        for key in ('extensions', 'languages', 'languages_size'):
+            for name, value in part[key].items():
+                stats[key][name] += value
+        stats['largest_files'].extend(part['largest_files'])
+        for lang, files in part['largest_by_language'].items():
+            stats['largest_by_language'][lang].extend(files)
+    stats['largest_files'] = heapq.nlargest(TOP_FILES, stats['largest_files'])
+    for lang, files in stats['largest_by_language'].items():
+        stats['largest_by_language'][lang] = heapq.nlargest(TOP_FILES, files)
+    return stats
+
+def dump_dir_stats(stats, mtime, subdirs):
+    """Turns the stats of one directory's own files into an index entry."""
+    return {
+        'mtime': mtime,
+        'subdirs': subdirs,
+        'file_count': stats['file_count'],
+        'skipped_count': stats['skipped_count'],
+        'size_bytes': stats['size_bytes'],
+        'sniffed': stats['sniffed'],
+        'extensions': dict(stats['extensions']),
+        'languages': dict(stats['languages']),
+        'languages_size': dict(stats['languages_size']),
+        'largest': [(size, os.path.basename(path)) for size, path in stats['largest_files']],
+        'largest_by_language': {lang: [(size, os.path.basename(path)) for size, path in files]
+                                for lang, files in stats['largest_by_language'].items()},
     }
 
-    print(f"Scanning... ", end="", flush=True)
+def add_dir_stats(stats, entry, directory):
+    """Adds a directory's index entry to stats, as if its files were scanned."""
+    stats['file_count'] += entry['file_count']
+    stats['skipped_count'] += entry['skipped_count']
+    stats['size_bytes'] += entry['size_bytes']
+    stats['sniffed'] += entry['sniffed']
+    for key in ('extensions', 'languages', 'languages_size'):
+        for name, value in entry[key].items():
+            stats[key][name] += value
+    for size, name in entry['largest']:
+        push_largest(stats['largest_files'], (size, os.path.join(directory, name)))
+    for lang, files in entry['largest_by_language'].items():
+        for size, name in files:
+            push_largest(stats['largest_by_language'][lang], (size, os.path.join(directory, name)))
+
+def index_path(uuid):
+    return os.path.join(INDEX_DIR, f"{uuid}.json")
 
+def load_index(uuid):
+    """Returns the scan index saved for a filesystem UUID, or an empty one."""
     try:
-        path_obj = Path(path)
-        for root, _, files in os.walk(path):
-            for file in files:
-                stats['file_count'] += 1
-                
-                if stats['file_count'] % 10 == 0:
-                    print(f"\rScanning... {stats['file_count']} files found", end="", flush=True)
+        with open(index_path(uuid), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') == INDEX_VERSION:
+            return index
+    except (OSError, ValueError):
+        pass
+    return {'version': INDEX_VERSION, 'dirs': {}}
 
-                file_path = Path(root) / file
-                file_size = 0
-                try:
-                    file_size = file_path.lstat().st_size
-                    stats['size_bytes'] += file_size
-                    
-                    # Store top 10 largest files using a min-heap
-                    # We store (size, path)
-                    # If heap is < 10, push. If > 10, pushpop (pushes new, pops smallest)
-                    if len(stats['largest_files']) < 10:
-                         heapq.heappush(stats['largest_files'], (file_size, str(file_path)))
-                    else:
-                        heapq.heappushpop(stats['largest_files'], (file_size, str(file_path)))
+def save_index(uuid, index):
+    """Writes a scan index, atomically so an unplugged scan can't corrupt it."""
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    path = index_path(uuid)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'sniff': index.get('sniff'), 'dirs': index['dirs']},
+                      f, separators=(',', ':'))
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Warning: could not save the scan index: {e}")
 
-                except (OSError, ValueError):
-                    stats['skipped_count'] += 1
-                    continue
+# Levels of the directory tree kept for --tree/--export, and subdirectories
+# kept per directory there (the rest are summed up as "(other)")
+TREE_DEPTH = 3
+TREE_CHILDREN = 50
 
-                suffix = file_path.suffix.lower()
-                if suffix:
-                    stats['extensions'][suffix] += 1
-                    if suffix in ext_map:
-                        lang = ext_map[suffix]
-                        stats['languages'][lang] += 1
-                        stats['languages_size'][lang] += file_size
-                    
-    except PermissionError:
-        print(f"\nWarning: Permission denied accessing some files in {path}")
-    except OSError as e:
-        print(f"\nError scanning {path}: {e}")
-    
-    # Sort largest files descending for final output (heap is min-heap)
+class DirTree:
+    """
+    Adds up the size of every directory during a scan_tree pass, post-order:
+    a directory is held only while some of its subdirectories are still
+    being scanned, then its totals go to its parent and it's dropped, so
+    memory follows the scan's frontier rather than the number of
+    directories. Keeps the TOP_FILES largest directories at any depth, and
+    the top max_depth levels as a tree for a treemap.
+    """
+
+    def __init__(self, root, max_depth=TREE_DEPTH, max_children=TREE_CHILDREN):
+        self.root = os.path.normpath(str(root))
+        self.max_depth = max_depth
+        self.max_children = max_children
+        self.lock = threading.Lock()
+        self.open = {}
+        self.largest = []
+        self.tree = None
+
+    def add(self, directory, size, files, subdirs):
+        """Records a listed directory: its own files' size and count, and its number of subdirectories."""
+        with self.lock:
+            if directory == self.root:
+                depth = 0
+            else:
+                depth = self.open[os.path.dirname(directory)]['depth'] + 1
+            node = {'name': os.path.basename(directory) or directory, 'size': size, 'files': files,
+                    'depth': depth, 'pending': subdirs, 'children': [] if depth < self.max_depth else None}
+            if subdirs:
+                self.open[directory] = node
+                return
+            # Done: hand totals up as long as that completes the parent
+            while True:
+                push_largest(self.largest, (node['size'], directory))
+                self.prune(node, self.max_children)
+                if directory == self.root:
+                    self.tree = node
+                    return
+                parent_dir = os.path.dirname(directory)
+                parent = self.open[parent_dir]
+                parent['size'] += node['size']
+                parent['files'] += node['files']
+                if parent['children'] is not None:
+                    parent['children'].append(node)
+                    if len(parent['children']) > 2 * self.max_children:
+                        self.prune(parent, self.max_children)
+                parent['pending'] -= 1
+                if parent['pending']:
+                    return
+                del self.open[parent_dir]
+                directory, node = parent_dir, parent
+
+    @staticmethod
+    def prune(node, keep):
+        """Keeps a node's keep largest children, summing the others up as "(other)"."""
+        children = node['children']
+        if not children:
+            node.pop('children', None)
+            return
+        children.sort(key=lambda child: child['size'], reverse=True)
+        if len(children) > keep:
+            rest = children[keep:]
+            del children[keep:]
+            other = next((child for child in children if child['name'] == '(other)'), None)
+            if other is None:
+                other = {'name': '(other)', 'size': 0, 'files': 0}
+                children.append(other)
+            for child in rest:
+                other['size'] += child['size']
+                other['files'] += child['files']
+
+    def to_dict(self):
+        """The results: 'root', 'largest_dirs' [(size, path)] largest first, and 'tree' of name/size/files/children."""
+        def clean(node):
+            out = {'name': node['name'], 'size': node['size'], 'files': node['files']}
+            if node.get('children'):
+                out['children'] = [clean(child) for child in node['children']]
+            return out
+
+        return {
+            'root': self.root,
+            'largest_dirs': sorted(self.largest, reverse=True),
+            'tree': clean(self.tree) if self.tree else None,
+        }
+
+def scan_tree(path, workers=SCAN_WORKERS, progress=None, index=None, sniff=None, tree=None):
+    """
+    Scans a tree with os.scandir on a pool of threads. Each thread goes
+    depth-first through its own stack of directories and hands some to a
+    shared queue whenever another thread sits idle, so a deep subtree
+    doesn't end up on a single thread. Each thread keeps its own stats,
+    which are merged at the end.
+
+    Like os.walk, symlinks to directories are listed but not followed, and
+    unreadable directories are passed over. progress, if given, is called
+    from the scan threads with the number of files and bytes counted since
+    its last call.
+
+    With an index (see load_index), a directory whose mtime matches the
+    index isn't listed again: its files' counts come from the index and
+    only its subdirectories are visited, at one stat each. A directory's
+    mtime changes when files are added, removed or renamed in it, not when
+    a file is rewritten in place, so sizes of edited files can be stale
+    until --full. The index is updated in place, with index['reused']
+    set to the number of directories taken from it.
+
+    With sniff set (a sample rate, 1.0 for every file), files whose
+    extension isn't in EXT_MAP are classified by their first bytes, see
+    sniff_files.
+
+    With a DirTree, each directory's totals are added to it as it's done.
+    """
+    shared = queue.Queue()
+    lock = threading.Lock()
+    idle = [0]
+    results = []
+    root = os.path.normpath(str(path))
+    if index is not None:
+        cached_dirs = index.get('dirs', {})
+        index['dirs'] = {}
+        index['reused'] = 0
+        racy = time.time_ns() - RACY_NS
+
+    def scan_dir(directory, stack, stats):
+        counted = 0
+        size = 0
+        unknown = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        if not entry.is_symlink():
+                            stack.append(entry.path)
+                        continue
+                    counted += 1
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        stats['file_count'] += 1
+                        stats['skipped_count'] += 1
+                        continue
+                    file_size = st.st_size
+                    known = add_file(stats, entry.path, entry.name, file_size)
+                    if sniff and not known and stat.S_ISREG(st.st_mode):
+                        unknown.append((st.st_ino, entry.path, file_size))
+                    size += file_size
+                    if progress and counted % PROGRESS_EVERY == 0:
+                        progress(PROGRESS_EVERY, size)
+                        size = 0
+        except OSError:
+            pass
+        if unknown:
+            sniff_files(stats, unknown, sniff)
+        if progress and counted % PROGRESS_EVERY:
+            progress(counted % PROGRESS_EVERY, size)
+
+    def scan_indexed(directory, stack, stats):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return
+        rel = os.path.relpath(directory, root)
+        entry = cached_dirs.get(rel)
+        if entry and entry['mtime'] == mtime:
+            with lock:
+                index['reused'] += 1
+            stack.extend(os.path.join(directory, name) for name in entry['subdirs'])
+            if progress and entry['file_count']:
+                progress(entry['file_count'], entry['size_bytes'])
+        else:
+            own = new_stats()
+            start = len(stack)
+            scan_dir(directory, stack, own)
+            subdirs = [os.path.basename(d) for d in stack[start:]]
+            entry = dump_dir_stats(own, mtime if mtime < racy else None, subdirs)
+        index['dirs'][rel] = entry
+        add_dir_stats(stats, entry, directory)
+
+    def worker():
+        stats = new_stats()
+        results.append(stats)
+        while True:
+            with lock:
+                idle[0] += 1
+            directory = shared.get()
+            with lock:
+                idle[0] -= 1
+            if directory is None:
+                shared.task_done()
+                return
+            stack = [directory]
+            while stack:
+                directory = stack.pop()
+                start = len(stack)
+                size, files = stats['size_bytes'], stats['file_count']
+                if index is None:
+                    scan_dir(directory, stack, stats)
+                else:
+                    scan_indexed(directory, stack, stats)
+                if tree:
+                    tree.add(directory, stats['size_bytes'] - size, stats['file_count'] - files,
+                             len(stack) - start)
+                # Give the oldest (and usually largest) subtrees away
+                while len(stack) > 1 and idle[0] and shared.empty():
+                    shared.put(stack.pop(0))
+            shared.task_done()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    shared.put(root)
+    shared.join()
+    for _ in threads:
+        shared.put(None)
+    for thread in threads:
+        thread.join()
+
+    stats = merge_stats(results)
+    # Sort largest files descending for final output
     stats['largest_files'].sort(key=lambda x: x[0], reverse=True)
+    return stats
+
+def scan_with_index(path, workers=SCAN_WORKERS, uuid=None, full=False, progress=None, sniff=None, tree=None):
+    """
+    Runs scan_tree with the index of the filesystem's UUID, if it has one,
+    and saves the updated index. Returns the stats and the index (None
+    without a UUID). An index made with other sniff settings isn't used.
+    """
+    index = None
+    if uuid:
+        index = {'dirs': {}} if full else load_index(uuid)
+        if index.get('sniff') != sniff:
+            index['dirs'] = {}
+        index['sniff'] = sniff
+    stats = scan_tree(path, workers, progress, index, sniff, tree)
+    if index is not None:
+        save_index(uuid, index)
+    return stats, index
+
+def reused_note(index):
+    if index and index['reused']:
+        return f"Reused {index['reused']} of {len(index['dirs'])} directories from the last scan."
+    return ""
+
+def analyze_directory(path, workers=SCAN_WORKERS, uuid=None, full=False, sniff=None):
+    """
+    Scans a directory to count file extensions and estimate languages.
+    Updates a progress indicator on the same line. Given the filesystem's
+    UUID, directories unchanged since the last scan are taken from its
+    index (all of them are listed again with full=True). sniff turns on
+    classification by content, see scan_tree.
+    """
+    if not os.path.isdir(path):
+        print(f"\nError scanning {path}: not a readable directory")
+        return new_stats()
+
+    print(f"Scanning... ", end="", flush=True)
+
+    lock = threading.Lock()
+    seen = [0, 0.0]
+
+    def progress(count, size):
+        with lock:
+            seen[0] += count
+            now = time.monotonic()
+            if now - seen[1] >= 0.1:
+                seen[1] = now
+                print(f"\rScanning... {seen[0]} files found", end="", flush=True)
+
+    stats, index = scan_with_index(path, workers, uuid, full, progress, sniff)
 
     # Clear the progress line
     print(f"\rScan Complete! Analyzed {stats['file_count']} files.      ")
+    if reused_note(index):
+        print(f"  {reused_note(index)}")
+    return stats
+
+def list_dir(directory):
+    """Lists one directory: stats of its own files, and its subdirectories."""
+    own = new_stats()
+    subdirs = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                    continue
+                try:
+                    file_size = entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    own['file_count'] += 1
+                    own['skipped_count'] += 1
+                    continue
+                add_file(own, entry.path, entry.name, file_size)
+    except OSError:
+        pass
+    return own, subdirs
+
+def estimate_keys(stats):
+    """Flattens stats into (key, value) pairs, the quantities being estimated."""
+    yield ('file_count',), stats['file_count']
+    yield ('skipped_count',), stats['skipped_count']
+    yield ('size_bytes',), stats['size_bytes']
+    for key in ('extensions', 'languages', 'languages_size'):
+        for name, value in stats[key].items():
+            yield (key, name), value
+
+def estimate_tree(path, seconds=ESTIMATE_SECONDS, max_files=None, progress=None, seed=None):
+    """
+    Estimates what scan_tree would count under path without listing every
+    directory. Each probe walks down from path picking a random
+    subdirectory at each level, and counts the files it passes weighted by
+    how unlikely it was to get there (the product of the branching
+    factors), which on average gives the whole tree's totals (Knuth's
+    estimator). Probes run until seconds go by or max_files have been
+    listed. Listings are kept, so probes get cheaper as they go, and once
+    every directory has been listed the exact stats are returned instead.
+
+    Returns stats as scan_tree does, rounded, with an 'estimate' key:
+    probes, dirs listed, files listed, whether it's exact, and the 95%
+    margin of every number as 'margin' (same layout as the stats).
+    """
+    rng = random.Random(seed)
+    deadline = time.monotonic() + seconds
+    listings = {}
+    unlisted = {path}
+    listed_files = 0
+    listed_size = 0
+    probes = 0
+    sums = defaultdict(float)
+    squares = defaultdict(float)
+
+    while unlisted:
+        if probes >= 2 and (time.monotonic() >= deadline or (max_files and listed_files >= max_files)):
+            break
+        directory = path
+        weight = 1
+        found = defaultdict(float)
+        while True:
+            if directory not in listings:
+                listings[directory] = list_dir(directory)
+                unlisted.discard(directory)
+                own, subdirs = listings[directory]
+                unlisted.update(subdirs)
+                listed_files += own['file_count']
+                listed_size += own['size_bytes']
+                if progress:
+                    progress(own['file_count'], own['size_bytes'])
+            own, subdirs = listings[directory]
+            for key, value in estimate_keys(own):
+                found[key] += weight * value
+            if not subdirs:
+                break
+            weight *= len(subdirs)
+            directory = rng.choice(subdirs)
+        probes += 1
+        for key, value in found.items():
+            sums[key] += value
+            squares[key] += value * value
+
+    stats = merge_stats([own for own, _ in listings.values()])
+    exact = not unlisted
+    margins = new_stats()
+    if not exact:
+        # Keys a probe didn't see count as zeroes in that probe
+        for key in sums:
+            mean = sums[key] / probes
+            variance = max(squares[key] / probes - mean * mean, 0) * probes / (probes - 1)
+            value, margin = round(mean), round(1.96 * math.sqrt(variance / probes))
+            if len(key) == 1:
+                stats[key[0]], margins[key[0]] = value, margin
+            else:
+                stats[key[0]][key[1]], margins[key[0]][key[1]] = value, margin
+        for key in ('extensions', 'languages', 'languages_size'):
+            for name in [name for name, value in stats[key].items() if not value]:
+                del stats[key][name]
+    margins.pop('largest_files')
+    margins.pop('largest_by_language')
+    margins.pop('sniffed')
+    stats['estimate'] = {
+        'probes': probes,
+        'dirs': len(listings),
+        'files': listed_files,
+        'bytes': listed_size,
+        'exact': exact,
+        'margin': margins,
+    }
     return stats
 
+def make_bench_tree(root, files, per_dir=1000):
+    """Creates files empty files under root, per_dir to a directory, two levels deep."""
+    dirs = (files + per_dir - 1) // per_dir
+    made = 0
+    for d in range(dirs):
+        directory = os.path.join(root, f"d{d // 100:03d}", f"d{d:05d}")
+        os.makedirs(directory, exist_ok=True)
+        for f in range(min(per_dir, files - made)):
+            ext = ('.py', '.jpg', '.txt', '.c', '.bin')[f % 5]
+            with open(os.path.join(directory, f"f{f:04d}{ext}"), 'wb') as fh:
+                if f % 97 == 0:
+                    fh.write(b"x" * f)
+        made += min(per_dir, files - made)
+
+def walk_tree(path):
+    """The os.walk + Path.lstat scanner analyze_directory used before, kept for benchmarks."""
+    count = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                (Path(root) / file).lstat()
+                count += 1
+            except OSError:
+                pass
+    return count
+
+def benchmark_scan(files=1000000, directory=None, workers=(1, 4, SCAN_WORKERS, 16)):
+    """Times os.walk against scan_tree on a generated tree of the given size."""
+    root = tempfile.mkdtemp(prefix="usb-analyzer-bench-", dir=directory)
+    try:
+        print(f"Creating {files} files in {root}...", flush=True)
+        started = time.monotonic()
+        make_bench_tree(root, files)
+        print(f"  done in {time.monotonic() - started:.1f}s\n")
+
+        # One untimed pass so every run sees the same warm cache
+        walk_tree(root)
+
+        started = time.monotonic()
+        count = walk_tree(root)
+        baseline = time.monotonic() - started
+        print(f"  os.walk + lstat      {baseline:8.2f}s  {count / baseline:10.0f} files/s")
+        for n in workers:
+            started = time.monotonic()
+            stats = scan_tree(root, n)
+            elapsed = time.monotonic() - started
+            print(f"  scandir, {n:>2} threads  {elapsed:8.2f}s  {stats['file_count'] / elapsed:10.0f} files/s"
+                  f"  ({baseline / elapsed:.1f}x)")
+        print("\nThe tree was in the page cache; a cold USB drive gains more from the threads.")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+# Bytes read from each end of a file for the partial hash
+PARTIAL_BLOCK = 4096
+
+# Files listed before they are written to the candidate database
+DUPE_BATCH = 10000
+
+def get_hasher():
+    """xxh3-128 when the xxhash module is installed, BLAKE2b otherwise."""
+    try:
+        import xxhash
+        return xxhash.xxh3_128
+    except ImportError:
+        return lambda: hashlib.blake2b(digest_size=16)
+
+def partial_hash(path, size, block=PARTIAL_BLOCK):
+    """Hashes the first and last block of a file."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        h.update(f.read(block))
+        if size > block:
+            f.seek(max(block, size - block))
+            h.update(f.read(block))
+    return h.digest()
+
+def full_hash(path, new_hash, bufsize=1 << 20):
+    h = new_hash()
+    buf = bytearray(bufsize)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        while n := f.readinto(buf):
+            h.update(view[:n])
+    return h.digest()
+
+def list_files(root, out, min_size=1):
+    """
+    Puts batches of (size, dev, ino, path) for the regular files under root
+    on the out queue. Paths are bytes so any file name round-trips.
+    """
+    batch = []
+    stack = [os.fsencode(root)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if st.st_size >= min_size:
+                        batch.append((st.st_size, st.st_dev, st.st_ino, entry.path))
+                        if len(batch) >= DUPE_BATCH:
+                            out.put(batch)
+                            batch = []
+        except OSError:
+            pass
+    if batch:
+        out.put(batch)
+
+def hash_group(size, entries, new_hash):
+    """
+    Splits files of one size into groups of identical content: first by a
+    hash of their ends, then by a full hash where those still match.
+    Small files are covered whole by the partial hash. Returns a list of
+    (size, paths).
+    """
+    def bucket(paths, key):
+        buckets = {}
+        for path in paths:
+            try:
+                digest = key(path)
+            except OSError:
+                continue
+            buckets.setdefault(digest, []).append(path)
+        return [group for group in buckets.values() if len(group) > 1]
+
+    groups = bucket(entries, lambda path: partial_hash(path, size))
+    if size > 2 * PARTIAL_BLOCK:
+        groups = [same for group in groups for same in bucket(group, lambda path: full_hash(path, new_hash))]
+    return [(size, group) for group in groups]
+
+def find_duplicates(roots, min_size=1, workers=SCAN_WORKERS, db_dir=None):
+    """
+    Finds files with identical content under roots. Files are listed (one
+    thread per root) into a temporary SQLite database, so only one size
+    bucket at a time has to be held in memory however many files there are.
+    Sizes seen more than once are then hashed on a thread pool, a bounded
+    number of buckets at a time. Hard links to the same file count once.
+
+    Returns groups as {'size', 'paths', 'reclaimable'}, most reclaimable
+    bytes first.
+    """
+    db_file = tempfile.NamedTemporaryFile(prefix="usb-analyzer-dupes-", suffix=".db", dir=db_dir, delete=False)
+    db_file.close()
+    db = sqlite3.connect(db_file.name)
+    try:
+        db.execute("PRAGMA journal_mode=OFF")
+        db.execute("PRAGMA synchronous=OFF")
+        db.execute("CREATE TABLE files (size INTEGER, dev INTEGER, ino INTEGER, path BLOB)")
+
+        out = queue.Queue(maxsize=64)
+        listers = [threading.Thread(target=list_files, args=(root, out, min_size), daemon=True)
+                   for root in roots]
+        for thread in listers:
+            thread.start()
+        while any(thread.is_alive() for thread in listers) or not out.empty():
+            try:
+                batch = out.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            db.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", batch)
+        db.execute("CREATE INDEX files_size ON files (size)")
+
+        rows = db.execute(
+            "SELECT DISTINCT size, dev, ino, path FROM files WHERE size IN "
+            "(SELECT size FROM files GROUP BY size HAVING COUNT(DISTINCT dev || ':' || ino) > 1) "
+            "ORDER BY size, dev, ino")
+
+        new_hash = get_hasher()
+        results = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for size, group in itertools.groupby(rows, key=lambda row: row[0]):
+                # One path per inode: hard links and overlapping roots aren't duplicates
+                inodes = {}
+                for _, dev, ino, path in group:
+                    inodes.setdefault((dev, ino), path)
+                if len(inodes) < 2:
+                    continue
+                pending.add(pool.submit(hash_group, size, list(inodes.values()), new_hash))
+                if len(pending) >= workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    results.extend(f.result() for f in done)
+            results.extend(f.result() for f in wait(pending).done)
+    finally:
+        db.close()
+        os.unlink(db_file.name)
+
+    groups = [{
+        'size': size,
+        'paths': sorted(os.fsdecode(p) for p in paths),
+        'reclaimable': size * (len(paths) - 1),
+    } for found in results for size, paths in found]
+    groups.sort(key=lambda g: (-g['reclaimable'], g['paths'][0]))
+    return groups
+
+def print_duplicates(groups, limit=20):
+    reclaimable = sum(g['reclaimable'] for g in groups)
+    files = sum(len(g['paths']) for g in groups)
+    print(f"\033[1;35mDuplicate Files:\033[0m {len(groups)} group(s), {files} files, "
+          f"{human_readable_size(reclaimable)} reclaimable")
+    for group in groups[:limit]:
+        print(f"\n  [{human_readable_size(group['size']):>8}] x{len(group['paths'])}  "
+              f"({human_readable_size(group['reclaimable'])} reclaimable)")
+        for path in group['paths']:
+            print(f"      {path}")
+    if len(groups) > limit:
+        print(f"\n  ... and {len(groups) - limit} more group(s)")
+
+# Content manifests for --snapshot and --verify, by filesystem UUID
+MANIFEST_DIR = os.path.join(INDEX_DIR, 'manifests')
+MANIFEST_VERSION = 1
+
+# Bytes of a mapped file handed to the hash at a time
+MAP_CHUNK = 8 << 20
+
+def manifest_hasher(name=None):
+    """
+    Returns (name, new_hash) for the manifest hash called name, or the
+    fastest one available (as get_hasher) when name is None.
+    """
+    if name in (None, 'xxh3_128'):
+        try:
+            import xxhash
+            return 'xxh3_128', xxhash.xxh3_128
+        except ImportError:
+            if name:
+                raise ValueError("this manifest was hashed with xxh3_128: install the xxhash module")
+    if name not in (None, 'blake2b_128'):
+        raise ValueError(f"unknown manifest hash: {name}")
+    return 'blake2b_128', lambda: hashlib.blake2b(digest_size=16)
+
+def mmap_hash(path, new_hash):
+    """Hashes a file through a read-only mapping, so the data isn't copied into Python."""
+    h = new_hash()
+    with open(path, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, 'madvise'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, MAP_CHUNK):
+                        h.update(view[offset:offset + MAP_CHUNK])
+                finally:
+                    view.release()
+    return h.hexdigest()
+
+def hash_files(items, root, new_hash, workers=SCAN_WORKERS):
+    """
+    Hashes (relpath, ...) items under root on a thread pool, a bounded
+    number at a time. Yields (item, hexdigest), with None for files that
+    can't be read.
+    """
+    def job(item):
+        try:
+            return item, mmap_hash(os.path.join(root, item[0]), new_hash)
+        except (OSError, ValueError):
+            return item, None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for item in items:
+            pending.add(pool.submit(job, item))
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in wait(pending).done:
+            yield future.result()
+
+def walk_files(root):
+    """Yields (relpath, size, mtime_ns) for the regular files under root."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    yield os.path.relpath(entry.path, root), st.st_size, st.st_mtime_ns
+        except OSError:
+            pass
+
+def manifest_path(root, uuid=None):
+    """Where the manifest of a device (by UUID) or of any other directory is kept."""
+    if not uuid:
+        uuid = "path-" + hashlib.blake2b(os.path.realpath(root).encode(), digest_size=8).hexdigest()
+    return os.path.join(MANIFEST_DIR, f"{uuid}.json")
+
+def snapshot_device(root, path, workers=SCAN_WORKERS):
+    """
+    Hashes every file under root and writes a manifest of their size,
+    mtime and hash to path (atomically). Returns the manifest.
+    """
+    name, new_hash = manifest_hasher()
+    files = {}
+    for (rel, size, mtime), digest in hash_files(walk_files(root), root, new_hash, workers):
+        if digest:
+            files[rel] = [size, mtime, digest]
+    manifest = {'version': MANIFEST_VERSION, 'root': root, 'hash': name, 'created': time.time(),
+                'files': dict(sorted(files.items()))}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(tmp, path)
+    return manifest
+
+def load_manifest(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"{path}: unsupported manifest version {manifest.get('version')}")
+    return manifest
+
+def verify_device(root, manifest, workers=SCAN_WORKERS, rehash=False):
+    """
+    Checks the files under root against a manifest. Files whose size and
+    mtime still match are taken as intact without reading them, unless
+    rehash is set. A file with the same size but another mtime is hashed,
+    and only counts as changed if its content did.
+
+    Returns lists of relative paths: 'changed' (modified since the
+    snapshot), 'corrupted' (content differs though size and mtime don't,
+    or unreadable), 'missing' and 'new'; plus counts 'ok' and 'hashed'.
+    """
+    _, new_hash = manifest_hasher(manifest['hash'])
+    expected = manifest['files']
+    report = {'ok': 0, 'hashed': 0, 'changed': [], 'corrupted': [], 'missing': [], 'new': []}
+    seen = set()
+    to_hash = []
+    for rel, size, mtime in walk_files(root):
+        seen.add(rel)
+        if rel not in expected:
+            report['new'].append(rel)
+            continue
+        old_size, old_mtime, _ = expected[rel]
+        if size != old_size:
+            report['changed'].append(rel)
+        elif mtime != old_mtime or rehash:
+            to_hash.append((rel, mtime == old_mtime))
+        else:
+            report['ok'] += 1
+
+    for (rel, same_mtime), digest in hash_files(to_hash, root, new_hash, workers):
+        report['hashed'] += 1
+        if digest == expected[rel][2]:
+            report['ok'] += 1
+        elif same_mtime or digest is None:
+            report['corrupted'].append(rel)
+        else:
+            report['changed'].append(rel)
+
+    report['missing'] = [rel for rel in expected if rel not in seen]
+    for key in ('changed', 'corrupted', 'missing', 'new'):
+        report[key].sort()
+    return report
+
+def print_verify(report, limit=20):
+    """Prints verify_device's findings, worst first."""
+    colors = {'corrupted': "\033[1;31m", 'missing': "\033[1;31m", 'changed': "\033[1;33m", 'new': "\033[1;36m"}
+    print(f"  \033[1;32mOK:\033[0m {report['ok']} file(s) ({report['hashed']} hashed)")
+    for key in ('corrupted', 'missing', 'changed', 'new'):
+        if not report[key]:
+            continue
+        print(f"  {colors[key]}{key.capitalize()}:\033[0m {len(report[key])} file(s)")
+        for rel in report[key][:limit]:
+            print(f"      {rel}")
+        if len(report[key]) > limit:
+            print(f"      ... and {len(report[key]) - limit} more")
+
+# Seconds each read test runs for, block sizes of the sequential and random
+# tests, and the size of the optional write test
+THROUGHPUT_SECONDS = 5
+SEQ_BLOCK = 1 << 20
+RANDOM_BLOCK = 4096
+WRITE_BYTES = 64 * 1024**2
+
+def drop_cache(fd, offset=0, length=0):
+    """Drops a file's pages from the page cache so the next read goes to the device."""
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+def open_uncached(path, flags=os.O_RDONLY):
+    """
+    Opens path with O_DIRECT, so reads and writes bypass the page cache.
+    Where the filesystem won't do that (FUSE mounts like ntfs-3g, or it
+    fails on the first read), opens it normally with its cached pages
+    dropped instead. Returns (fd, direct). Buffers used with a direct fd
+    must be page aligned: anonymous mmaps are.
+    """
+    if hasattr(os, 'O_DIRECT'):
+        try:
+            fd = os.open(path, flags | os.O_DIRECT)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+        else:
+            if flags & os.O_ACCMODE == os.O_WRONLY:
+                return fd, True
+            try:
+                with mmap.mmap(-1, RANDOM_BLOCK) as probe:
+                    os.preadv(fd, [probe], 0)
+                return fd, True
+            except OSError as e:
+                os.close(fd)
+                if e.errno != errno.EINVAL:
+                    raise
+    fd = os.open(path, flags)
+    drop_cache(fd)
+    return fd, False
+
+def bench_sequential(paths, seconds=THROUGHPUT_SECONDS, block=SEQ_BLOCK):
+    """
+    Reads paths one after the other for up to seconds. Files that can't be
+    opened or read (permissions, I/O errors) are skipped. Returns (bytes,
+    elapsed, direct, skipped paths).
+    """
+    total = 0
+    direct = True
+    skipped = []
+    started = time.monotonic()
+    deadline = started + seconds
+    with mmap.mmap(-1, block) as buf:
+        for path in paths:
+            try:
+                fd, file_direct = open_uncached(path)
+            except OSError:
+                skipped.append(path)
+                continue
+            direct = direct and file_direct
+            try:
+                offset = 0
+                while time.monotonic() < deadline:
+                    n = os.preadv(fd, [buf], offset)
+                    total += n
+                    offset += n
+                    if n < block:
+                        break
+                if not file_direct:
+                    drop_cache(fd)
+            except OSError:
+                skipped.append(path)
+            finally:
+                os.close(fd)
+            if time.monotonic() >= deadline:
+                break
+    return total, time.monotonic() - started, direct, skipped
+
+def bench_random(paths, seconds=THROUGHPUT_SECONDS, block=RANDOM_BLOCK, seed=None):
+    """
+    Reads aligned blocks at random offsets across paths, picked by size,
+    for up to seconds. Without O_DIRECT every block is dropped from the
+    cache after it's read, so reading it again isn't a cache hit. A file
+    that can't be opened or read is left out from then on. Returns (reads,
+    elapsed, direct, skipped paths).
+    """
+    rng = random.Random(seed)
+    files = []
+    skipped = []
+    try:
+        for path in paths:
+            try:
+                blocks = os.path.getsize(path) // block
+                if blocks:
+                    fd, file_direct = open_uncached(path)
+                    files.append((path, fd, blocks, file_direct))
+            except OSError:
+                skipped.append(path)
+        if not files:
+            return 0, 0.0, False, skipped
+        direct = all(f[3] for f in files)
+        for _, fd, _, file_direct in files:
+            if not file_direct and hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_RANDOM)
+        reads = 0
+        started = time.monotonic()
+        deadline = started + seconds
+        with mmap.mmap(-1, block) as buf:
+            while files and time.monotonic() < deadline:
+                entry = rng.choices(files, [f[2] for f in files])[0]
+                path, fd, blocks, file_direct = entry
+                offset = rng.randrange(blocks) * block
+                try:
+                    os.preadv(fd, [buf], offset)
+                except OSError:
+                    files.remove(entry)
+                    os.close(fd)
+                    skipped.append(path)
+                    continue
+                if not file_direct:
+                    drop_cache(fd, offset, block)
+                reads += 1
+        return reads, time.monotonic() - started, direct, skipped
+    finally:
+        for _, fd, _, _ in files:
+            os.close(fd)
+
+def bench_write(directory, size=WRITE_BYTES, block=SEQ_BLOCK):
+    """
+    Writes size bytes of random data (so compressing or deduplicating
+    controllers can't cheat) to a temporary file in directory, synced to
+    the device, then removes it. Returns (bytes, elapsed, direct).
+    """
+    handle, path = tempfile.mkstemp(prefix='.usb_analyzer-', dir=directory)
+    os.close(handle)
+    try:
+        with mmap.mmap(-1, block) as buf:
+            buf.write(os.urandom(block))
+            fd, direct = open_uncached(path, os.O_WRONLY)
+            try:
+                written = 0
+                started = time.monotonic()
+                while written < size:
+                    n = min(block, size - written)
+                    if n == block:
+                        written += os.pwritev(fd, [buf], written)
+                    elif direct and n % RANDOM_BLOCK:
+                        # O_DIRECT only takes whole sectors, so an uneven tail goes through the cache
+                        tail = os.open(path, os.O_WRONLY)
+                        try:
+                            written += os.pwrite(tail, buf[:n], written)
+                            os.fsync(tail)
+                        finally:
+                            os.close(tail)
+                    else:
+                        with memoryview(buf) as view, view[:n] as chunk:
+                            written += os.pwritev(fd, [chunk], written)
+                os.fsync(fd)
+                elapsed = time.monotonic() - started
+            finally:
+                os.close(fd)
+    finally:
+        os.unlink(path)
+    return written, elapsed, direct
+
+def benchmark_device(mountpoint, paths, seconds=THROUGHPUT_SECONDS, write_bytes=0):
+    """
+    Measures a mounted device's read throughput on existing files (the
+    largest ones the scan found), and its write throughput with
+    write_bytes > 0. Returns a dict of MB/s and IOPS figures.
+    """
+    paths = sorted((p for p in paths if os.path.isfile(p) and not os.path.islink(p)),
+                   key=os.path.getsize, reverse=True)
+    result = {'files': len(paths), 'direct': True, 'skipped': 0}
+    mb = 1024**2
+    if paths:
+        total, elapsed, direct, seq_skipped = bench_sequential(paths, seconds)
+        if total:
+            result['seq_mb_s'] = total / elapsed / mb
+            result['seq_bytes'] = total
+            result['direct'] = result['direct'] and direct
+        reads, elapsed, direct, rand_skipped = bench_random(paths, seconds)
+        if reads:
+            result['rand_iops'] = reads / elapsed
+            result['rand_mb_s'] = reads * RANDOM_BLOCK / elapsed / mb
+            result['direct'] = result['direct'] and direct
+        result['skipped'] = len(set(seq_skipped) | set(rand_skipped))
+    if write_bytes:
+        try:
+            written, elapsed, direct = bench_write(mountpoint, write_bytes)
+            result['write_mb_s'] = written / elapsed / mb
+            result['direct'] = result['direct'] and direct
+        except OSError as e:
+            result['write_error'] = str(e)
+    return result
+
 def human_readable_size(size_bytes):
     """Converts bytes to human readable string."""
     if size_bytes is None:
@@ -179,7 +1524,25 @@ def draw_bar(count, max_count, width=15):
     bar = "█" * filled + "░" * (width - filled)
     return bar
 
-def format_output(device_info, scan_stats=None, disk_usage=None):
+def format_throughput(result):
+    """Prints benchmark_device's figures."""
+    how = "O_DIRECT" if result['direct'] else "page cache dropped"
+    print(f"\n    \033[1;34mThroughput ({how}):\033[0m")
+    if 'seq_mb_s' in result:
+        print(f"      Sequential read: {result['seq_mb_s']:8.1f} MB/s "
+              f"({human_readable_size(result['seq_bytes'])} from {result['files']} file(s))")
+    if 'rand_iops' in result:
+        print(f"      Random 4K read:  {result['rand_iops']:8.0f} IOPS ({result['rand_mb_s']:.2f} MB/s)")
+    if not result['files']:
+        print("      No files to read from.")
+    if result.get('skipped'):
+        print(f"      Skipped {result['skipped']} unreadable file(s).")
+    if 'write_mb_s' in result:
+        print(f"      Sequential write:{result['write_mb_s']:8.1f} MB/s")
+    if 'write_error' in result:
+        print(f"      Write test failed: {result['write_error']}")
+
+def format_output(device_info, scan_stats=None, disk_usage=None, throughput=None):
     """Parses and properly formats the output for the user."""
     
     name = device_info.get('name', 'Unknown')
@@ -198,9 +1561,21 @@ def format_output(device_info, scan_stats=None, disk_usage=None):
         print(f"    Free: {human_readable_size(free)}")
     
     if scan_stats:
-        print(f"  Content Analysis:")
-        print(f"    Total Files: {scan_stats['file_count']} (Skipped: {scan_stats['skipped_count']})")
-        print(f"    Data Size:   {human_readable_size(scan_stats['size_bytes'])}")
+        estimate = scan_stats.get('estimate')
+        margin = estimate['margin'] if estimate and not estimate['exact'] else None
+        if margin:
+            print(f"  Content Analysis (estimated from {estimate['probes']} probes, "
+                  f"{estimate['files']} files in {estimate['dirs']} directories listed, 95% margins):")
+            print(f"    Total Files: ~{scan_stats['file_count']} ± {margin['file_count']} "
+                  f"(Skipped: ~{scan_stats['skipped_count']})")
+            print(f"    Data Size:   ~{human_readable_size(scan_stats['size_bytes'])} "
+                  f"± {human_readable_size(margin['size_bytes'])}")
+        else:
+            print(f"  Content Analysis:")
+            print(f"    Total Files: {scan_stats['file_count']} (Skipped: {scan_stats['skipped_count']})")
+            print(f"    Data Size:   {human_readable_size(scan_stats['size_bytes'])}")
+        if scan_stats.get('sniffed'):
+            print(f"    By Content:  {scan_stats['sniffed']} files without a known extension")
         
         if scan_stats['languages']:
             print(f"\n    \033[1;32mFile Composition (Count | Size):\033[0m")
@@ -232,13 +1607,16 @@ def format_output(device_info, scan_stats=None, disk_usage=None):
                 
                 lang_str = f"{lang:<12}"
                 count_str = f"{str(count):<6}"
+                if margin:
+                    count_str = f"{count_str} ±{margin['languages'].get(lang, 0):<6}"
+                    size_str = f"{size_str} ±{human_readable_size(margin['languages_size'].get(lang, 0))}"
                 
                 print(f"      {color}{lang_str} {count_bar} {count_str} {size_bar} {size_str}{reset}")
         else:
              print("    No recognized file types found.")
              
         if scan_stats.get('largest_files'):
-            print(f"\n    \033[1;35mTop 10 Largest Files:\033[0m")
+            print(f"\n    \033[1;35mTop 10 Largest Files{' Seen' if margin else ''}:\033[0m")
             for size, path in scan_stats['largest_files']:
                 # Truncate path if too long?
                 # Let's show relative path if possible, or usually just filename is enough if path is super deep
@@ -246,17 +1624,226 @@ def format_output(device_info, scan_stats=None, disk_usage=None):
                 # print formatted: [SIZE] Path
                 print(f"      [{human_readable_size(size):>8}] {path}")
 
+        if scan_stats.get('dirs'):
+            print(f"\n    \033[1;35mTop 10 Largest Directories:\033[0m")
+            for size, path in scan_stats['dirs']['largest_dirs']:
+                print(f"      [{human_readable_size(size):>8}] {path}")
+
+    if throughput:
+        format_throughput(throughput)
+
     print("-" * 60)
     print("\n") 
 
-def main():
-    print_title()
-    print("Searching for devices...\n")
-    
-    data = get_drive_info()
-    if not data:
-        return
+def group_by_disk(lsblk_data, devices):
+    """
+    Groups devices by the physical disk they are on, keeping their order,
+    so partitions of one disk can be scanned one after the other.
+    """
+    disk_of = {}
+
+    def recurse(devs, disk):
+        for dev in devs:
+            disk_of[dev['name']] = disk or dev['name']
+            recurse(dev.get('children', []), disk or dev['name'])
+
+    recurse((lsblk_data or {}).get('blockdevices', []), None)
+    groups = {}
+    for dev in devices:
+        groups.setdefault(disk_of.get(dev['name'], dev['name']), []).append(dev)
+    return list(groups.values())
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+class LiveProgress:
+    """
+    One status line per device (files/s, MB/s, ETA against the used space),
+    redrawn in place while scans run. Reports of finished devices are printed
+    above the status lines. Without a terminal only the reports are printed.
+    """
+
+    def __init__(self, devices, live=True, interval=0.2):
+        self.rows = {dev['name']: {'state': 'waiting', 'files': 0, 'bytes': 0, 'total': 0,
+                                   'started': 0.0, 'elapsed': 0.0} for dev in devices}
+        self.live = live
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.drawn = 0
+        self.stop = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        if self.live:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        if self.thread:
+            self.thread.join()
+        with self.lock:
+            self.clear()
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            with self.lock:
+                self.clear()
+                self.draw()
+
+    def start(self, name, total):
+        with self.lock:
+            self.rows[name].update(state='scanning', total=total, started=time.monotonic())
+
+    def update(self, name, files, size):
+        row = self.rows[name]
+        with self.lock:
+            row['files'] += files
+            row['bytes'] += size
+
+    def finish(self, name, report):
+        """Marks a device done and prints its report (a function that prints)."""
+        with self.lock:
+            row = self.rows[name]
+            if row['started']:
+                row['elapsed'] = time.monotonic() - row['started']
+            row['state'] = 'done'
+            self.clear()
+            report()
+            self.draw()
+
+    def clear(self):
+        if self.drawn:
+            sys.stdout.write(f"\033[{self.drawn}F\033[J")
+            self.drawn = 0
+
+    def draw(self):
+        if not self.live:
+            sys.stdout.flush()
+            return
+        lines = []
+        for name, row in self.rows.items():
+            if row['state'] == 'waiting':
+                lines.append(f"  {name:<10} waiting")
+                continue
+            elapsed = row['elapsed'] if row['state'] == 'done' else time.monotonic() - row['started']
+            elapsed = max(elapsed, 0.001)
+            rate = row['bytes'] / elapsed
+            bar = draw_bar(min(row['bytes'], row['total']), row['total'], width=15)
+            if row['state'] == 'done':
+                eta = f"done in {format_duration(elapsed)}"
+            elif rate and row['total'] > row['bytes']:
+                eta = f"ETA {format_duration((row['total'] - row['bytes']) / rate)}"
+            else:
+                eta = "ETA --:--"
+            lines.append(f"  {name:<10} {bar} {row['files']:>9} files {row['files'] / elapsed:>8.0f}/s "
+                         f"{rate / 1048576:>7.1f} MB/s  {eta}")
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+        self.drawn = len(lines)
+
+def scan_devices(devices, lsblk_data, workers=SCAN_WORKERS, full=False, live=None, sniff=None, sample=None,
+                 throughput=None, tree_depth=None):
+    """
+    Scans all devices at once: one thread per physical disk, going through
+    that disk's partitions in turn, each partition scanned by scan_tree.
+    Reports are printed as devices finish. sample is a dict of seconds,
+    max_files and exact_below: devices using at least exact_below bytes
+    are then estimated by estimate_tree rather than scanned. throughput
+    is a dict of seconds and write_bytes for benchmark_device, run on each
+    device after its scan. With tree_depth, directory sizes are added up
+    by a DirTree and kept in the stats as 'dirs' (not when estimating).
 
+    Returns (device, stats) pairs, stats None for devices not scanned.
+    """
+    if live is None:
+        live = sys.stdout.isatty()
+    groups = group_by_disk(lsblk_data, devices)
+    results = {}
+
+    with LiveProgress(devices, live) as view:
+        def scan_group(group):
+            for dev in group:
+                mountpoint = dev.get('mountpoint')
+                scan_stats = None
+                disk_usage = None
+                measured = None
+                note = ""
+
+                if mountpoint and os.path.isdir(mountpoint):
+                    try:
+                        usage = shutil.disk_usage(mountpoint)
+                        disk_usage = (usage.total, usage.used, usage.free)
+                        view.start(dev['name'], usage.used)
+                        progress = lambda files, size, name=dev['name']: view.update(name, files, size)
+                        if sample and usage.used >= sample['exact_below']:
+                            scan_stats = estimate_tree(mountpoint, sample['seconds'], sample['max_files'], progress)
+                        else:
+                            dir_tree = DirTree(mountpoint, tree_depth) if tree_depth is not None else None
+                            scan_stats, index = scan_with_index(
+                                mountpoint, workers, dev.get('uuid'), full, progress, sniff, dir_tree)
+                            note = reused_note(index)
+                            if dir_tree:
+                                scan_stats['dirs'] = dir_tree.to_dict()
+                        if throughput:
+                            measured = benchmark_device(
+                                mountpoint, [path for _, path in scan_stats['largest_files']],
+                                throughput['seconds'], throughput['write_bytes'])
+                    except Exception as e:
+                        note = f"Error accessing {mountpoint}: {e}"
+
+                def report():
+                    if note:
+                        print(note)
+                    format_output(dev, scan_stats, disk_usage, measured)
+
+                results[dev['name']] = scan_stats
+                view.finish(dev['name'], report)
+
+        with ThreadPoolExecutor(max_workers=len(groups) or 1) as pool:
+            for future in [pool.submit(scan_group, group) for group in groups]:
+                future.result()
+    return [(dev, results.get(dev['name'])) for dev in devices]
+
+def export_scan(path, results):
+    """
+    Writes scan_devices' results as JSON for other tools (a treemap view,
+    say): per device its totals, languages with their largest files, the
+    largest files and directories, and the directory tree if it was built.
+    """
+    def files(items):
+        return [{'size': size, 'path': file_path} for size, file_path in items]
+
+    devices = []
+    for dev, stats in results:
+        entry = {key: dev.get(key) for key in ('name', 'mountpoint', 'uuid', 'label', 'size')}
+        if stats:
+            dirs = stats.get('dirs') or {}
+            entry.update({
+                'estimated': bool(stats.get('estimate')) and not stats['estimate']['exact'],
+                'file_count': stats['file_count'],
+                'size_bytes': stats['size_bytes'],
+                'languages': {lang: {'files': count, 'size': stats['languages_size'].get(lang, 0),
+                                     'largest': files(stats['largest_by_language'].get(lang, []))}
+                              for lang, count in sorted(stats['languages'].items(), key=lambda x: -x[1])},
+                'extensions': dict(stats['extensions']),
+                'largest_files': files(stats['largest_files']),
+                'largest_dirs': files(dirs.get('largest_dirs', [])),
+                'tree': dirs.get('tree'),
+            })
+        devices.append(entry)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'created': time.time(), 'devices': devices}, f, indent=1)
+
+def select_devices(data):
+    """
+    Picks the USB devices to report from device data: mounted ones and
+    unpartitioned ones, once each, smallest first.
+    """
     usb_devices = find_usb_devices(data)
     
     devices_to_report = []
@@ -273,10 +1860,6 @@ def main():
             unique_devices.append(d)
             seen_names.add(d['name'])
     
-    if not unique_devices:
-        print("No USB storage devices found.")
-        return
-
     def get_size(d):
         try:
             return int(d.get('size', 0) or 0)
@@ -284,31 +1867,239 @@ def main():
             return float('inf') 
 
     unique_devices.sort(key=get_size)
+    return unique_devices
 
-    print(f"Found {len(unique_devices)} USB device(s). Processing smallest to largest...\n")
-    time.sleep(1) 
-    
-    for i, dev in enumerate(unique_devices, 1):
-        print(f"[{i}/{len(unique_devices)}] Processing {dev.get('name')}...", flush=True)
-        
-        mountpoint = dev.get('mountpoint')
-        scan_stats = None
-        disk_usage = None
-        
-        if mountpoint and os.path.isdir(mountpoint):
-            try:
-                usage = shutil.disk_usage(mountpoint)
-                disk_usage = (usage.total, usage.used, usage.free)
-                scan_stats = analyze_directory(mountpoint)
-            except Exception as e:
-                print(f"Error accessing {mountpoint}: {e}")
-        
-        format_output(dev, scan_stats, disk_usage)
-        
-        if i < len(unique_devices):
-            print("Processing next device in 2 seconds...", end="", flush=True)
-            time.sleep(2)
-            print("\r" + " " * 40 + "\r", end="") # Clear line
+# Netlink family the kernel announces block devices coming and going on
+NETLINK_KOBJECT_UEVENT = 15
+
+# Seconds between looks for new devices in --watch mode when nothing wakes
+# it up, and the time a new device gets to settle (be mounted) after an event
+WATCH_INTERVAL = 5
+SETTLE_SECONDS = 1
+
+def open_uevent_socket():
+    """Subscribes to kernel uevents, or returns None where that isn't allowed."""
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, 1))
+        sock.setblocking(False)
+        return sock
+    except (AttributeError, OSError):
+        return None
+
+def mounted_changes(known, devices):
+    """
+    Compares the mounted devices among devices with the known set of
+    (name, uuid, mountpoint) keys. Returns (added devices, removed keys,
+    new known set).
+    """
+    current = {(d['name'], d.get('uuid'), d['mountpoint']): d for d in devices if d.get('mountpoint')}
+    added = [dev for key, dev in current.items() if key not in known]
+    removed = sorted(key for key in known if key not in current)
+    return added, removed, set(current)
+
+def watch_devices(scan, interval=WATCH_INTERVAL):
+    """
+    Waits for USB devices to be mounted and calls scan(devices, lsblk_data)
+    with each new batch, until interrupted. Wakes up on kernel uevents and
+    on changes to the mount table (which /proc/self/mountinfo signals with
+    POLLPRI), and looks anyway every interval seconds.
+    """
+    uevents = open_uevent_socket()
+    poller = select.poll()
+    if uevents:
+        poller.register(uevents, select.POLLIN)
+    try:
+        mountinfo = open('/proc/self/mountinfo', 'rb')
+        poller.register(mountinfo, select.POLLPRI)
+    except OSError:
+        mountinfo = None
+
+    data = get_drive_info()
+    _, _, known = mounted_changes(set(), select_devices(data) if data else [])
+    print(f"Watching for USB devices ({len(known)} already mounted). Press Ctrl-C to stop.\n", flush=True)
+    try:
+        while True:
+            if poller.poll(interval * 1000):
+                time.sleep(SETTLE_SECONDS)
+                while uevents:
+                    try:
+                        uevents.recv(65536)
+                    except OSError:
+                        break
+            data = get_drive_info()
+            if not data:
+                continue
+            added, removed, known = mounted_changes(known, select_devices(data))
+            for name, _, mountpoint in removed:
+                print(f"\033[1;33mRemoved:\033[0m {name} ({mountpoint})")
+            if added:
+                print(f"\033[1;32mNew:\033[0m {', '.join(d['name'] for d in added)}\n", flush=True)
+                scan(added, data)
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+    finally:
+        if uevents:
+            uevents.close()
+        if mountinfo:
+            mountinfo.close()
+
+def parse_size(text):
+    """Parses a size like 4096, 500M or 1.5T (powers of 1024) into bytes."""
+    units = 'KMGTP'
+    text = text.strip().upper().rstrip('IB') or '0'
+    try:
+        if text[-1] in units:
+            return int(float(text[:-1]) * 1024 ** (units.index(text[-1]) + 1))
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="USB Device Discovery & Content Scanner")
+    parser.add_argument("-j", "--workers", type=int, default=SCAN_WORKERS,
+                        help=f"threads scanning a device (default: {SCAN_WORKERS})")
+    parser.add_argument("--full", action="store_true",
+                        help="list every directory again instead of trusting the last scan's index")
+    parser.add_argument("--sniff", action="store_true",
+                        help="classify files without a known extension by their first bytes")
+    parser.add_argument("--sniff-sample", type=float, metavar="RATE",
+                        help="with --sniff, read only this fraction of those files (e.g. 0.1)")
+    parser.add_argument("--sample", type=float, nargs="?", const=ESTIMATE_SECONDS, metavar="SECONDS",
+                        help="estimate each device's contents by sampling for this long instead of "
+                             f"scanning it all (default: {ESTIMATE_SECONDS}s)")
+    parser.add_argument("--sample-files", type=int, metavar="FILES",
+                        help="with --sample, also stop after listing this many files")
+    parser.add_argument("--exact-below", type=parse_size, default=EXACT_BELOW, metavar="SIZE",
+                        help="with --sample, scan devices using less than this exactly "
+                             f"(e.g. 500M, 2T; default: {human_readable_size(EXACT_BELOW)})")
+    parser.add_argument("--throughput", type=float, nargs="?", const=THROUGHPUT_SECONDS, metavar="SECONDS",
+                        help="after scanning, time sequential and random 4K reads of the largest files "
+                             f"for this long each (default: {THROUGHPUT_SECONDS}s)")
+    parser.add_argument("--write-test", type=parse_size, nargs="?", const=WRITE_BYTES, metavar="SIZE",
+                        help="with --throughput, also time writing a temporary file of this size "
+                             f"(default: {human_readable_size(WRITE_BYTES)})")
+    parser.add_argument("--tree", type=int, nargs="?", const=TREE_DEPTH, metavar="DEPTH",
+                        help="add up directory sizes and show the largest directories, keeping "
+                             f"DEPTH levels of the tree for --export (default: {TREE_DEPTH})")
+    parser.add_argument("--export", metavar="FILE",
+                        help="write the scan results, with the directory tree, to FILE as JSON")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and scan USB devices as they get mounted")
+    parser.add_argument("--dupes", nargs="*", metavar="PATH",
+                        help="find duplicate files across these paths (default: all mounted USB devices)")
+    parser.add_argument("--snapshot", nargs="*", metavar="PATH",
+                        help="hash every file and save a manifest of these paths (default: all mounted USB devices)")
+    parser.add_argument("--verify", nargs="*", metavar="PATH",
+                        help="check these paths against their last --snapshot (default: all mounted USB devices)")
+    parser.add_argument("--manifest", metavar="FILE",
+                        help="manifest file for a single --snapshot/--verify path (default: kept in the cache)")
+    parser.add_argument("--rehash", action="store_true",
+                        help="with --verify, hash files even if their size and mtime match")
+    parser.add_argument("--min-size", type=int, default=1,
+                        help="ignore files smaller than this many bytes when looking for duplicates")
+    parser.add_argument("--benchmark", type=int, nargs="?", const=1000000, metavar="FILES",
+                        help="time the scanner on a generated tree (default: 1000000 files)")
+    parser.add_argument("--bench-dir", help="where to generate the benchmark tree (default: $TMPDIR)")
+    args = parser.parse_args(argv)
+    if sum(mode is not None for mode in (args.dupes, args.snapshot, args.verify)) + args.watch > 1:
+        parser.error("--watch, --dupes, --snapshot and --verify can't be combined")
+    return args
+
+def scan_options(args):
+    """The sniff, sample, throughput and tree_depth arguments of scan_devices, from the command line."""
+    sniff = None
+    if args.sniff or args.sniff_sample:
+        sniff = min(max(args.sniff_sample or 1.0, 0.001), 1.0)
+    sample = None
+    if args.sample or args.sample_files:
+        sample = {'seconds': args.sample or ESTIMATE_SECONDS, 'max_files': args.sample_files,
+                  'exact_below': args.exact_below}
+    throughput = None
+    if args.throughput or args.write_test:
+        throughput = {'seconds': args.throughput or THROUGHPUT_SECONDS,
+                      'write_bytes': args.write_test or 0}
+    tree_depth = args.tree
+    if tree_depth is None and args.export:
+        tree_depth = TREE_DEPTH
+    return {'sniff': sniff, 'sample': sample, 'throughput': throughput, 'tree_depth': tree_depth}
+
+def run_manifests(roots, args):
+    """Snapshots or verifies each (mountpoint, uuid) in roots, as asked by args."""
+    if args.manifest and len(roots) != 1:
+        print("--manifest needs exactly one path to snapshot or verify.")
+        return
+    for root, uuid in roots:
+        path = args.manifest or manifest_path(root, uuid)
+        started = time.monotonic()
+        if args.snapshot is not None:
+            print(f"Snapshotting {root}...", flush=True)
+            manifest = snapshot_device(root, path, args.workers)
+            print(f"  {len(manifest['files'])} file(s) hashed in {time.monotonic() - started:.1f}s, "
+                  f"manifest saved to {path}\n")
+            continue
+        try:
+            manifest = load_manifest(path)
+        except FileNotFoundError:
+            print(f"No manifest for {root}: run with --snapshot first.\n")
+            continue
+        except ValueError as e:
+            print(f"Error: {e}\n")
+            continue
+        created = time.strftime('%Y-%m-%d %H:%M', time.localtime(manifest['created']))
+        print(f"Verifying {root} against the snapshot of {created}...", flush=True)
+        try:
+            report = verify_device(root, manifest, args.workers, args.rehash)
+        except ValueError as e:
+            print(f"Error: {e}\n")
+            continue
+        print_verify(report)
+        print(f"  Done in {time.monotonic() - started:.1f}s\n")
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.benchmark:
+        benchmark_scan(args.benchmark, args.bench_dir, sorted({1, 4, args.workers, 16}))
+        return
+
+    print_title()
+
+    if args.watch:
+        watch_devices(lambda devices, data: scan_devices(devices, data, args.workers, args.full,
+                                                         **scan_options(args)))
+        return
+
+    explicit = args.dupes or args.snapshot or args.verify
+    if explicit:
+        roots = [(path, None) for path in explicit]
+    else:
+        print("Searching for devices...\n")
+        data = get_drive_info()
+        if not data:
+            return
+        unique_devices = select_devices(data)
+        if not unique_devices:
+            print("No USB storage devices found.")
+            return
+        if args.dupes is None and args.snapshot is None and args.verify is None:
+            print(f"Found {len(unique_devices)} USB device(s). Scanning them all at once...\n")
+            results = scan_devices(unique_devices, data, args.workers, args.full, **scan_options(args))
+            if args.export:
+                export_scan(args.export, results)
+                print(f"Results written to {args.export}")
+            return
+        roots = [(d['mountpoint'], d.get('uuid')) for d in unique_devices if d.get('mountpoint')]
+
+    if args.snapshot is not None or args.verify is not None:
+        run_manifests(roots, args)
+        return
+
+    paths = [root for root, _ in roots]
+    print(f"Looking for duplicate files in {', '.join(paths)}...", flush=True)
+    started = time.monotonic()
+    groups = find_duplicates(paths, args.min_size, args.workers)
+    print(f"Done in {time.monotonic() - started:.1f}s\n")
+    print_duplicates(groups)
 
 if __name__ == "__main__":
     main()